@@ -1,26 +1,52 @@
 # Import necessary modules
 import os
 import random
-import nltk
+import bisect
+import csv
+import gzip
+import heapq
+import math
+import multiprocessing
+import queue
+import re
+import string
+import sys
+import tempfile
+import threading
+import time
+import zlib
 import logging
 import requests
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import date, datetime, timedelta, timezone
+from flask import Flask, Request, Response, g, has_request_context, stream_with_context, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+from markupsafe import escape
+from sqlalchemy import bindparam, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, defer, joinedload, make_transient_to_detached
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_paginate import Pagination, get_page_parameter
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Length, EqualTo, Email
 from flask_mail import Mail, Message as FlaskMessage
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-import matplotlib.pyplot as plt
-import numpy as np
-from io import BytesIO
+from io import BytesIO, StringIO, TextIOWrapper
 import base64
+import hashlib
+import json
+import click
 
-# Download NLTK data (if not already downloaded)
-nltk.download('punkt')
+# Importing this module must stay cheap: no network, no database and no plotting/NLP
+# stacks. Those load on first use, and setup steps are explicit CLI commands
+# (`flask init-db`, `flask download-nltk-data`).
 
 app = Flask(__name__)
 
@@ -29,14 +55,88 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_default_secret_key
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///messages.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['RESULTS_PER_PAGE'] = 5  # Number of messages per page
+app.config['HISTORY_MAX_PAGE_SIZE'] = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 100))  # Largest history page served
+app.config['HISTORY_STREAM_ENABLED'] = os.environ.get('HISTORY_STREAM_ENABLED', '0') == '1'  # Each open stream holds a worker thread
+app.config['HISTORY_STREAM_KEEPALIVE'] = int(os.environ.get('HISTORY_STREAM_KEEPALIVE', 15))  # Seconds between SSE keepalives (and catch-ups on other processes' messages)
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'auto')  # 'auto', 'fts5' or 'memory'
+app.config['SEARCH_MAX_RESULTS'] = int(os.environ.get('SEARCH_MAX_RESULTS', 50))
+app.config['BATCH_MAX_MESSAGES'] = int(os.environ.get('BATCH_MAX_MESSAGES', 500))  # Messages per batch request
+app.config['SPECIAL_MOMENTS_MAX_LENGTH'] = int(os.environ.get('SPECIAL_MOMENTS_MAX_LENGTH', 2000))  # Characters per message request
+app.config['EXPORT_CHUNK_SIZE'] = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))  # Rows fetched and encoded at a time
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))  # Rows inserted per transaction
+app.config['IMPORT_MAX_ERRORS'] = 20  # Rejected rows described in an import summary
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = os.environ.get('MAIL_PORT', 587)
 app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', True)
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@romancegpt.com')
+app.config['MESSAGE_QUOTES'] = os.environ.get('MESSAGE_QUOTES', 'local')  # 'local' quote pool or the quote 'api'
+app.config['COMPOSER_SEED'] = int(os.environ.get('COMPOSER_SEED', 0))  # Same seed and inputs, same message
+app.config['COMPOSER_CACHE_SIZE'] = int(os.environ.get('COMPOSER_CACHE_SIZE', 4096))  # Analyses and messages memoized
 app.config['QUOTE_API_URL'] = 'https://quotes.rest/qod?category=love'
+app.config['QUOTE_API_TIMEOUT'] = float(os.environ.get('QUOTE_API_TIMEOUT', 2.0))  # Seconds
+app.config['QUOTE_CACHE_TTL'] = int(os.environ.get('QUOTE_CACHE_TTL', 6 * 60 * 60))  # Seconds a quote stays fresh
+app.config['QUOTE_CACHE_SIZE'] = int(os.environ.get('QUOTE_CACHE_SIZE', 32))  # Max quotes kept in memory
+app.config['QUOTE_REFRESH_INTERVAL'] = int(os.environ.get('QUOTE_REFRESH_INTERVAL', 60 * 60))  # Background refresh period
+app.config['SOCIAL_SHARE_URL'] = os.environ.get('SOCIAL_SHARE_URL', 'https://api.example.com/share')
+app.config['SHARE_QUEUE_BACKEND'] = os.environ.get('SHARE_QUEUE_BACKEND', 'database')  # 'database' or 'memory'
+app.config['SHARE_WORKER_ENABLED'] = os.environ.get('SHARE_WORKER_ENABLED', '1') == '1'
+app.config['SHARE_WORKERS'] = int(os.environ.get('SHARE_WORKERS', 4))  # Concurrent share requests per process
+app.config['SHARE_MAX_ATTEMPTS'] = int(os.environ.get('SHARE_MAX_ATTEMPTS', 5))  # Attempts before a share fails
+app.config['SHARE_RETRY_BACKOFF'] = float(os.environ.get('SHARE_RETRY_BACKOFF', 10))  # Seconds, doubled per attempt
+app.config['SHARE_POLL_INTERVAL'] = float(os.environ.get('SHARE_POLL_INTERVAL', 2))  # Seconds between idle polls
+app.config['SHARE_LEASE'] = int(os.environ.get('SHARE_LEASE', 120))  # Seconds before an unfinished claim is retried
+app.config['SHARE_RATE_LIMITS'] = {'default': (5.0, 5)}  # Provider -> (requests per second, burst)
+app.config['OUTBOUND_CONNECT_TIMEOUT'] = float(os.environ.get('OUTBOUND_CONNECT_TIMEOUT', 2.0))  # Seconds
+app.config['OUTBOUND_READ_TIMEOUT'] = float(os.environ.get('OUTBOUND_READ_TIMEOUT', 5.0))  # Seconds
+app.config['OUTBOUND_RETRIES'] = int(os.environ.get('OUTBOUND_RETRIES', 2))  # Extra attempts for idempotent requests
+app.config['OUTBOUND_RETRY_BACKOFF'] = float(os.environ.get('OUTBOUND_RETRY_BACKOFF', 0.2))  # Seconds, doubled per attempt
+app.config['OUTBOUND_POOL_SIZE'] = int(os.environ.get('OUTBOUND_POOL_SIZE', 20))  # Keep-alive connections per host
+app.config['OUTBOUND_BREAKER_THRESHOLD'] = int(os.environ.get('OUTBOUND_BREAKER_THRESHOLD', 5))  # Failures before failing fast
+app.config['OUTBOUND_BREAKER_RESET'] = float(os.environ.get('OUTBOUND_BREAKER_RESET', 30.0))  # Seconds before a probe
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_SIZE', 25 * 1024 * 1024))  # Bytes per image
+app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_SIZE'] + 64 * 1024  # Room for the multipart envelope
+app.config['UPLOAD_CHUNK_SIZE'] = 64 * 1024  # Bytes read, hashed and written at a time
+app.config['THUMBNAIL_SIZES'] = (128, 512)  # Longest edge, in pixels
+app.config['THUMBNAIL_WORKERS'] = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+app.config['UPLOAD_CACHE_MAX_AGE'] = 365 * 24 * 60 * 60  # Content-addressed files never change
+app.config['CHART_CACHE_SIZE'] = int(os.environ.get('CHART_CACHE_SIZE', 128))  # Rendered charts kept in memory
+app.config['CHART_MAX_DAYS'] = 365  # Longest messages-per-day chart
+app.config['NLTK_DATA_PATH'] = os.environ.get('NLTK_DATA_PATH', os.path.join(app.root_path, 'nltk_data'))  # Vendored NLTK data
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')  # Werkzeug method, iterations included
+app.config['PASSWORD_SALT_LENGTH'] = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', os.cpu_count() or 1))  # Hashing processes; 0 hashes inline
+app.config['PASSWORD_MAX_PENDING'] = int(os.environ.get('PASSWORD_MAX_PENDING', 8))  # Requests waiting on a hash before new ones get a 503
+app.config['PASSWORD_TIMEOUT'] = float(os.environ.get('PASSWORD_TIMEOUT', 10))  # Seconds a request waits for its hash
+app.config['LOGIN_RATE_PER_IP'] = (2.0, 20)  # Login attempts per second and burst, per client IP
+app.config['LOGIN_RATE_PER_USER'] = (0.2, 5)  # Login attempts per second and burst, per username
+app.config['LOGIN_THROTTLE_KEYS'] = 10000  # Client IPs and usernames tracked per throttle
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 10))  # Seconds a loaded user is reused across requests
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 10000))  # Users kept in memory
+app.config['RECORD_QUERY_COUNTS'] = os.environ.get('RECORD_QUERY_COUNTS', '0') == '1'  # X-DB-Queries response header
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'  # Prometheus metrics at /metrics
+app.config['PROFILE_ENABLED'] = os.environ.get('PROFILE_ENABLED', '0') == '1'  # Sample request stacks, keep the slowest
+app.config['PROFILE_INTERVAL'] = float(os.environ.get('PROFILE_INTERVAL', 0.005))  # Seconds between stack samples
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 10))  # Slowest request profiles kept on disk
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['OCCASION_SCHEDULER_ENABLED'] = os.environ.get('OCCASION_SCHEDULER_ENABLED', '1') == '1'
+app.config['OCCASION_TICK_INTERVAL'] = int(os.environ.get('OCCASION_TICK_INTERVAL', 60))  # Seconds between scheduler ticks
+app.config['OCCASION_REMIND_DAYS'] = int(os.environ.get('OCCASION_REMIND_DAYS', 1))  # Days ahead a reminder goes out (under a year)
+app.config['OCCASION_BATCH_SIZE'] = int(os.environ.get('OCCASION_BATCH_SIZE', 500))  # Reminders generated per transaction
+app.config['UPCOMING_OCCASIONS_LIMIT'] = 20  # Occasions listed on /special_occasions
+app.config['GIFT_RECOMMENDATIONS'] = int(os.environ.get('GIFT_RECOMMENDATIONS', 10))  # Gifts recommended per user
+app.config['GIFT_CACHE_TTL'] = int(os.environ.get('GIFT_CACHE_TTL', 300))  # Seconds a user's recommendations are reused
+app.config['GIFT_CACHE_SIZE'] = int(os.environ.get('GIFT_CACHE_SIZE', 10000))  # Users' recommendations kept in memory
+app.config['GIFT_CATALOG_CHECK_INTERVAL'] = int(os.environ.get('GIFT_CATALOG_CHECK_INTERVAL', 30))  # Seconds between catalog change checks
+app.config['GIFT_WEIGHTS'] = {'category': 3.0, 'color': 1.5, 'attribute': 1.0, 'popularity': 0.5}  # Score per matching preference
+app.config['OUTBOX_WORKER_ENABLED'] = os.environ.get('OUTBOX_WORKER_ENABLED', '1') == '1'
+app.config['OUTBOX_BATCH_SIZE'] = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))  # Emails sent per SMTP connection
+app.config['OUTBOX_MAX_ATTEMPTS'] = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))  # Attempts before dead-lettering
+app.config['OUTBOX_RETRY_BACKOFF'] = int(os.environ.get('OUTBOX_RETRY_BACKOFF', 30))  # Seconds, doubled per attempt
+app.config['OUTBOX_POLL_INTERVAL'] = int(os.environ.get('OUTBOX_POLL_INTERVAL', 5))  # Seconds between idle polls
+app.config['OUTBOX_LEASE'] = int(os.environ.get('OUTBOX_LEASE', 300))  # Seconds before an unfinished claim is retried
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 # Configure Flask-Login
@@ -58,10 +158,13 @@ db = SQLAlchemy(app)
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
-    password = db.Column(db.String(100), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    messages = db.relationship('Message', backref='user', lazy=True)
+    messages = db.relationship('Message', backref='user', lazy='dynamic')
     is_admin = db.Column(db.Boolean, default=False)
+    # Bumped whenever a message is added; drives history ETags
+    history_version = db.Column(db.Integer, default=0, nullable=False)
+    statistics = db.relationship('UserStatistics', uselist=False)
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -69,42 +172,926 @@ class Message(db.Model):
     girlfriend_name = db.Column(db.String(100), nullable=False)
     romantic_message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Serves newest-first history pages per user without sorting
+    __table_args__ = (db.Index('ix_message_user_timestamp_id', 'user_id', 'timestamp', 'id'),)
+
+# Outgoing notification emails, written in the same transaction as the row they describe
+class OutboxEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent or dead
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime)
+    __table_args__ = (db.Index('ix_outbox_email_due', 'status', 'next_attempt_at'),)
+
+# Dates to remember (birthdays, anniversaries), one-off or recurring yearly. next_occurs_on is
+# the next date to send a reminder for, or NULL once a one-off has passed; the scheduler moves it
+# forward as it fires, so its index only ever holds rows that are due or in the future.
+class Occasion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    girlfriend_name = db.Column(db.String(100), nullable=False)
+    special_moments = db.Column(db.Text, default='', nullable=False)
+    occurs_on = db.Column(db.Date, nullable=False)  # The first occurrence
+    recurrence = db.Column(db.String(10), default='yearly', nullable=False)  # yearly or once
+    next_occurs_on = db.Column(db.Date)
+    last_reminded_on = db.Column(db.Date)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    __table_args__ = (db.Index('ix_occasion_next_occurs_on', 'next_occurs_on', 'id'),
+                      db.Index('ix_occasion_user_next_occurs_on', 'user_id', 'next_occurs_on'))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "girlfriend_name": self.girlfriend_name,
+            "special_moments": self.special_moments,
+            "recurrence": self.recurrence,
+            "date": self.next_occurs_on.isoformat() if self.next_occurs_on else None,
+        }
+
+# Gift catalog. Items are retired (active=False) rather than deleted; updated_at and the item
+# count tell processes when to rebuild their recommendation index.
+class GiftItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64), unique=True, nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    color = db.Column(db.String(30))
+    attributes = db.Column(db.String(500), default='', nullable=False)  # Comma-separated, e.g. "handmade,personalized"
+    price = db.Column(db.Float)
+    popularity = db.Column(db.Float, default=0.0, nullable=False)  # 0 to 1
+    active = db.Column(db.Boolean, default=True, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
+
+# What a user is looking for in a gift; each list is comma-separated, most preferred first
+class GiftPreferences(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    categories = db.Column(db.String(500), default='', nullable=False)
+    colors = db.Column(db.String(500), default='', nullable=False)
+    attributes = db.Column(db.String(500), default='', nullable=False)
+    max_price = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+# Per-user message counters, maintained in the same transaction as message inserts
+class UserStatistics(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_messages = db.Column(db.Integer, default=0, nullable=False)
+
+# Messages per user, UTC day and recipient; rolling windows are summed from these
+class MessageDailyCount(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    girlfriend_name = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+# Uploaded images, stored once per distinct content under their SHA-256
+class ImageUpload(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    extension = db.Column(db.String(10), nullable=False)
+    original_name = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    @property
+    def filename(self):
+        return f"{self.sha256}.{self.extension}"
+
+# Social media shares, processed in the background; status is queued, sending, sent or failed
+class ShareJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    message = db.relationship('Message')
+    provider = db.Column(db.String(50), default='default', nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    __table_args__ = (db.Index('ix_share_job_due', 'status', 'next_attempt_at'),)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "message_id": self.message_id,
+            "provider": self.provider,
+            "status": self.status,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "updated_at": self.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+# Flask-Login user loading. Users are cached per process as snapshots of their column values,
+# keyed by id, for `ttl` seconds and at most `max_entries`; a hit is merged into the request's
+# session without a query. The password hash is deferred and only loaded by the few views
+# that need it. Entries are dropped after any commit that changes the user row (password,
+# admin flag, history version) and on logout; other processes see such changes once their
+# own entry expires, so the TTL is kept short. History ETags don't wait for that: they read
+# the version from the row.
+class UserCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, user):
+        unloaded = inspect(user).unloaded
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns if column.key not in unloaded}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+user_cache = UserCache(app.config['USER_CACHE_TTL'], app.config['USER_CACHE_SIZE'])
+
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    values = user_cache.get(user_id)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    # One round trip: the user plus the statistics row get_message_statistics reads
+    user = User.query.options(defer(User.password), joinedload(User.statistics)).filter_by(id=user_id).first()
+    if user is not None:
+        user_cache.put(user)
+    return user
+
+# Note a user row change (e.g. a bulk UPDATE the session doesn't track); the cached user is dropped on commit
+def mark_user_changed(session, user_id):
+    session.info.setdefault("changed_user_ids", set()).add(user_id)
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_users(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            mark_user_changed(session, obj.id)
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        user_cache.invalidate(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed_users(session):
+    session.info.pop("changed_user_ids", None)
 
 # Create database tables (run this once to initialize the database)
-db.create_all()
+@app.cli.command("init-db")
+def init_db_command():
+    """Create the database tables."""
+    db.create_all()
+    message_search.rebuild()
+    click.echo("Initialized the database.")
+
+# NLTK is only needed for message composition; load it, with the vendored data path, on first use
+_nltk = None
+
+def load_nltk():
+    global _nltk
+    if _nltk is None:
+        import nltk
+        if app.config['NLTK_DATA_PATH'] not in nltk.data.path:
+            nltk.data.path.insert(0, app.config['NLTK_DATA_PATH'])
+        _nltk = nltk
+    return _nltk
+
+# Download NLTK data into the vendored path (once, at build time)
+@app.cli.command("download-nltk-data")
+def download_nltk_data_command():
+    """Download the NLTK data the app uses into NLTK_DATA_PATH."""
+    nltk = load_nltk()
+    if not nltk.download('punkt', download_dir=app.config['NLTK_DATA_PATH']):
+        raise click.ClickException("Could not download NLTK data.")
+    click.echo(f"Downloaded NLTK data to {app.config['NLTK_DATA_PATH']}.")
+
+# Outbound HTTP: one pooled client shared by every integration (quote API, social sharing)
+class CircuitOpenError(requests.ConnectionError):
+    pass
+
+# Per-host circuit breaker: after `failure_threshold` consecutive failures, calls fail fast
+# for `reset_timeout` seconds, then a single probe decides whether the host is back.
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half-open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+# Cumulative latency histogram with fixed buckets, in seconds
+class LatencyHistogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.counts[index] += 1
+                    break
+            self.count += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.BUCKETS, self.counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+class OutboundClient:
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+    def __init__(self, connect_timeout, read_timeout, retries, backoff, pool_size, failure_threshold, reset_timeout):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._breakers = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[host]
+
+    def histogram(self, host):
+        with self._lock:
+            if host not in self._histograms:
+                self._histograms[host] = LatencyHistogram()
+            return self._histograms[host]
+
+    def latency_snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {host: histogram.snapshot() for host, histogram in histograms.items()}
+
+    # Send a request with pooled connections, timeouts, jittered retries and circuit breaking.
+    # Retries cover connection errors, timeouts and 5xx/429 responses; non-idempotent
+    # methods are only retried when `retry=True` is passed.
+    def request(self, method, url, retry=None, **kwargs):
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        histogram = self.histogram(host)
+        kwargs.setdefault("timeout", self.timeout)
+        if retry is None:
+            retry = method.upper() in self.IDEMPOTENT_METHODS
+        attempts = self.retries + 1 if retry else 1
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {host}")
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                response, error = None, e
+            histogram.observe(time.monotonic() - start)
+
+            if response is not None and response.status_code < 500 and response.status_code != 429:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt + 1 < attempts:
+                # Full jitter keeps retrying workers from hitting the host in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        if response is not None:
+            return response
+        raise error
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+outbound_client = OutboundClient(
+    connect_timeout=app.config['OUTBOUND_CONNECT_TIMEOUT'],
+    read_timeout=app.config['OUTBOUND_READ_TIMEOUT'],
+    retries=app.config['OUTBOUND_RETRIES'],
+    backoff=app.config['OUTBOUND_RETRY_BACKOFF'],
+    pool_size=app.config['OUTBOUND_POOL_SIZE'],
+    failure_threshold=app.config['OUTBOUND_BREAKER_THRESHOLD'],
+    reset_timeout=app.config['OUTBOUND_BREAKER_RESET'],
+)
+
+# Instrumentation: per-route latency, per-request query counts and durations, and timed spans,
+# exposed in Prometheus text format at /metrics. Durations reuse LatencyHistogram; timings
+# are taken in after_request, so a streamed body's own time isn't included.
+METRIC_HELP = {
+    "http_request_duration_seconds": ("histogram", "Request latency by route and method"),
+    "http_requests_total": ("counter", "Requests by route, method and status"),
+    "db_queries_total": ("counter", "SQL statements executed by route"),
+    "db_query_duration_seconds": ("histogram", "Total SQL time per request by route"),
+    "span_duration_seconds": ("histogram", "Timed spans inside requests and workers"),
+    "outbound_request_duration_seconds": ("histogram", "Outbound HTTP latency by host"),
+    "cache_requests_total": ("counter", "In-process cache lookups by cache and result"),
+}
+
+class Metrics:
+    def __init__(self):
+        self._histograms = {}  # (name, labels) -> LatencyHistogram
+        self._counters = {}  # (name, labels) -> value
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        return {key: histogram.snapshot() for key, histogram in histograms.items()}, counters
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+metrics = Metrics()
+
+def format_metric_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+# Prometheus text exposition (version 0.0.4) of everything recorded, plus outbound and cache stats
+def render_metrics():
+    histograms, counters = metrics.snapshot()
+    for host, snapshot in outbound_client.latency_snapshot().items():
+        histograms[("outbound_request_duration_seconds", (("host", host),))] = snapshot
+    for cache_name, cache in (("quote", quote_cache), ("user", user_cache), ("chart", chart_cache),
+                              ("composer", message_composer), ("gift", gift_recommender)):
+        for result, value in dict(cache.stats).items():
+            counters[("cache_requests_total", (("cache", cache_name), ("result", result)))] = value
+
+    lines = []
+    for name, (kind, description) in METRIC_HELP.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        if kind == "counter":
+            lines += [f"{name}{format_metric_labels(labels)} {value}"
+                      for (metric, labels), value in sorted(counters.items()) if metric == name]
+            continue
+        for (metric, labels), snapshot in sorted(histograms.items(), key=lambda item: item[0]):
+            if metric != name:
+                continue
+            for bound, count in snapshot["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', le),))} {count}")
+            lines.append(f"{name}_sum{format_metric_labels(labels)} {snapshot['sum']}")
+            lines.append(f"{name}_count{format_metric_labels(labels)} {snapshot['count']}")
+    return "\n".join(lines) + "\n"
+
+# Time a block (or, as a decorator, a function) as a named span. Spans inside a request are
+# also kept on the request, and written out with its profile if it is among the slowest.
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("span_duration_seconds", elapsed, span=name)
+        if has_request_context():
+            g.setdefault("spans", []).append((name, elapsed))
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context, so a statement that raises leaves nothing behind
+    context._query_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    if has_request_context():
+        g.db_queries = g.get("db_queries", 0) + 1
+        g.db_query_time = g.get("db_query_time", 0.0) + elapsed
+
+def request_query_count():
+    return g.get("db_queries", 0)
+
+# Opt-in sampling profiler (PROFILE_ENABLED). One thread samples the stacks of in-flight
+# requests every PROFILE_INTERVAL seconds; the PROFILE_KEEP slowest requests are written to
+# PROFILE_DIR in collapsed-stack format (one "frame;frame;frame count" line per stack,
+# as flame graph tools read), with the request's spans in the header.
+class SamplingProfiler:
+    def __init__(self, interval, keep, directory):
+        self.interval = interval
+        self.keep = keep
+        self.directory = directory
+        self._active = {}  # thread id -> Counter of collapsed stacks
+        self._slowest = []  # heap of (seconds, path)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def end(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                active = list(self._active.items())
+            for ident, samples in active:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    # Only while the request is still active: once end() has handed its
+                    # samples over, record() reads them without the lock
+                    with self._lock:
+                        if self._active.get(ident) is samples:
+                            samples[";".join(reversed(stack))] += 1
+
+    # Keep the profile if the request is among the slowest seen; returns the file written, if any
+    def record(self, seconds, label, samples, spans):
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')}.txt")
+            evicted = heapq.heappushpop(self._slowest, (seconds, path)) if len(self._slowest) >= self.keep else None
+            if evicted is None:
+                heapq.heappush(self._slowest, (seconds, path))
+        with open(path, "w") as profile:
+            profile.write(f"# {label} {seconds * 1000:.1f}ms\n")
+            for name, elapsed in spans:
+                profile.write(f"# span {name} {elapsed * 1000:.1f}ms\n")
+            for stack, count in samples.most_common():
+                profile.write(f"{stack} {count}\n")
+        if evicted is not None and os.path.exists(evicted[1]):
+            os.remove(evicted[1])
+        return path
+
+profiler = SamplingProfiler(app.config['PROFILE_INTERVAL'], app.config['PROFILE_KEEP'], app.config['PROFILE_DIR'])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if app.config['PROFILE_ENABLED']:
+        profiler.begin()
+
+@app.after_request
+def record_request_metrics(response):
+    if "request_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("http_request_duration_seconds", elapsed, route=route, method=request.method)
+    metrics.inc("http_requests_total", route=route, method=request.method, status=response.status_code)
+    metrics.inc("db_queries_total", request_query_count(), route=route)
+    metrics.observe("db_query_duration_seconds", g.get("db_query_time", 0.0), route=route)
+    if app.config['PROFILE_ENABLED']:
+        samples = profiler.end()
+        if samples is not None:
+            profiler.record(elapsed, f"{request.method} {request.path}", samples, g.get("spans", []))
+    if app.config['RECORD_QUERY_COUNTS']:
+        response.headers["X-DB-Queries"] = str(request_query_count())
+    return response
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+# Local pool of love quotes used until (or whenever) the quote API can't be reached
+FALLBACK_QUOTES = [
+    "You make every moment special",
+    "Every love story is beautiful, but ours is my favorite",
+    "I love you not only for what you are, but for what I am when I am with you",
+    "In all the world, there is no heart for me like yours",
+    "You are my today and all of my tomorrows",
+    "Whatever our souls are made of, yours and mine are the same",
+]
+
+# Process-wide cache of love quotes fetched from the quote API.
+# Requests are always served from memory: fresh quotes while they are within
+# their TTL, stale ones while a background refresh is in flight, and the local
+# fallback pool when nothing has been fetched yet.
+class QuoteCache:
+    def __init__(self, url, ttl, max_size, refresh_interval, timeout, fallback_quotes=FALLBACK_QUOTES, client=None):
+        self.url = url
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.fallback_quotes = list(fallback_quotes)
+        self.client = client or outbound_client
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+        self._entries = OrderedDict()  # quote -> time it was fetched
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def get_quote(self):
+        now = time.monotonic()
+        with self._lock:
+            fresh = [quote for quote, fetched_at in self._entries.items() if now - fetched_at < self.ttl]
+            if fresh:
+                self.stats["hits"] += 1
+                return random.choice(fresh)
+            if self._entries:
+                # Stale-while-revalidate: serve what we have and refresh behind the request
+                self.stats["stale_hits"] += 1
+                quote = random.choice(list(self._entries))
+            else:
+                self.stats["misses"] += 1
+                quote = random.choice(self.fallback_quotes)
+        self.refresh_async()
+        return quote
+
+    def refresh(self):
+        try:
+            response = self.client.get(self.url, timeout=(self.client.timeout[0], self.timeout))
+            response.raise_for_status()
+            quote = response.json()['contents']['quotes'][0]['quote'].strip().rstrip('.')
+        except Exception as e:
+            logging.error(f"Error fetching quote from API: {str(e)}")
+            with self._lock:
+                self.stats["refresh_errors"] += 1
+            return False
+        with self._lock:
+            self._entries.pop(quote, None)
+            self._entries[quote] = time.monotonic()
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self.stats["refreshes"] += 1
+        return True
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="quote-refresh", daemon=True).start()
+
+    def start(self):
+        # Refresh periodically so quotes are swapped in before they expire
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._refresh_loop, name="quote-refresher", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            refresher.join()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.refresh_interval)
+
+quote_cache = QuoteCache(
+    app.config['QUOTE_API_URL'],
+    ttl=app.config['QUOTE_CACHE_TTL'],
+    max_size=app.config['QUOTE_CACHE_SIZE'],
+    refresh_interval=app.config['QUOTE_REFRESH_INTERVAL'],
+    timeout=app.config['QUOTE_API_TIMEOUT'],
+)
+
+# In-process message composition. The special moments are split into moments (short clauses)
+# ranked by their key phrases (RAKE: runs of content words scored by word degree / frequency),
+# plus the names of places and people among those phrases, and a precompiled template is
+# filled with them. The template, moments and quote are picked from
+# a hash of the inputs and a seed, so a message is fully determined by (name, moments, seed),
+# and both the text analysis and whole messages are memoized. Tokenizers load once per process.
+MESSAGE_TEMPLATES = [
+    "{name}, {quote}. Our love grows stronger every day.",
+    "{name}, every day with you feels like a gift. {quote}.",
+    "My dearest {name}, I'm so lucky to have you. {quote}.",
+    "{name}, I keep coming back to {moment}. {quote}.",
+    "My dearest {name}, every time I think about {moment}, I fall for you all over again.",
+    "{name}, I still smile when I remember {moment}. Our love grows stronger every day.",
+    "Dear {name}, thank you for {moment}. {quote}.",
+    "{name}, {moment} is one of my favorite memories, and I can't wait to make a thousand more with you.",
+    "{name}, from {moment} to {moment2}, every memory with you is my favorite.",
+    "{name}, {moment} and {moment2}: I treasure every moment we share. {quote}.",
+    "{name}, I'll never think of {keyword} the same way again. {quote}.",
+    "{name}, {keyword} will always remind me of you. Our love grows stronger every day.",
+]
+STOPWORDS = frozenset("""
+    a about after again all also am an and any are as at be because been before being between both but by
+    can could did do does doing down during each even ever every few for from further had has have having
+    he her here hers herself him himself his how i if in into is it its itself just let me more most my
+    myself no nor not now of off on once only or other our ours ourselves out over own really same she
+    should so some such than that the their theirs them themselves then there these they this those
+    through to too under until up very was we were what when where which while who whom why will with
+    would you your yours yourself yourselves
+""".split())
+MOMENT_SEPARATORS = re.compile(r"\s*(?:[,;:!?]|\.(?=\s|$)|\band\b|\bthen\b)\s*", re.IGNORECASE)
+
+class MessageComposer:
+    def __init__(self, templates, quotes, cache_size):
+        # Precompiled: (literal, field) pairs, and the set of fields each template needs
+        formatter = string.Formatter()
+        self.templates = [[(literal, field) for literal, field, _, _ in formatter.parse(template)]
+                          for template in templates]
+        self.template_fields = [frozenset(field for _, field in parts if field) for parts in self.templates]
+        self.quotes = list(quotes)
+        self.analyze = lru_cache(maxsize=cache_size)(self._analyze)
+        self._compose = lru_cache(maxsize=cache_size)(self._compose_uncached)
+        self._tokenizers = None
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        analyze, compose = self.analyze.cache_info(), self._compose.cache_info()
+        return {"hits": analyze.hits + compose.hits, "misses": analyze.misses + compose.misses}
+
+    def clear(self):
+        self.analyze.cache_clear()
+        self._compose.cache_clear()
+
+    # Sentence splitter (punkt, when its data is installed) and word tokenizer, loaded once
+    def tokenizers(self):
+        with self._lock:
+            if self._tokenizers is None:
+                nltk = load_nltk()
+                try:
+                    split_sentences = nltk.data.load("tokenizers/punkt/english.pickle").tokenize
+                except LookupError:
+                    split_sentences = lambda text: re.split(r"(?<=[.!?])\s+", text)
+                self._tokenizers = (split_sentences, nltk.tokenize.TreebankWordTokenizer().tokenize)
+            return self._tokenizers
 
-# Function to generate a more varied romantic message using real-time data from the "They Said So" Quotes API
+    # Moments (clauses) and named key phrases of a special-moments text, best first
+    def _analyze(self, special_moments):
+        split_sentences, tokenize = self.tokenizers()
+        phrases = []
+        names = set()  # Capitalized phrases past the start of a sentence: places, people
+        moments = []
+        for sentence in split_sentences(special_moments.strip()):
+            phrase = []
+            for position, token in enumerate(tokenize(sentence) + [""]):
+                if token.isalpha() and token.lower() not in STOPWORDS:
+                    phrase.append(token)
+                    continue
+                if phrase:
+                    phrases.append(tuple(phrase))
+                    if position > len(phrase) and all(word[0].isupper() for word in phrase):
+                        names.add(" ".join(phrase))
+                    phrase = []
+            for clause in MOMENT_SEPARATORS.split(sentence):
+                words = clause.split()
+                if words and any(word.isalpha() and word.lower() not in STOPWORDS for word in words):
+                    if words[0].lower() in STOPWORDS:
+                        words[0] = words[0].lower()
+                    moments.append(" ".join(words))
+
+        frequency = Counter()
+        degree = Counter()
+        for phrase in phrases:
+            for word in phrase:
+                frequency[word.lower()] += 1
+                degree[word.lower()] += len(phrase)
+        def score(words):
+            return sum(degree[word] / frequency[word] for word in map(str.lower, words) if word in frequency)
+
+        ranked = sorted(dict.fromkeys(" ".join(phrase) for phrase in phrases), key=lambda p: -score(p.split()))
+        moments = sorted(dict.fromkeys(moments), key=lambda m: -score(m.split()))
+        return tuple(moments[:3]), tuple(phrase for phrase in ranked if phrase in names)[:3]
+
+    def compose(self, girlfriend_name, special_moments="", seed=0, quote=None):
+        return self._compose(str(girlfriend_name), str(special_moments or "").strip(), str(seed), quote)
+
+    def _compose_uncached(self, girlfriend_name, special_moments, seed, quote):
+        moments, keywords = self.analyze(special_moments) if special_moments else ((), ())
+        digest = int.from_bytes(hashlib.blake2b(f"{seed}|{girlfriend_name}|{special_moments}".encode(),
+                                                digest_size=8).digest(), "big")
+        values = {"name": girlfriend_name, "quote": quote or self.quotes[digest % len(self.quotes)]}
+        if moments:
+            first = (digest >> 8) % min(len(moments), 2)
+            values["moment"] = moments[first]
+            if len(moments) > 1:
+                values["moment2"] = moments[1 - first]
+        if keywords:
+            values["keyword"] = keywords[(digest >> 16) % len(keywords)]
+
+        # With moments to use, only templates that use them; otherwise only those that don't
+        personal = {"moment", "moment2", "keyword"}
+        candidates = [index for index, fields in enumerate(self.template_fields)
+                      if fields <= values.keys() and bool(fields & personal) == bool(moments or keywords)]
+        parts = self.templates[candidates[(digest >> 24) % len(candidates)]]
+        return "".join(literal + (values[field] if field else "") for literal, field in parts)
+
+message_composer = MessageComposer(MESSAGE_TEMPLATES, FALLBACK_QUOTES, app.config['COMPOSER_CACHE_SIZE'])
+
+# Quote for a new message: None lets the composer pick from its local pool; MESSAGE_QUOTES='api'
+# uses the (never blocking) quote API cache instead
+def message_quote():
+    if app.config['MESSAGE_QUOTES'] != 'api':
+        return None
+    quote_cache.start()
+    return quote_cache.get_quote()
+
+# Function to generate a romantic message around the special moments, composed in-process
+@span("generate_romantic_message")
 def generate_romantic_message(girlfriend_name, special_moments):
     if not girlfriend_name:
         girlfriend_name = "My Love"  # Use a default if girlfriend_name is not provided
 
-    try:
-        # Fetch real-time love quote from the "They Said So" Quotes API
-        response = requests.get(app.config['QUOTE_API_URL'])
-        quote_data = response.json()
-        quote = quote_data['contents']['quotes'][0]['quote']
-    except Exception as e:
-        logging.error(f"Error fetching quote from API: {str(e)}")
-        quote = "You make every moment special."
-
-    # Construct the romantic message
-    romantic_message = f"{girlfriend_name}, {quote}. Our love grows stronger every day."
+    # Construct the romantic message; the history version varies it between generations
+    with span("generate_romantic_message.compose"):
+        seed = f"{app.config['COMPOSER_SEED']}:{current_user.id}:{current_user.history_version}"
+        romantic_message = message_composer.compose(girlfriend_name, special_moments, seed=seed, quote=message_quote())
 
     # Save the message in the database
-    new_message = Message(user=current_user, girlfriend_name=girlfriend_name, romantic_message=romantic_message)
+    timestamp = datetime.utcnow()
+    new_message = Message(user=current_user, girlfriend_name=girlfriend_name, romantic_message=romantic_message, timestamp=timestamp)
     db.session.add(new_message)
-    db.session.commit()
-
-    # Notify user via email (optional)
-    send_notification_email(new_message)
+    bump_history_version(current_user)
+    record_message_statistics(current_user.id, [(timestamp, girlfriend_name)])
+    # Notify user via email (optional); delivered by the outbox worker after commit
+    queue_notification_email(new_message)
+    with span("generate_romantic_message.commit"):
+        db.session.commit()
+    notification_outbox.notify()
+    history_broker.publish(current_user.id, [new_message])
 
     # Return the generated message and timestamp
     return {
+        "id": new_message.id,
         "girlfriend_name": girlfriend_name,
         "romantic_message": romantic_message,
         "timestamp": new_message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
     }
 
+# Compose messages for several entries ({"girlfriend_name", "special_moments"}) for a user.
+# Returns a result (or error) per entry and the Message rows to insert.
+def compose_romantic_messages(user, entries, timestamp, quote=None):
+    seed = f"{app.config['COMPOSER_SEED']}:{user.id}:{user.history_version}"
+    results = []
+    rows = []
+    for index, entry in enumerate(entries):
+        girlfriend_name = entry.get("girlfriend_name", "") if isinstance(entry, dict) else ""
+        if not isinstance(girlfriend_name, str):
+            girlfriend_name = str(girlfriend_name)
+        if not girlfriend_name:
+            results.append({"index": index, "error": "Missing girlfriend's name"})
+            continue
+        special_moments = entry.get("special_moments") or ""
+        romantic_message = message_composer.compose(girlfriend_name, special_moments if isinstance(special_moments, str) else "",
+                                                    seed=f"{seed}:{index}", quote=quote)
+        rows.append({
+            "user_id": user.id,
+            "girlfriend_name": girlfriend_name,
+            "romantic_message": romantic_message,
+            "timestamp": timestamp,
+        })
+        results.append({
+            "index": index,
+            "girlfriend_name": girlfriend_name,
+            "romantic_message": romantic_message,
+            "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    return results, rows
+
+# Bulk insert new message rows, for one user or many, with their history versions and
+# statistics; the caller commits
+def insert_messages(rows):
+    db.session.bulk_insert_mappings(Message, rows)
+    bump_history_versions({row["user_id"] for row in rows})
+    record_bulk_message_statistics(rows)
+
+# After a bulk insert has committed, hand its messages to any live history streams
+def publish_inserted_messages(user_id, timestamp):
+    if history_broker.has_subscribers(user_id):
+        # Bulk inserts don't hand back ids; reload the batch for the live stream
+        history_broker.publish(user_id, Message.query
+                               .filter_by(user_id=user_id, timestamp=timestamp)
+                               .order_by(Message.id).all())
+
+# Generate messages for several recipients at once: one bulk insert, one commit and one
+# summary notification. Returns a result (or error) per entry.
+def generate_romantic_messages(entries):
+    timestamp = datetime.utcnow()
+    results, rows = compose_romantic_messages(current_user, entries, timestamp, quote=message_quote())
+    if rows:
+        insert_messages(rows)
+        queue_batch_notification_email(current_user, rows)
+        db.session.commit()
+        notification_outbox.notify()
+        publish_inserted_messages(current_user.id, timestamp)
+    return results
+
 # Flask-WTF Form for user registration
 class RegistrationForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=4, max=50)])
@@ -113,31 +1100,179 @@ class RegistrationForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
     submit = SubmitField('Register')
 
-# Send notification email to the user
-def send_notification_email(message):
-    try:
-        msg = FlaskMessage("New Romantic Message",
-                           recipients=[current_user.email],
-                           body=f"Dear {current_user.username},\n\n"
-                                f"Your romantic message for {message.girlfriend_name} has been created. "
-                                f"Here is the message:\n\n'{message.romantic_message}'\n\n"
-                                f"Cheers,\nThe Romantic Message App")
-        mail.send(msg)
-    except Exception as e:
-        logging.error(f"Error sending email notification: {str(e)}")
+# Queue a notification email about a new message; the caller commits
+def queue_notification_email(message):
+    user = message.user
+    email = OutboxEmail(recipient=user.email,
+                        subject="New Romantic Message",
+                        body=f"Dear {user.username},\n\n"
+                             f"Your romantic message for {message.girlfriend_name} has been created. "
+                             f"Here is the message:\n\n'{message.romantic_message}'\n\n"
+                             f"Cheers,\nThe Romantic Message App")
+    db.session.add(email)
+    return email
+
+# Queue one summary notification email for a batch of new messages; the caller commits
+def queue_batch_notification_email(user, rows):
+    names = ", ".join(row["girlfriend_name"] for row in rows)
+    email = OutboxEmail(recipient=user.email,
+                        subject="New Romantic Messages",
+                        body=f"Dear {user.username},\n\n"
+                             f"{len(rows)} romantic messages have been created for {names}.\n\n"
+                             f"Cheers,\nThe Romantic Message App")
+    db.session.add(email)
+    return email
+
+# Send notification email to the user over an open Flask-Mail connection
+@span("send_notification_email")
+def send_notification_email(email, connection):
+    connection.send(FlaskMessage(email.subject, recipients=[email.recipient], body=email.body))
+
+# Background worker draining the notification outbox in batches over one SMTP connection.
+# Rows are claimed with a lease, so several workers can share the table and a crashed
+# worker's claims are picked up again once the lease runs out.
+class NotificationOutbox:
+    def __init__(self, app):
+        self.app = app
+        self.stats = {"sent": 0, "retried": 0, "dead": 0}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+
+    def start(self):
+        if self._worker is not None or not self.app.config['OUTBOX_WORKER_ENABLED']:
+            return
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="notification-outbox", daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.join()
+
+    def notify(self):
+        self.start()
+        self._wakeup.set()
+
+    def drain(self):
+        # Process batches until nothing is due; returns the number of emails handled
+        handled = 0
+        while True:
+            count = self.process_batch()
+            if not count:
+                return handled
+            handled += count
+
+    def process_batch(self):
+        config = self.app.config
+        now = datetime.utcnow()
+        due = (OutboxEmail.query
+               .filter(OutboxEmail.status.in_(('pending', 'sending')), OutboxEmail.next_attempt_at <= now)
+               .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id)
+               .limit(config['OUTBOX_BATCH_SIZE'])
+               .all())
+        claimed = []
+        lease_until = now + timedelta(seconds=config['OUTBOX_LEASE'])
+        for email in due:
+            updated = (OutboxEmail.query
+                       .filter_by(id=email.id, status=email.status, next_attempt_at=email.next_attempt_at)
+                       .update({"status": "sending", "next_attempt_at": lease_until}, synchronize_session=False))
+            if updated:
+                claimed.append(email.id)
+        db.session.commit()
+        if not claimed:
+            return 0
+        claimed = OutboxEmail.query.filter(OutboxEmail.id.in_(claimed)).all()
+
+        try:
+            with mail.connect() as connection:
+                for email in claimed:
+                    try:
+                        send_notification_email(email, connection)
+                    except Exception as e:
+                        self._failed(email, e)
+                    else:
+                        email.status = 'sent'
+                        email.sent_at = datetime.utcnow()
+                        self.stats["sent"] += 1
+        except Exception as e:
+            # The connection itself failed; every email still in flight gets retried
+            for email in claimed:
+                if email.status == 'sending':
+                    self._failed(email, e)
+        db.session.commit()
+        return len(claimed)
+
+    def _failed(self, email, error):
+        config = self.app.config
+        logging.error(f"Error sending email notification: {str(error)}")
+        email.attempts += 1
+        email.last_error = str(error)
+        if email.attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+            email.status = 'dead'
+            self.stats["dead"] += 1
+        else:
+            backoff = config['OUTBOX_RETRY_BACKOFF'] * 2 ** (email.attempts - 1)
+            email.status = 'pending'
+            email.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff * random.uniform(0.5, 1.0))
+            self.stats["retried"] += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            handled = 0
+            with self.app.app_context():
+                try:
+                    handled = self.process_batch()
+                except Exception as e:
+                    logging.error(f"Error draining notification outbox: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if not handled:
+                self._wakeup.wait(self.app.config['OUTBOX_POLL_INTERVAL'])
+                self._wakeup.clear()
+
+notification_outbox = NotificationOutbox(app)
+
+# Start the worker with the process (on its first request), so emails left pending or leased
+# by an earlier process are delivered without waiting for a new message
+@app.before_request
+def start_notification_outbox():
+    notification_outbox.start()
 
 # Routes
 @app.route("/")
 @login_required
 def index():
-    return render_template("index.html", user=current_user)
+    return render_template("index.html", user=current_user, history_stream=app.config['HISTORY_STREAM_ENABLED'])
+
+# Check the fields of a message request; returns (girlfriend_name, special_moments) or raises ValueError
+def validate_message_fields(data):
+    if not isinstance(data, dict):
+        raise ValueError("Expected an object")
+    girlfriend_name = data.get("girlfriend_name") or ""
+    special_moments = data.get("special_moments") or ""
+    if not isinstance(girlfriend_name, str) or len(girlfriend_name) > 100:
+        raise ValueError("girlfriend_name must be a string of at most 100 characters")
+    if not isinstance(special_moments, str) or len(special_moments) > app.config['SPECIAL_MOMENTS_MAX_LENGTH']:
+        raise ValueError(f"special_moments must be a string of at most {app.config['SPECIAL_MOMENTS_MAX_LENGTH']} characters")
+    return girlfriend_name, special_moments
 
 @app.route("/generate_message", methods=["POST"])
 @login_required
 def ajax_generate_message():
-    data = request.get_json()
-    girlfriend_name = data.get("girlfriend_name", "")
-    special_moments = data.get("special_moments", "")
+    try:
+        girlfriend_name, special_moments = validate_message_fields(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Perform form validation
     if not girlfriend_name:
@@ -149,28 +1284,737 @@ def ajax_generate_message():
 
     return jsonify(generated_message)
 
+@app.route("/generate_messages/batch", methods=["POST"])
+@login_required
+def ajax_generate_messages_batch():
+    data = request.get_json(silent=True)
+    entries = data.get("messages") if isinstance(data, dict) else data
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "Expected a list of messages"}), 400
+    if len(entries) > app.config['BATCH_MAX_MESSAGES']:
+        return jsonify({"error": f"At most {app.config['BATCH_MAX_MESSAGES']} messages per batch"}), 400
+    for index, entry in enumerate(entries):
+        try:
+            validate_message_fields(entry)
+        except ValueError as e:
+            return jsonify({"error": f"Message {index}: {e}"}), 400
+
+    results = generate_romantic_messages(entries)
+
+    # Stream one JSON result per line so large batches aren't buffered into a single document
+    return Response((json.dumps(result) + "\n" for result in results), mimetype="application/x-ndjson")
+
+# Message history, newest first, paged by an opaque cursor over (timestamp, id)
+def encode_history_cursor(message):
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor):
+    # Raises ValueError for cursors we didn't issue
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    timestamp, message_id = raw.split("|")
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+def format_history_message(message):
+    return {
+        "id": message.id,
+        "girlfriend_name": message.girlfriend_name,
+        "romantic_message": message.romantic_message,
+        "timestamp": message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def get_message_history_page(user, cursor=None, limit=None, include_total=False):
+    limit = max(1, min(limit or app.config['RESULTS_PER_PAGE'], app.config['HISTORY_MAX_PAGE_SIZE']))
+    query = Message.query.filter(Message.user_id == user.id)
+    if cursor:
+        timestamp, message_id = decode_history_cursor(cursor)
+        # The redundant `timestamp <=` bound lets the index seek straight to the cursor
+        query = query.filter(Message.timestamp <= timestamp,
+                             db.or_(Message.timestamp < timestamp, Message.id < message_id))
+    # Fetch one extra row to learn whether another page exists without counting
+    messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    page = {
+        "messages": [format_history_message(message) for message in messages],
+        "next_cursor": encode_history_cursor(messages[-1]) if has_more else None,
+    }
+    if include_total:
+        page["total"] = get_message_statistics(user, windows=())["total_messages"]
+    return page
+
+# Bump the user's history version in the same transaction as a message insert
+def bump_history_version(user):
+    bump_history_versions([user.id])
+
+def bump_history_versions(user_ids):
+    (User.query.filter(User.id.in_(user_ids))
+     .update({User.history_version: User.history_version + 1}, synchronize_session=False))
+    for user_id in user_ids:
+        mark_user_changed(db.session, user_id)
+
+# ETag for a user's history; changes exactly when a message is added. The version is read from
+# the row rather than the (possibly cached) user, so messages added by another process count too.
+def history_etag(user):
+    version = db.session.query(User.history_version).filter(User.id == user.id).scalar()
+    return f"{user.id}-{version}"
+
+@app.route("/api/messages", methods=["GET"])
+@login_required
+def api_message_history():
+    # Unchanged polls are answered with one primary key lookup, without touching messages
+    etag = history_etag(current_user)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        page = get_message_history_page(current_user,
+                                        cursor=request.args.get("cursor"),
+                                        limit=request.args.get("limit", type=int),
+                                        include_total=request.args.get("include_total") in ("1", "true"))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    response = jsonify(page)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# In-process fan-out of new messages to live history streams, keyed by user id.
+# Each subscriber gets a bounded queue; a subscriber that stops reading misses
+# deltas instead of growing memory, and catches up on reconnect via Last-Event-ID.
+# Messages added by other processes never reach it; streams pick those up from the
+# database at each keepalive instead.
+class HistoryBroker:
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id):
+        subscription = queue.Queue(self.max_pending)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscribers.pop(user_id, None)
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def publish(self, user_id, messages):
+        if not self.has_subscribers(user_id):
+            return
+        events = [format_history_message(message) for message in messages]
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait(events)
+            except queue.Full:
+                logging.warning(f"Dropping history events for a slow stream of user {user_id}")
+
+history_broker = HistoryBroker()
+
+def format_history_event(event):
+    return f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+
+# A user's messages after `after_id` as history events, oldest first
+def history_events_after(user_id, after_id):
+    return [format_history_message(message) for message in Message.query
+            .filter(Message.user_id == user_id, Message.id > after_id)
+            .order_by(Message.id)
+            .limit(app.config['HISTORY_MAX_PAGE_SIZE'])]
+
+def stream_history_events(user_id, subscription, backlog, last_id, keepalive):
+    try:
+        sent = set()
+        message_events = backlog
+        while True:
+            for message_event in message_events:
+                if message_event["id"] not in sent:
+                    sent.add(message_event["id"])
+                    last_id = max(last_id, message_event["id"])
+                    yield format_history_event(message_event)
+            try:
+                message_events = subscription.get(timeout=keepalive)
+            except queue.Empty:
+                # Nothing published here for a while: catch up on messages other processes
+                # (web workers, imports, the occasion scheduler) added
+                with app.app_context():
+                    message_events = history_events_after(user_id, last_id)
+                if not message_events:
+                    yield ": keepalive\n\n"
+    finally:
+        history_broker.unsubscribe(user_id, subscription)
+
+# Server-Sent Events stream of new messages; each open stream holds one worker thread
+@app.route("/api/messages/stream", methods=["GET"])
+@login_required
+def api_message_history_stream():
+    if not app.config['HISTORY_STREAM_ENABLED']:
+        return jsonify({"error": "History streaming is disabled"}), 404
+
+    user_id = current_user.id
+    # Subscribe before reading the backlog so nothing committed in between is missed
+    subscription = history_broker.subscribe(user_id)
+    last_event_id = request.headers.get("Last-Event-ID", request.args.get("last_event_id"))
+    if last_event_id and last_event_id.isdigit():
+        last_id = int(last_event_id)
+        backlog = history_events_after(user_id, last_id)
+    else:
+        last_id = db.session.query(db.func.max(Message.id)).filter(Message.user_id == user_id).scalar() or 0
+        backlog = []
+
+    response = Response(stream_history_events(user_id, subscription, backlog, last_id,
+                                              app.config['HISTORY_STREAM_KEEPALIVE']),
+                        mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# Full-text search over a user's messages. On SQLite with FTS5 the index is an external-content
+# FTS5 table kept in sync by triggers, so every insert path (single, batch, bulk) is covered in
+# the inserting transaction. Elsewhere an in-process inverted index catches up on new rows
+# (by id) before each search.
+FTS_TABLE = "message_fts"
+FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"romantic_message, girlfriend_name, content='message', content_rowid='id', tokenize='unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON message BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, romantic_message, girlfriend_name) "
+    f"VALUES (new.id, new.romantic_message, new.girlfriend_name); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON message BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, romantic_message, girlfriend_name) "
+    f"VALUES ('delete', old.id, old.romantic_message, old.girlfriend_name); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE ON message BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, romantic_message, girlfriend_name) "
+    f"VALUES ('delete', old.id, old.romantic_message, old.girlfriend_name); "
+    f"INSERT INTO {FTS_TABLE}(rowid, romantic_message, girlfriend_name) "
+    f"VALUES (new.id, new.romantic_message, new.girlfriend_name); END",
+]
+# Highlight markers that can't occur in message text; swapped for <mark> after escaping
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"
+
+def parse_search_query(query, max_terms=8):
+    # Words, optionally followed by * for a prefix match: "beach sun*"
+    return [(word, prefix == "*") for word, prefix in re.findall(r"(\w+)(\*?)", query.lower())][:max_terms]
+
+def render_highlight(marked):
+    return str(escape(marked)).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+
+def highlight_terms(value, terms):
+    def matches(word):
+        word = word.lower()
+        return any(word.startswith(term) if prefix else word == term for term, prefix in terms)
+    marked = re.sub(r"\w+", lambda m: f"{HIGHLIGHT_START}{m.group(0)}{HIGHLIGHT_END}" if matches(m.group(0)) else m.group(0), value)
+    return render_highlight(marked)
+
+def format_timestamp(value):
+    # Raw SQL on SQLite hands back DateTime columns as text
+    return value[:19] if isinstance(value, str) else value.strftime("%Y-%m-%d %H:%M:%S")
+
+def fts5_supported(connection):
+    if connection.dialect.name != "sqlite":
+        return False
+    try:
+        connection.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(content)"))
+        connection.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+    except Exception:
+        return False
+
+@event.listens_for(Message.__table__, "after_create")
+def create_message_fts(target, connection, **kw):
+    if app.config['SEARCH_BACKEND'] != 'memory' and fts5_supported(connection):
+        for statement in FTS_DDL:
+            connection.execute(text(statement))
+
+@event.listens_for(Message.__table__, "before_drop")
+def drop_message_fts(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+
+# In-process inverted index: (user_id, term) -> {message_id: term frequency}
+class InvertedSearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._terms = {}  # user_id -> sorted terms, for prefix expansion
+            self._lengths = {}  # message_id -> number of terms
+            self._user_docs = {}  # user_id -> (number of messages, total terms)
+            self._last_id = 0
+
+    def catch_up(self):
+        rows = (db.session.query(Message.id, Message.user_id, Message.girlfriend_name, Message.romantic_message)
+                .filter(Message.id > self._last_id)
+                .order_by(Message.id)
+                .yield_per(10000))
+        with self._lock:
+            for message_id, user_id, girlfriend_name, romantic_message in rows:
+                if message_id <= self._last_id:
+                    continue
+                words = re.findall(r"\w+", f"{romantic_message} {girlfriend_name}".lower())
+                self._lengths[message_id] = len(words)
+                documents, total_terms = self._user_docs.get(user_id, (0, 0))
+                self._user_docs[user_id] = (documents + 1, total_terms + len(words))
+                for word in words:
+                    postings = self._postings.get((user_id, word))
+                    if postings is None:
+                        postings = self._postings[(user_id, word)] = {}
+                        bisect.insort(self._terms.setdefault(user_id, []), word)
+                    postings[message_id] = postings.get(message_id, 0) + 1
+                self._last_id = message_id
+
+    # Forget messages that were deleted from the table
+    def discard(self, user_id, message_ids):
+        with self._lock:
+            message_ids = [m for m in message_ids if m in self._lengths]
+            if not message_ids:
+                return
+            documents, total_terms = self._user_docs[user_id]
+            self._user_docs[user_id] = (documents - len(message_ids),
+                                        total_terms - sum(self._lengths.pop(m) for m in message_ids))
+            user_terms = self._terms.get(user_id, [])
+            for word in list(user_terms):
+                postings = self._postings[(user_id, word)]
+                for message_id in message_ids:
+                    postings.pop(message_id, None)
+                if not postings:
+                    del self._postings[(user_id, word)]
+                    user_terms.remove(word)
+
+    # Rank with BM25; every term must match
+    def search(self, user_id, terms, limit):
+        with self._lock:
+            documents, total_terms = self._user_docs.get(user_id, (0, 0))
+            if not documents:
+                return []
+            average_length = total_terms / documents or 1
+            scores = None
+            for term, prefix in terms:
+                expanded = [term]
+                if prefix:
+                    user_terms = self._terms.get(user_id, [])
+                    start = bisect.bisect_left(user_terms, term)
+                    expanded = []
+                    for candidate in user_terms[start:]:
+                        if not candidate.startswith(term):
+                            break
+                        expanded.append(candidate)
+                term_scores = {}
+                for word in expanded:
+                    postings = self._postings.get((user_id, word), {})
+                    idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for message_id, frequency in postings.items():
+                        length = self._lengths[message_id] / average_length
+                        score = idf * frequency * 2.2 / (frequency + 1.2 * (0.25 + 0.75 * length))
+                        term_scores[message_id] = term_scores.get(message_id, 0) + score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {m: score + term_scores[m] for m, score in scores.items() if m in term_scores}
+                if not scores:
+                    return []
+            return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[:limit]
+
+class MessageSearch:
+    def __init__(self):
+        self.inverted_index = InvertedSearchIndex()
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            backend = app.config['SEARCH_BACKEND']
+            if backend == 'memory':
+                self._engine = 'memory'
+            else:
+                has_fts = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}).first() \
+                    if db.engine.dialect.name == "sqlite" else None
+                self._engine = 'fts5' if has_fts else 'memory'
+        return self._engine
+
+    def reset(self):
+        self._engine = None
+        self.inverted_index.clear()
+
+    # Build or rebuild the index from the message table
+    def rebuild(self):
+        self.reset()
+        if app.config['SEARCH_BACKEND'] != 'memory':
+            with db.engine.begin() as connection:
+                if fts5_supported(connection):
+                    for statement in FTS_DDL:
+                        connection.execute(text(statement))
+                    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+    def search(self, user_id, query, limit=20):
+        terms = parse_search_query(query)
+        if not terms:
+            return []
+        if self.engine == 'fts5':
+            return self._search_fts5(user_id, terms, limit)
+        return self._search_memory(user_id, terms, limit)
+
+    def _search_fts5(self, user_id, terms, limit):
+        match = " ".join(f'"{term}"*' if prefix else f'"{term}"' for term, prefix in terms)
+        rows = db.session.execute(text(
+            f"SELECT m.id, m.girlfriend_name, m.romantic_message, m.timestamp, "
+            f"highlight({FTS_TABLE}, 0, :start, :end), highlight({FTS_TABLE}, 1, :start, :end), "
+            f"bm25({FTS_TABLE}) AS score "
+            f"FROM {FTS_TABLE} JOIN message m ON m.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :match AND m.user_id = :user_id "
+            f"ORDER BY score, m.id DESC LIMIT :limit"),
+            {"start": HIGHLIGHT_START, "end": HIGHLIGHT_END, "match": match, "user_id": user_id, "limit": limit})
+        return [{
+            "id": message_id,
+            "girlfriend_name": girlfriend_name,
+            "romantic_message": romantic_message,
+            "timestamp": format_timestamp(timestamp),
+            "score": -score,
+            "highlight": {"romantic_message": render_highlight(message_highlight),
+                          "girlfriend_name": render_highlight(name_highlight)},
+        } for message_id, girlfriend_name, romantic_message, timestamp, message_highlight, name_highlight, score in rows]
+
+    def _search_memory(self, user_id, terms, limit):
+        self.inverted_index.catch_up()
+        ranked = self.inverted_index.search(user_id, terms, limit)
+        messages = {message.id: message for message in Message.query.filter(Message.id.in_([m for m, _ in ranked]))}
+        # The index only learns of new rows, so drop any that have been deleted since
+        deleted = [message_id for message_id, _ in ranked if message_id not in messages]
+        if deleted:
+            self.inverted_index.discard(user_id, deleted)
+        results = []
+        for message_id, score in ranked:
+            message = messages.get(message_id)
+            if message is None:
+                continue
+            result = format_history_message(message)
+            result["score"] = score
+            result["highlight"] = {"romantic_message": highlight_terms(message.romantic_message, terms),
+                                   "girlfriend_name": highlight_terms(message.girlfriend_name, terms)}
+            results.append(result)
+        return results
+
+message_search = MessageSearch()
+
+@app.route("/api/search", methods=["GET"])
+@login_required
+def api_search_messages():
+    query = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", 20, type=int), app.config['SEARCH_MAX_RESULTS']))
+    return jsonify({"query": query, "results": message_search.search(current_user.id, query, limit)})
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Create the message search index if needed and rebuild it from the message table."""
+    message_search.rebuild()
+    click.echo(f"Rebuilt the {message_search.engine} search index.")
+
+# Bulk export and import of a user's messages. Exports are streamed in keyset-paged chunks
+# over (timestamp, id), each fetched with a short query of its own, so memory stays flat and a
+# slow download never holds a read transaction open against writers. Imports are read from
+# the request stream line by line and inserted in batches, one transaction per batch.
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FIELDS = ("id", "girlfriend_name", "romantic_message", "timestamp")
+IMPORT_FORMATS = {"application/x-ndjson": "ndjson", "application/jsonl": "ndjson", "text/csv": "csv"}
+
+class MessageImportError(ValueError):
+    pass
+
+def iter_message_export_chunks(user_id, chunk_size):
+    last = None
+    while True:
+        query = (Message.query
+                 .with_entities(Message.id, Message.girlfriend_name, Message.romantic_message, Message.timestamp)
+                 .filter(Message.user_id == user_id))
+        if last is not None:
+            query = query.filter(Message.timestamp >= last.timestamp,
+                                 db.or_(Message.timestamp > last.timestamp, Message.id > last.id))
+        rows = query.order_by(Message.timestamp, Message.id).limit(chunk_size).all()
+        # End the read between chunks; nothing is held while the client catches up
+        db.session.commit()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+
+def encode_export_rows(rows, fmt):
+    if fmt == "csv":
+        buffer = StringIO()
+        csv.writer(buffer).writerows((row.id, row.girlfriend_name, row.romantic_message, row.timestamp.isoformat())
+                                     for row in rows)
+        return buffer.getvalue()
+    return "".join(json.dumps({"id": row.id, "girlfriend_name": row.girlfriend_name,
+                               "romantic_message": row.romantic_message,
+                               "timestamp": row.timestamp.isoformat()}) + "\n" for row in rows)
+
+def stream_message_export(user_id, fmt, compress, chunk_size):
+    # wbits=31 writes a gzip container, compressed incrementally chunk by chunk
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(data):
+        data = data.encode()
+        return compressor.compress(data) if compressor else data
+
+    if fmt == "csv":
+        yield encode(",".join(EXPORT_FIELDS) + "\r\n")
+    for rows in iter_message_export_chunks(user_id, chunk_size):
+        data = encode(encode_export_rows(rows, fmt))
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+@app.route("/export/messages.<fmt>", methods=["GET"])
+@login_required
+def export_messages(fmt):
+    base, _, extension = fmt.partition(".")
+    if base not in EXPORT_FORMATS or extension not in ("", "gz"):
+        return jsonify({"error": "Unsupported export format"}), 404
+
+    compress = extension == "gz"
+    body = stream_message_export(current_user.id, base, compress, app.config['EXPORT_CHUNK_SIZE'])
+    response = Response(stream_with_context(body), mimetype="application/gzip" if compress else EXPORT_FORMATS[base])
+    response.headers["Content-Disposition"] = f"attachment; filename=messages.{fmt}"
+    response.headers["Cache-Control"] = "private, no-store"
+    return response
+
+# Validate one imported record and turn it into a Message row
+def parse_import_record(record):
+    if not isinstance(record, dict):
+        raise MessageImportError("Expected a JSON object")
+    girlfriend_name = record.get("girlfriend_name")
+    romantic_message = record.get("romantic_message")
+    if not isinstance(girlfriend_name, str) or not girlfriend_name.strip():
+        raise MessageImportError("Missing girlfriend's name")
+    if len(girlfriend_name) > Message.girlfriend_name.type.length:
+        raise MessageImportError(f"Girlfriend's name is longer than {Message.girlfriend_name.type.length} characters")
+    if not isinstance(romantic_message, str) or not romantic_message.strip():
+        raise MessageImportError("Missing romantic message")
+
+    timestamp = record.get("timestamp")
+    if timestamp in (None, ""):
+        timestamp = datetime.utcnow()
+    else:
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except (TypeError, ValueError):
+            raise MessageImportError("Invalid timestamp")
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return {"girlfriend_name": girlfriend_name, "romantic_message": romantic_message, "timestamp": timestamp}
+
+# (line number, record) pairs from an NDJSON or CSV byte stream, read incrementally
+def iter_import_records(stream, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(TextIOWrapper(stream, encoding="utf-8"), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record
+
+# Insert one batch of imported rows with its statistics and history version, and commit
+def save_imported_messages(rows):
+    insert_messages(rows)
+    db.session.commit()
+
+# Import records for a user in batches. Valid rows are kept even when others are rejected;
+# if the input itself turns out to be unreadable, the batches read so far stay committed.
+def import_messages(user, records, batch_size):
+    summary = {"imported": 0, "rejected": 0, "errors": []}
+    rows = []
+    try:
+        for number, record in records:
+            try:
+                row = parse_import_record(record)
+            except MessageImportError as e:
+                summary["rejected"] += 1
+                if len(summary["errors"]) < app.config['IMPORT_MAX_ERRORS']:
+                    summary["errors"].append({"line": number, "error": str(e)})
+                continue
+            row["user_id"] = user.id
+            rows.append(row)
+            if len(rows) >= batch_size:
+                save_imported_messages(rows)
+                summary["imported"] += len(rows)
+                rows = []
+    except (csv.Error, UnicodeDecodeError, OSError, EOFError, zlib.error) as e:
+        summary["error"] = f"Unreadable import data: {e}"
+    if rows:
+        save_imported_messages(rows)
+        summary["imported"] += len(rows)
+    return summary
+
+# Import messages from an NDJSON (application/x-ndjson) or CSV (text/csv) request body,
+# optionally sent with Content-Encoding: gzip
+@app.route("/import/messages", methods=["POST"])
+@login_required
+def import_messages_route():
+    fmt = IMPORT_FORMATS.get(request.mimetype)
+    if fmt is None:
+        return jsonify({"error": "Expected an application/x-ndjson or text/csv body"}), 415
+    if request.content_encoding not in (None, "", "identity", "gzip"):
+        return jsonify({"error": "Unsupported content encoding"}), 415
+
+    stream = request.stream
+    if request.content_encoding == "gzip":
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    try:
+        summary = import_messages(current_user, iter_import_records(stream, fmt), app.config['IMPORT_BATCH_SIZE'])
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error importing messages: {str(e)}")
+        return jsonify({"error": "Failed to import messages"}), 500
+    return jsonify(summary), 400 if "error" in summary else 200
+
 @app.route("/get_message_history", methods=["GET"])
 @login_required
 def ajax_get_message_history():
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    messages = current_user.messages.order_by(Message.timestamp.desc()).paginate(page, app.config['RESULTS_PER_PAGE'], False)
-    formatted_history = [
-        {
-            "girlfriend_name": message.girlfriend_name,
-            "romantic_message": message.romantic_message,
-            "timestamp": message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-        }
-        for message in messages.items
-    ]
-    pagination = Pagination(page=page, total=messages.total, per_page=app.config['RESULTS_PER_PAGE'], css_framework='bootstrap4')
+    try:
+        page = get_message_history_page(current_user, cursor=request.args.get("cursor"))
+    except ValueError:
+        page = get_message_history_page(current_user)
+
+    return render_template("message_history.html", message_history=page["messages"], next_cursor=page["next_cursor"])
+
+# Password hashing and verification run in a small process pool, so a slow KDF burns pool
+# processes rather than web threads. Admission control keeps a login flood from tying up
+# every web thread: at most `max_pending` requests wait on the pool (the rest are turned
+# away at once), and token buckets per client IP and per username reject repeated attempts
+# before they cost a hash.
+class PasswordServiceBusy(Exception):
+    pass
+
+class PasswordService:
+    # `method` is a full Werkzeug method string, iterations included, e.g. pbkdf2:sha256:260000;
+    # stored hashes with any other method are rehashed on the next successful login.
+    # workers=0 hashes on the calling thread.
+    def __init__(self, method, salt_length, workers, max_pending, timeout):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._dummy_hash = None
+        self._lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordServiceBusy()
+        try:
+            executor = self.start()
+            if executor is None:
+                return fn(*args)
+            return executor.submit(fn, *args).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise PasswordServiceBusy()
+        finally:
+            self._slots.release()
+
+    # Start the pool, and make the dummy hash verify_unknown checks against, once and through
+    # the pool; concurrent first callers wait for it. Returns the pool (None when hashing inline).
+    def start(self):
+        if self._dummy_hash is not None and (self._executor is not None or not self.workers):
+            return self._executor
+        with self._lock:
+            if self.workers and self._executor is None:
+                # Spawned, not forked: a fork would copy locks held by the app's background threads
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            executor = self._executor if self.workers else None
+            if self._dummy_hash is None:
+                args = (os.urandom(16).hex(), self.method, self.salt_length)
+                self._dummy_hash = (executor.submit(generate_password_hash, *args).result(timeout=self.timeout)
+                                    if executor is not None else generate_password_hash(*args))
+            return executor
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    # Spend the same effort as a real check, so unknown usernames can't be told apart by timing
+    def verify_unknown(self, password):
+        self.start()
+        self.verify(self._dummy_hash, password)
+        return False
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split("$", 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+password_service = PasswordService(
+    app.config['PASSWORD_HASH_METHOD'],
+    salt_length=app.config['PASSWORD_SALT_LENGTH'],
+    workers=app.config['PASSWORD_WORKERS'],
+    max_pending=app.config['PASSWORD_MAX_PENDING'],
+    timeout=app.config['PASSWORD_TIMEOUT'],
+)
+
+# Token buckets per key (client IP or username); the least recently seen keys are
+# dropped past `max_keys`, so a flood of made-up usernames can't grow memory
+class LoginThrottle:
+    def __init__(self, rate, burst, max_keys):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return bucket.try_acquire()
 
-    return render_template("message_history.html", message_history=formatted_history, pagination=pagination)
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+login_ip_throttle = LoginThrottle(*app.config['LOGIN_RATE_PER_IP'], max_keys=app.config['LOGIN_THROTTLE_KEYS'])
+login_user_throttle = LoginThrottle(*app.config['LOGIN_RATE_PER_USER'], max_keys=app.config['LOGIN_THROTTLE_KEYS'])
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data, method='sha256')
+        try:
+            hashed_password = password_service.hash(form.password.data)
+        except PasswordServiceBusy:
+            flash('The server is busy. Please try again in a moment.', 'danger')
+            return render_template("register.html", form=form), 503
         user = User(username=form.username.data, password=hashed_password, email=form.email.data)
         db.session.add(user)
         db.session.commit()
@@ -183,8 +2027,23 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
+        if not (login_ip_throttle.allow(request.remote_addr) and login_user_throttle.allow((username or "").lower())):
+            flash('Too many login attempts. Please wait a moment and try again.', 'danger')
+            return render_template("login.html"), 429
         user = User.query.filter_by(username=username).first()
-        if user and check_password_hash(user.password, password):
+        try:
+            valid = password_service.verify(user.password, password) if user else password_service.verify_unknown(password)
+        except PasswordServiceBusy:
+            flash('The server is busy. Please try again in a moment.', 'danger')
+            return render_template("login.html"), 503
+        if valid:
+            if password_service.needs_rehash(user.password):
+                # Upgrade legacy (e.g. plain sha256) hashes while the password is at hand
+                try:
+                    user.password = password_service.hash(password)
+                    db.session.commit()
+                except PasswordServiceBusy:
+                    pass  # Rehashed on a later login instead
             login_user(user, remember=True)
             flash('Login successful!', 'success')
             return redirect(url_for('index'))
@@ -195,6 +2054,7 @@ def login():
 @app.route("/logout")
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
@@ -240,6 +2100,150 @@ def server_error(e):
     return render_template("500.html"), 500
 
 # File uploads
+IMAGE_SIGNATURES = {b"\x89PNG\r\n\x1a\n": "png", b"\xff\xd8\xff": "jpg", b"GIF87a": "gif", b"GIF89a": "gif"}
+CONTENT_FILENAME = re.compile(r"^([0-9a-f]{64})\.(png|jpg|gif)$")
+
+class UploadError(ValueError):
+    pass
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# Sniff the image type from the first bytes; the client's filename and content type aren't trusted
+def detect_image_type(head):
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return extension
+    return None
+
+def content_path(filename):
+    # Fan out into subdirectories by hash prefix so no directory grows too large
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename[:2], filename)
+
+def thumbnail_path(sha256, size):
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails', str(size), sha256[:2], f"{sha256}.jpg")
+
+# An upload on its way to disk: a temp file in the upload folder, hashed, sniffed and
+# size-checked as it is written. Data past a rejection is dropped rather than written.
+class UploadSpool:
+    def __init__(self):
+        folder = app.config['UPLOAD_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix=".upload-")
+        self.file = os.fdopen(fd, "w+b")
+        self.max_size = app.config['MAX_UPLOAD_SIZE']
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.extension = None
+        self.error = None
+
+    def write(self, data):
+        if self.error is None:
+            if len(self.head) < 8:
+                self.head += data[:8 - len(self.head)]
+                if len(self.head) == 8 and detect_image_type(self.head) is None:
+                    self.error = UploadError("Only PNG, JPEG and GIF images can be uploaded")
+                    return len(data)
+            self.size += len(data)
+            if self.size > self.max_size:
+                self.error = UploadError(f"Images must be smaller than {self.max_size // (1024 * 1024)} MB")
+                return len(data)
+            self.digest.update(data)
+            self.file.write(data)
+        return len(data)
+
+    # Reads and seeks go to the temp file, as for any spooled upload
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    # File the upload by content and return its path; identical content is stored once
+    def save(self):
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+        if self.size == 0:
+            raise UploadError("The uploaded file is empty")
+        extension = detect_image_type(self.head)
+        if extension is None:
+            raise UploadError("Only PNG, JPEG and GIF images can be uploaded")
+        self.extension = extension
+        path = content_path(f"{self.digest.hexdigest()}.{extension}")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.path, path)
+            self.path = None
+        return path
+
+    def close(self):
+        self.file.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+# The form parser writes /upload_image's file parts straight into an UploadSpool, instead of
+# a spooled temp file store_upload would then copy into the upload folder
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == "upload_image":
+            return UploadSpool()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app.request_class = UploadRequest
+
+# Store an upload, from the request's UploadSpool or by streaming any other file object into
+# one in chunks. The caller commits the returned ImageUpload.
+def store_upload(stream, original_name, user_id):
+    spool = stream if isinstance(stream, UploadSpool) else UploadSpool()
+    try:
+        if spool is not stream:
+            chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+            while spool.error is None:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                spool.write(chunk)
+        path = spool.save()
+    finally:
+        spool.close()
+
+    upload = ImageUpload(user_id=user_id, sha256=spool.digest.hexdigest(), extension=spool.extension,
+                         original_name=original_name, size=spool.size)
+    db.session.add(upload)
+    if not all(os.path.exists(thumbnail_path(upload.sha256, size)) for size in app.config['THUMBNAIL_SIZES']):
+        schedule_thumbnails(path, upload.sha256)
+    return upload
+
+# Thumbnails are generated by a small worker pool, never on the request thread
+_thumbnail_pool = None
+_thumbnail_pool_lock = threading.Lock()
+
+def schedule_thumbnails(path, sha256):
+    global _thumbnail_pool
+    with _thumbnail_pool_lock:
+        if _thumbnail_pool is None:
+            _thumbnail_pool = ThreadPoolExecutor(app.config['THUMBNAIL_WORKERS'], thread_name_prefix="thumbnails")
+    return _thumbnail_pool.submit(generate_thumbnails, path, sha256, app.config['THUMBNAIL_SIZES'])
+
+def generate_thumbnails(path, sha256, sizes):
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            # Let JPEG decoding downscale while reading when it can
+            image.draft("RGB", (max(sizes), max(sizes)))
+            image = image.convert("RGB")
+            for size in sorted(sizes, reverse=True):
+                image.thumbnail((size, size))
+                target = thumbnail_path(sha256, size)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".thumb-")
+                with os.fdopen(fd, "wb") as temp:
+                    image.save(temp, format="JPEG", quality=85)
+                os.replace(temp_path, target)
+    except Exception as e:
+        logging.error(f"Error generating thumbnails for {sha256}: {str(e)}")
+
 @app.route("/upload_image", methods=["POST"])
 @login_required
 def upload_image():
@@ -251,37 +2255,159 @@ def upload_image():
         if file.filename == '':
             flash('No selected file', 'danger')
             return redirect(request.url)
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            flash('File uploaded successfully', 'success')
-            return redirect(url_for('index'))
+        if not allowed_file(file.filename):
+            flash('Only PNG, JPEG and GIF images can be uploaded', 'danger')
+            return redirect(request.url)
+        try:
+            upload = store_upload(file.stream, secure_filename(file.filename), current_user.id)
+        except UploadError as e:
+            flash(str(e), 'danger')
+            return redirect(request.url)
+        db.session.commit()
+        flash('File uploaded successfully', 'success')
+        return redirect(url_for('index', uploaded=upload.filename))
 
-# Displaying uploaded images
+# Displaying uploaded images. Content-addressed files never change, so they are
+# served with their hash as the ETag, long-lived cache headers and Range support.
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    match = CONTENT_FILENAME.match(filename)
+    if not match:
+        # Files uploaded before content addressing
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    response = send_from_directory(os.path.dirname(os.path.abspath(content_path(filename))), filename,
+                                   etag=match.group(1), max_age=app.config['UPLOAD_CACHE_MAX_AGE'])
+    response.headers["Cache-Control"] = f"public, max-age={app.config['UPLOAD_CACHE_MAX_AGE']}, immutable"
+    return response
+
+@app.route('/uploads/thumbnails/<int:size>/<filename>')
+def uploaded_thumbnail(size, filename):
+    match = CONTENT_FILENAME.match(filename)
+    if size not in app.config['THUMBNAIL_SIZES'] or not match:
+        return jsonify({"error": "Unknown thumbnail"}), 404
+    path = os.path.abspath(thumbnail_path(match.group(1), size))
+    if not os.path.exists(path):
+        # Still being generated; the original stands in until it's ready
+        response = redirect(url_for('uploaded_file', filename=filename))
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    response = send_from_directory(os.path.dirname(path), os.path.basename(path),
+                                   etag=f"{match.group(1)}-{size}", max_age=app.config['UPLOAD_CACHE_MAX_AGE'])
+    response.headers["Cache-Control"] = f"public, max-age={app.config['UPLOAD_CACHE_MAX_AGE']}, immutable"
+    return response
 
 # Data visualization
+CHART_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+# LRU cache of rendered chart images, keyed by a hash of the plotted data, size and format
+class ChartCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            self._entries[key] = image
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+chart_cache = ChartCache(app.config['CHART_CACHE_SIZE'])
+
+# Messages per UTC day over the last `days` days (oldest first), binned from the daily buckets
+def messages_per_day(user, days):
+    import numpy as np
+
+    start = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = (db.session.query(MessageDailyCount.day, MessageDailyCount.count)
+            .filter(MessageDailyCount.user_id == user.id, MessageDailyCount.day >= start)
+            .all())
+    if not rows:
+        return start, np.zeros(days, dtype=np.int64)
+    bucket_days, counts = zip(*rows)
+    offsets = (np.array(bucket_days, dtype="datetime64[D]") - np.datetime64(start, "D")).astype(np.int64)
+    return start, np.bincount(offsets, weights=counts, minlength=days).astype(np.int64)
+
+def chart_key(start, counts, width, height, fmt):
+    digest = hashlib.sha256(counts.tobytes())
+    digest.update(f"{start.isoformat()}|{width}x{height}|{fmt}".encode())
+    return digest.hexdigest()[:32]
+
+# Render with the object-oriented Figure/Agg API; no pyplot global state is involved
+@span("render_messages_chart")
+def render_messages_chart(start, counts, width, height, fmt):
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(width / 100, height / 100), dpi=100)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    days = np.datetime64(start, "D") + np.arange(len(counts))
+    axes.bar(days.astype(datetime), counts, width=0.8, color="#e83e8c")
+    axes.set_xlabel("Day")
+    axes.set_ylabel("Messages")
+    axes.set_title("Messages per Day")
+    figure.autofmt_xdate()
+    image = BytesIO()
+    figure.savefig(image, format=fmt)
+    return image.getvalue()
+
+# Rendered chart for the given data, from the cache when it was drawn before
+def get_chart_image(key, start, counts, width, height, fmt):
+    image = chart_cache.get(key)
+    if image is None:
+        image = render_messages_chart(start, counts, width, height, fmt)
+        chart_cache.put(key, image)
+    return image
+
+def chart_params():
+    days = min(max(request.args.get("days", 30, type=int), 1), app.config['CHART_MAX_DAYS'])
+    width = min(max(request.args.get("width", 800, type=int), 200), 2000)
+    height = min(max(request.args.get("height", 400, type=int), 150), 1500)
+    return days, width, height
+
 @app.route("/visualization")
+@login_required
 def data_visualization():
-    # Generate sample data and create a simple plot
-    x = np.linspace(0, 10, 100)
-    y = np.sin(x)
-    plt.plot(x, y)
-    plt.xlabel("X-axis")
-    plt.ylabel("Y-axis")
-    plt.title("Sample Data Visualization")
-    
-    # Save the plot to a BytesIO object
-    img_bytes = BytesIO()
-    plt.savefig(img_bytes, format='png')
-    img_bytes.seek(0)
-    
-    # Encode the image to base64 for embedding in HTML
-    img_base64 = base64.b64encode(img_bytes.read()).decode('utf-8')
-    
-    return render_template("data_visualization.html", img_base64=img_base64)
+    days, width, height = chart_params()
+    chart_url = url_for("messages_chart", fmt="png", days=days, width=width, height=height)
+    return render_template("data_visualization.html", chart_url=chart_url)
+
+# Chart images are served separately from the page so browsers can cache and revalidate them
+@app.route("/visualization/messages_per_day.<fmt>")
+@login_required
+def messages_chart(fmt):
+    if fmt not in CHART_FORMATS:
+        return jsonify({"error": "Unsupported chart format"}), 404
+    days, width, height = chart_params()
+    start, counts = messages_per_day(current_user, days)
+    key = chart_key(start, counts, width, height, fmt)
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+    else:
+        response = Response(get_chart_image(key, start, counts, width, height, fmt), mimetype=CHART_FORMATS[fmt])
+    response.set_etag(key)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 # Change the user's password
 @app.route("/change_password", methods=["GET", "POST"])
@@ -293,54 +2419,542 @@ def change_password():
         confirm_password = request.form.get("confirm_password")
         if new_password == confirm_password:
             # Placeholder: Update the user's password in the database
-            current_user.password = generate_password_hash(new_password, method='sha256')
+            try:
+                current_user.password = password_service.hash(new_password)
+            except PasswordServiceBusy:
+                flash("The server is busy. Please try again in a moment.", "danger")
+                return render_template("change_password.html"), 503
             db.session.commit()
             flash("Password changed successfully", "success")
         else:
             flash("Password and confirmation do not match", "danger")
     return render_template("change_password.html")
 
-# Displaying upcoming special occasions
-@app.route("/special_occasions")
+# Special occasions and their reminders. A reminder goes out OCCASION_REMIND_DAYS ahead of each
+# occurrence: a message is pre-generated for the day and an email queued through the outbox.
+# Scheduler ticks read only the due end of the next_occurs_on index, never every user's rows.
+OCCASION_RECURRENCES = ('yearly', 'once')
+
+# The occasion's date in a given year; Feb 29 falls on Feb 28 outside leap years
+def occurrence_in_year(occurs_on, year):
+    if occurs_on.month == 2 and occurs_on.day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        return date(year, 2, 28)
+    return occurs_on.replace(year=year)
+
+# First occurrence on or after `on_or_after`, or None when a one-off has passed
+def next_occurrence(occurs_on, recurrence, on_or_after):
+    if occurs_on >= on_or_after:
+        return occurs_on
+    if recurrence == 'once':
+        return None
+    candidate = occurrence_in_year(occurs_on, on_or_after.year)
+    if candidate < on_or_after:
+        candidate = occurrence_in_year(occurs_on, on_or_after.year + 1)
+    return candidate
+
+# Queue the reminder email for an occasion, with the message generated for it; the caller commits
+def queue_occasion_reminder_email(user, occasion, occurs_on, romantic_message):
+    email = OutboxEmail(recipient=user.email,
+                        subject=f"Reminder: {occasion.girlfriend_name}'s {occasion.name}",
+                        body=f"Dear {user.username},\n\n"
+                             f"{occasion.girlfriend_name}'s {occasion.name} is on {occurs_on.strftime('%A, %B %d')}. "
+                             f"Here is a message for the day:\n\n'{romantic_message}'\n\n"
+                             f"Cheers,\nThe Romantic Message App")
+    db.session.add(email)
+    return email
+
+# Background scheduler firing due occasion reminders. A reminder is claimed by moving the row's
+# next_occurs_on forward with a conditional UPDATE, in the same transaction as its message and
+# email: only one process's update can match, and a failed batch rolls back its claims too, so
+# several processes can tick the same table without double-firing or losing reminders.
+# Occurrences already in the past (the scheduler was down) are skipped, not sent late.
+class OccasionScheduler:
+    def __init__(self, app):
+        self.app = app
+        self.stats = {"fired": 0, "skipped": 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = None
+
+    def start(self):
+        if self._worker is not None or not self.app.config['OCCASION_SCHEDULER_ENABLED']:
+            return
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="occasion-scheduler", daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.join()
+
+    def tick(self, today=None):
+        # Process batches until nothing is due; returns the number of reminders fired
+        today = today or datetime.utcnow().date()
+        fired = 0
+        while True:
+            claimed, count = self.process_batch(today)
+            fired += claimed
+            if not count:
+                return fired
+
+    # Claim and fire one batch of due occasions; returns (reminders fired, due rows seen)
+    @span("occasion_scheduler.process_batch")
+    def process_batch(self, today):
+        config = self.app.config
+        horizon = today + timedelta(days=config['OCCASION_REMIND_DAYS'])
+        due = (Occasion.query
+               .filter(Occasion.next_occurs_on <= horizon)
+               .order_by(Occasion.next_occurs_on, Occasion.id)
+               .limit(config['OCCASION_BATCH_SIZE'])
+               .all())
+        if not due:
+            return 0, 0
+
+        table = Occasion.__table__
+        claim = (table.update()
+                 .where(table.c.id == bindparam("b_id"), table.c.next_occurs_on == bindparam("b_next_occurs_on")))
+        claimed = {}
+        for occasion in due:
+            occurs_on = occasion.next_occurs_on
+            values = {"next_occurs_on": next_occurrence(occasion.occurs_on, occasion.recurrence,
+                                                        max(occurs_on + timedelta(days=1), today))}
+            if occurs_on >= today:
+                values["last_reminded_on"] = occurs_on
+            updated = db.session.execute(claim.values(**values),
+                                         {"b_id": occasion.id, "b_next_occurs_on": occurs_on}).rowcount
+            if updated and occurs_on >= today:
+                claimed.setdefault(occasion.user_id, []).append((occasion, occurs_on))
+            elif updated:
+                self.stats["skipped"] += 1
+
+        # One bulk insert, version bump and statistics update for the whole batch
+        timestamp = datetime.utcnow()
+        messages = []
+        if claimed:
+            quote = message_quote()
+            for user in User.query.filter(User.id.in_(list(claimed))).options(defer(User.password)):
+                reminders = claimed[user.id]
+                entries = [{"girlfriend_name": occasion.girlfriend_name, "special_moments": occasion.special_moments}
+                           for occasion, _ in reminders]
+                results, rows = compose_romantic_messages(user, entries, timestamp, quote=quote)
+                messages.extend(rows)
+                for (occasion, occurs_on), result in zip(reminders, results):
+                    queue_occasion_reminder_email(user, occasion, occurs_on, result["romantic_message"])
+            insert_messages(messages)
+        db.session.commit()
+        fired = len(messages)
+        self.stats["fired"] += fired
+        if fired:
+            notification_outbox.notify()
+            for user_id in claimed:
+                publish_inserted_messages(user_id, timestamp)
+        return fired, len(due)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.tick()
+                except Exception as e:
+                    logging.error(f"Error firing occasion reminders: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.app.config['OCCASION_TICK_INTERVAL'])
+
+occasion_scheduler = OccasionScheduler(app)
+
+# Web processes run the scheduler too; ticks in several processes are safe
+@app.before_request
+def start_occasion_scheduler():
+    occasion_scheduler.start()
+
+# Fire due reminders once, e.g. from cron when web processes run without the scheduler
+@app.cli.command("send-occasion-reminders")
+def send_occasion_reminders_command():
+    """Generate and queue the reminders for occasions that are due."""
+    click.echo(f"Fired {occasion_scheduler.tick()} occasion reminders.")
+    notification_outbox.stop()
+
+# Validate a new occasion from a JSON or form body; returns an unsaved Occasion
+def parse_occasion(data, user, today):
+    name = data.get("name") or ""
+    if not isinstance(name, str) or len(name) > 100:
+        raise ValueError("name must be a string of at most 100 characters")
+    # The same limits as a message request, since reminders compose a message from these
+    girlfriend_name, special_moments = validate_message_fields(data)
+    name, girlfriend_name = name.strip(), girlfriend_name.strip()
+    recurrence = data.get("recurrence") or "yearly"
+    if not name or not girlfriend_name:
+        raise ValueError("An occasion needs a name and a girlfriend's name")
+    if recurrence not in OCCASION_RECURRENCES:
+        raise ValueError(f"Recurrence must be one of {', '.join(OCCASION_RECURRENCES)}")
+    try:
+        occurs_on = date.fromisoformat(data.get("date") or "")
+    except (TypeError, ValueError):
+        raise ValueError("Date must be YYYY-MM-DD")
+    next_occurs_on = next_occurrence(occurs_on, recurrence, today)
+    if next_occurs_on is None:
+        raise ValueError("Date is in the past")
+    return Occasion(user_id=user.id, name=name, girlfriend_name=girlfriend_name, special_moments=special_moments,
+                    occurs_on=occurs_on, recurrence=recurrence, next_occurs_on=next_occurs_on)
+
+# Displaying upcoming special occasions; JSON clients get the list, and add occasions with a POST
+@app.route("/special_occasions", methods=["GET", "POST"])
 @login_required
 def special_occasions():
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = request.form.to_dict()
+        try:
+            occasion = parse_occasion(data, current_user, datetime.utcnow().date())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        db.session.add(occasion)
+        db.session.commit()
+        return jsonify(occasion.to_dict()), 201
+
     # Retrieve and display upcoming special occasions
-    upcoming_occasions = get_upcoming_occasions()
+    upcoming_occasions = get_upcoming_occasions(current_user)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"occasions": upcoming_occasions})
     return render_template("special_occasions.html", upcoming_occasions=upcoming_occasions)
 
-# Get upcoming special occasions
-def get_upcoming_occasions():
-    # Implement logic to fetch upcoming occasions from a database or external API
-    upcoming_occasions = [
-        {"name": "Anniversary", "date": "2024-05-15"},
-        {"name": "Birthday", "date": "2024-07-22"},
-        # Add more occasions as needed
-    ]
-    return upcoming_occasions
+@app.route("/special_occasions/<int:occasion_id>", methods=["DELETE"])
+@login_required
+def delete_special_occasion(occasion_id):
+    occasion = Occasion.query.filter_by(id=occasion_id, user_id=current_user.id).first_or_404()
+    db.session.delete(occasion)
+    db.session.commit()
+    return "", 204
+
+# Get a user's upcoming special occasions, soonest first (the current user's by default)
+def get_upcoming_occasions(user=None, limit=None):
+    if user is None and has_request_context() and current_user.is_authenticated:
+        user = current_user
+    if user is None:
+        return []
+    occasions = (Occasion.query
+                 .filter(Occasion.user_id == user.id, Occasion.next_occurs_on.isnot(None))
+                 .order_by(Occasion.next_occurs_on, Occasion.id)
+                 .limit(limit or app.config['UPCOMING_OCCASIONS_LIMIT']))
+    return [occasion.to_dict() for occasion in occasions]
+
+# Gift recommendations. Each process keeps an index of the active catalog: per-item price and
+# popularity arrays and, for every category, color and attribute, the sorted positions of the
+# items that have it. A user's preferences select postings; their union is the candidate set,
+# scored in a few vectorized NumPy adds (earlier favorites weigh more) and cut to the top few.
+# Per-user results are cached until the user saves preferences or the catalog changes. Other
+# processes see a preference change once their entry expires (GIFT_CACHE_TTL), and a catalog
+# change at their next check (GIFT_CATALOG_CHECK_INTERVAL).
+GIFT_PREFERENCE_FIELDS = (("category", "categories"), ("color", "colors"), ("attribute", "attributes"))
+GIFT_MAX_PREFERENCES = 10  # Values per preference list
+
+# Built-in starter catalog, used until a catalog is loaded (`flask load-gift-catalog`)
+FALLBACK_GIFTS = [
+    {"sku": "starter-necklace", "name": "Necklace", "category": "Jewelry", "popularity": 0.9},
+    {"sku": "starter-bracelet", "name": "Bracelet", "category": "Jewelry", "popularity": 0.8},
+    {"sku": "starter-earrings", "name": "Earrings", "category": "Jewelry", "popularity": 0.7},
+    {"sku": "starter-photo-frame", "name": "Customized Photo Frame", "category": "Keepsakes",
+     "attributes": "personalized", "popularity": 0.6},
+    {"sku": "starter-love-letter", "name": "Handwritten Love Letter", "category": "Keepsakes",
+     "attributes": "handmade,personalized", "popularity": 0.5},
+    {"sku": "starter-experience-day", "name": "Experience Day", "category": "Experiences", "popularity": 0.4},
+]
+
+def split_values(value):
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+def gift_term(value):
+    return value.strip().lower()
+
+class GiftIndex:
+    # rows: (id, name, category, color, attributes, price, popularity) tuples, in position order
+    def __init__(self, rows, version):
+        import numpy as np
+        self.version = version
+        self.rows = rows
+        self.price = np.array([np.nan if row[5] is None else row[5] for row in rows], dtype=float)
+        self.popularity = np.array([row[6] for row in rows], dtype=float)
+        postings = {}
+        for position, (_, _, category, color, attributes, _, _) in enumerate(rows):
+            terms = {("category", gift_term(category))}
+            if color:
+                terms.add(("color", gift_term(color)))
+            terms.update(("attribute", gift_term(attribute)) for attribute in split_values(attributes or ""))
+            for term in terms:
+                postings.setdefault(term, []).append(position)
+        self.postings = {term: np.array(positions, dtype=np.int64) for term, positions in postings.items()}
+
+    def recommend(self, preferences, weights, limit):
+        import numpy as np
+        if not self.rows:
+            return []
+        terms = []
+        for field, key in GIFT_PREFERENCE_FIELDS:
+            for rank, value in enumerate(preferences.get(key) or ()):
+                posting = self.postings.get((field, gift_term(value)))
+                if posting is not None:
+                    terms.append((posting, weights[field] / (rank + 1)))
+
+        # Without a matching preference every item is a candidate, ranked by popularity
+        candidates = np.unique(np.concatenate([posting for posting, _ in terms])) if terms else np.arange(len(self.rows))
+        scores = weights["popularity"] * self.popularity[candidates]
+        for posting, weight in terms:
+            scores[np.searchsorted(candidates, posting)] += weight
+        if preferences.get("max_price") is not None:
+            affordable = ~(self.price[candidates] > preferences["max_price"])  # Unknown prices stay in
+            candidates, scores = candidates[affordable], scores[affordable]
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort((candidates, -scores))
+        return [self.item(candidates[i], scores[i]) for i in order]
+
+    def item(self, position, score):
+        item_id, name, category, color, _, price, _ = self.rows[position]
+        return {"id": item_id, "name": name, "category": category, "color": color, "price": price,
+                "score": round(float(score), 3)}
+
+# Changes whenever an item is added, updated or retired
+def gift_catalog_version():
+    return tuple(db.session.query(db.func.max(GiftItem.updated_at), db.func.count(GiftItem.id)).one())
+
+def build_gift_index(version):
+    rows = [tuple(row) for row in db.session.query(GiftItem.id, GiftItem.name, GiftItem.category, GiftItem.color,
+                                                   GiftItem.attributes, GiftItem.price, GiftItem.popularity)
+            .filter(GiftItem.active.is_(True)).order_by(GiftItem.id)]
+    if not version[1]:
+        rows = [(None, gift["name"], gift["category"], gift.get("color"), gift.get("attributes", ""), gift.get("price"),
+                 gift["popularity"]) for gift in FALLBACK_GIFTS]
+    return GiftIndex(rows, version)
+
+class GiftRecommender:
+    def __init__(self, ttl, max_entries, check_interval):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries = OrderedDict()  # user id -> (expires, catalog version, recommendations)
+        self._lock = threading.Lock()
+        self._index = None
+        self._index_lock = threading.Lock()
+        self._checked_at = 0.0
+
+    # The index for the current catalog; the catalog version is only read every check_interval
+    def index(self):
+        index = self._index
+        if index is not None and time.monotonic() < self._checked_at + self.check_interval:
+            return index
+        with self._index_lock:
+            if self._index is None or time.monotonic() >= self._checked_at + self.check_interval:
+                version = gift_catalog_version()
+                if self._index is None or self._index.version != version:
+                    with span("gift_recommender.build_index"):
+                        self._index = build_gift_index(version)
+                self._checked_at = time.monotonic()
+            return self._index
+
+    # Recommendations for a preferences dict, computed afresh
+    def recommend(self, preferences, limit=None):
+        return self.index().recommend(preferences, app.config['GIFT_WEIGHTS'], limit or app.config['GIFT_RECOMMENDATIONS'])
+
+    # A user's recommendations, from the cache unless they are stale
+    def for_user(self, user):
+        index = self.index()
+        with self._lock:
+            entry = self._entries.get(user.id)
+            if entry is not None and entry[0] >= time.monotonic() and entry[1] == index.version:
+                self._entries.move_to_end(user.id)
+                self.stats["hits"] += 1
+                return entry[2]
+            self._entries.pop(user.id, None)
+            self.stats["misses"] += 1
+        recommendations = index.recommend(get_user_preferences(user), app.config['GIFT_WEIGHTS'],
+                                          app.config['GIFT_RECOMMENDATIONS'])
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, index.version, recommendations)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return recommendations
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    # The catalog changed in this process: check its version on the next lookup
+    def catalog_changed(self):
+        self._checked_at = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+        with self._index_lock:
+            self._index = None
+            self._checked_at = 0.0
+
+gift_recommender = GiftRecommender(app.config['GIFT_CACHE_TTL'], app.config['GIFT_CACHE_SIZE'],
+                                   app.config['GIFT_CATALOG_CHECK_INTERVAL'])
+
+# Validate one catalog record (from NDJSON or CSV) and turn it into GiftItem values
+def parse_gift_item(record):
+    if not isinstance(record, dict):
+        raise ValueError("Expected an object")
+    values = {}
+    for field, limit in (("sku", 64), ("name", 200), ("category", 50)):
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip() or len(value) > limit:
+            raise ValueError(f"Invalid {field}")
+        values[field] = value.strip()
+    color = record.get("color") or None
+    if color is not None and (not isinstance(color, str) or len(color) > 30):
+        raise ValueError("Invalid color")
+    values["color"] = color
+    attributes = record.get("attributes") or []
+    attributes = split_values(attributes) if isinstance(attributes, str) else attributes
+    if not isinstance(attributes, list) or not all(isinstance(attribute, str) for attribute in attributes):
+        raise ValueError("Invalid attributes")
+    values["attributes"] = ",".join(attribute.strip() for attribute in attributes if attribute.strip())
+    if len(values["attributes"]) > 500:
+        raise ValueError("Invalid attributes")
+    try:
+        price = record.get("price")
+        values["price"] = None if price in (None, "") else float(price)
+        values["popularity"] = float(record.get("popularity") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid price or popularity")
+    if (values["price"] is not None and not values["price"] >= 0) or not 0 <= values["popularity"] <= 1:
+        raise ValueError("Invalid price or popularity")
+    active = record.get("active", True)
+    values["active"] = active if isinstance(active, bool) else str(active).lower() not in ("0", "false", "no")
+    return values
+
+# Add or update one batch of catalog items, matched by sku, and commit
+def save_gift_items(items):
+    items = {item["sku"]: item for item in items}
+    existing = dict(db.session.query(GiftItem.sku, GiftItem.id).filter(GiftItem.sku.in_(list(items))))
+    now = datetime.utcnow()
+    updates = [dict(item, id=existing[sku], updated_at=now) for sku, item in items.items() if sku in existing]
+    inserts = [dict(item, updated_at=now) for sku, item in items.items() if sku not in existing]
+    if updates:
+        db.session.bulk_update_mappings(GiftItem, updates)
+    if inserts:
+        db.session.bulk_insert_mappings(GiftItem, inserts)
+    db.session.commit()
+
+# Load catalog records in batches; returns the number of items added or updated. A bad
+# record stops the load, but the batches saved before it stay (and are picked up) as well.
+def load_gift_catalog(records, batch_size=1000):
+    loaded = 0
+    batch = []
+    try:
+        for record in records:
+            batch.append(parse_gift_item(record))
+            if len(batch) >= batch_size:
+                save_gift_items(batch)
+                loaded += len(batch)
+                batch = []
+        if batch:
+            save_gift_items(batch)
+            loaded += len(batch)
+    finally:
+        gift_recommender.catalog_changed()
+    return loaded
+
+@app.cli.command("load-gift-catalog")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def load_gift_catalog_command(path):
+    """Add or update gift catalog items from an NDJSON or CSV file, matched by sku."""
+    fmt = "csv" if path.endswith(".csv") else "ndjson"
+    with open(path, "rb") as stream:
+        records = iter_import_records(stream, fmt)
+        try:
+            loaded = load_gift_catalog(record for number, record in records)
+        except ValueError as e:
+            raise click.ClickException(f"Invalid catalog record: {e}")
+    click.echo(f"Loaded {loaded} gift catalog items.")
 
 # Display recommended gifts
 @app.route("/recommended_gifts")
 @login_required
 def recommended_gifts():
-    # Retrieve and display recommended gifts based on user preferences
-    user_preferences = get_user_preferences(current_user)
-    recommended_gifts = get_recommendations(user_preferences)
+    # Retrieve and display recommended gifts based on user preferences; usually a cache lookup
+    recommended_gifts = gift_recommender.for_user(current_user)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"gifts": recommended_gifts})
     return render_template("recommended_gifts.html", recommended_gifts=recommended_gifts)
 
+# View or change the current user's gift preferences (JSON or form body)
+@app.route("/gift_preferences", methods=["GET", "POST"])
+@login_required
+def gift_preferences():
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = request.form
+        try:
+            save_user_preferences(current_user, data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(get_user_preferences(current_user))
+
 # Get user preferences
 def get_user_preferences(user):
-    # Implement logic to fetch user preferences from the database
-    # For example, preferred gift categories, favorite colors, etc.
-    return {"favorite_category": "Jewelry", "favorite_color": "Blue"}
-
-# Get gift recommendations
-def get_recommendations(user_preferences):
-    # Implement logic to generate gift recommendations based on preferences
-    # For example, recommend jewelry if it's their favorite category
-    if user_preferences.get("favorite_category") == "Jewelry":
-        return ["Necklace", "Bracelet", "Earrings"]
-    else:
-        return ["Customized Photo Frame", "Handwritten Love Letter", "Experience Day"]
+    stored = db.session.get(GiftPreferences, user.id)
+    preferences = {key: split_values(getattr(stored, key)) if stored else [] for _, key in GIFT_PREFERENCE_FIELDS}
+    preferences["max_price"] = stored.max_price if stored else None
+    # The single favorites earlier versions returned
+    preferences["favorite_category"] = (preferences["categories"] or [None])[0]
+    preferences["favorite_color"] = (preferences["colors"] or [None])[0]
+    return preferences
+
+# Store a user's preferences, most preferred first, and drop their cached recommendations.
+# Preferences missing from `data` keep their stored values.
+def save_user_preferences(user, data):
+    values = {}
+    for _, key in GIFT_PREFERENCE_FIELDS:
+        if key not in data:
+            continue
+        items = data.get(key) or []
+        items = split_values(items) if isinstance(items, str) else items
+        if (not isinstance(items, list) or len(items) > GIFT_MAX_PREFERENCES
+                or not all(isinstance(item, str) and 0 < len(item.strip()) <= 50 and "," not in item for item in items)):
+            raise ValueError(f"{key} must be a list of up to {GIFT_MAX_PREFERENCES} names")
+        values[key] = ",".join(item.strip() for item in items)
+    if "max_price" in data:
+        try:
+            max_price = data.get("max_price")
+            values["max_price"] = None if max_price in (None, "") else float(max_price)
+        except (TypeError, ValueError):
+            raise ValueError("max_price must be a number")
+        if values["max_price"] is not None and not values["max_price"] >= 0:
+            raise ValueError("max_price must be a number")
+
+    stored = db.session.get(GiftPreferences, user.id) or GiftPreferences(user_id=user.id, categories='', colors='', attributes='')
+    for key, value in values.items():
+        setattr(stored, key, value)
+    db.session.add(stored)
+    db.session.commit()
+    gift_recommender.invalidate(user.id)
+
+# Get gift recommendations for a preferences dict (lists of categories, colors and attributes,
+# or a single favorite_category/favorite_color)
+def get_recommendations(user_preferences, limit=None):
+    preferences = dict(user_preferences)
+    for key, favorite in (("categories", "favorite_category"), ("colors", "favorite_color")):
+        if not preferences.get(key) and preferences.get(favorite):
+            preferences[key] = [preferences[favorite]]
+    return gift_recommender.recommend(preferences, limit)
 
 # Displaying user statistics
 @app.route("/user_statistics")
@@ -350,45 +2964,407 @@ def user_statistics():
     message_stats = get_message_statistics(current_user)
     return render_template("user_statistics.html", message_stats=message_stats)
 
-# Get user message generation statistics
-def get_message_statistics(user):
-    # Implement logic to fetch and calculate user-specific message statistics
-    total_messages = user.messages.count()
-    # Count messages created in the last 7 days
-    messages_last_7_days = user.messages.filter(Message.timestamp >= (datetime.utcnow() - timedelta(days=7))).count()
+# Add new messages, given as (timestamp, girlfriend_name) pairs, to a user's counters
+# and daily buckets. Runs in the caller's transaction; the caller commits.
+def record_message_statistics(user_id, messages):
+    buckets = {}
+    for timestamp, girlfriend_name in messages:
+        key = (timestamp.date(), girlfriend_name)
+        buckets[key] = buckets.get(key, 0) + 1
+    if not buckets:
+        return
 
-    return {
-        "total_messages": total_messages,
-        "messages_last_7_days": messages_last_7_days,
-    }
+    _increment(UserStatistics, {"user_id": user_id}, "total_messages", len(messages))
+    if len(buckets) == 1:
+        (day, girlfriend_name), count = next(iter(buckets.items()))
+        _increment(MessageDailyCount, {"user_id": user_id, "day": day, "girlfriend_name": girlfriend_name}, "count", count)
+    else:
+        _increment_daily_counts({(user_id, day, girlfriend_name): count for (day, girlfriend_name), count in buckets.items()})
+
+# The same for message rows across many users (bulk inserts, imports, reminder batches), in a
+# fixed number of statements however many users and buckets there are; the caller commits
+def record_bulk_message_statistics(rows):
+    totals = Counter(row["user_id"] for row in rows)
+    if not totals:
+        return
+    _increment_totals(totals)
+    _increment_daily_counts(Counter((row["user_id"], row["timestamp"].date(), row["girlfriend_name"]) for row in rows))
+
+# Another request can insert the same counter row between our UPDATE and INSERT; the INSERT
+# runs in a savepoint, so the loser rolls back just that and adds to the winner's row instead
+def _increment(model, key, column, amount):
+    updated = (model.query.filter_by(**key)
+               .update({column: getattr(model, column) + amount}, synchronize_session=False))
+    if updated:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **{column: amount}))
+    except IntegrityError:
+        model.query.filter_by(**key).update({column: getattr(model, column) + amount}, synchronize_session=False)
+
+# Insert new counter rows in bulk; if another request inserted one of them first, fall back
+# to incrementing each row on its own
+def _insert_counters(model, key_columns, column, rows):
+    try:
+        with db.session.begin_nested():
+            db.session.bulk_insert_mappings(model, rows)
+    except IntegrityError:
+        for row in rows:
+            _increment(model, {name: row[name] for name in key_columns}, column, row[column])
+
+# Many counters at once: one lookup, one executemany UPDATE and one bulk INSERT, instead of
+# a round trip per counter
+def _increment_totals(totals):
+    table = UserStatistics.__table__
+    existing = {user_id for user_id, in db.session.query(UserStatistics.user_id)
+                .filter(UserStatistics.user_id.in_(list(totals)))}
+    updates = [{"b_user_id": user_id, "b_amount": amount} for user_id, amount in totals.items() if user_id in existing]
+    if updates:
+        db.session.execute(table.update()
+                           .where(table.c.user_id == bindparam("b_user_id"))
+                           .values(total_messages=table.c.total_messages + bindparam("b_amount")), updates)
+    inserts = [{"user_id": user_id, "total_messages": amount} for user_id, amount in totals.items() if user_id not in existing]
+    if inserts:
+        _insert_counters(UserStatistics, ("user_id",), "total_messages", inserts)
+
+# Buckets are keyed by (user_id, day, girlfriend_name)
+def _increment_daily_counts(buckets):
+    table = MessageDailyCount.__table__
+    user_ids = sorted({user_id for user_id, _, _ in buckets})
+    days = [day for _, day, _ in buckets]
+    existing = {(row.user_id, row.day, row.girlfriend_name) for row in MessageDailyCount.query
+                .with_entities(MessageDailyCount.user_id, MessageDailyCount.day, MessageDailyCount.girlfriend_name)
+                .filter(MessageDailyCount.user_id.in_(user_ids), MessageDailyCount.day.between(min(days), max(days)))}
+
+    updates = [{"b_user_id": user_id, "b_day": day, "b_girlfriend_name": girlfriend_name, "b_count": count}
+               for (user_id, day, girlfriend_name), count in buckets.items() if (user_id, day, girlfriend_name) in existing]
+    if updates:
+        db.session.execute(table.update()
+                           .where(table.c.user_id == bindparam("b_user_id"), table.c.day == bindparam("b_day"),
+                                  table.c.girlfriend_name == bindparam("b_girlfriend_name"))
+                           .values(count=table.c.count + bindparam("b_count")), updates)
+    inserts = [{"user_id": user_id, "day": day, "girlfriend_name": girlfriend_name, "count": count}
+               for (user_id, day, girlfriend_name), count in buckets.items() if (user_id, day, girlfriend_name) not in existing]
+    if inserts:
+        _insert_counters(MessageDailyCount, ("user_id", "day", "girlfriend_name"), "count", inserts)
+
+# Get user message generation statistics.
+# Windows count whole UTC days, today included, and are summed from the daily buckets.
+def get_message_statistics(user, windows=(7, 30, 365), top_recipients=5):
+    stats = db.session.get(UserStatistics, user.id)
+    message_stats = {"total_messages": stats.total_messages if stats else 0}
+    if not windows:
+        return message_stats
+
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=max(windows) - 1)
+    per_day = dict(db.session.query(MessageDailyCount.day, db.func.sum(MessageDailyCount.count))
+                   .filter(MessageDailyCount.user_id == user.id, MessageDailyCount.day >= start)
+                   .group_by(MessageDailyCount.day))
+    for days in windows:
+        window_start = today - timedelta(days=days - 1)
+        message_stats[f"messages_last_{days}_days"] = sum(count for day, count in per_day.items() if day >= window_start)
 
-# Placeholder for a route to share messages on social media
+    # Per-recipient breakdown over the shortest window
+    recipients_start = today - timedelta(days=min(windows) - 1)
+    count = db.func.sum(MessageDailyCount.count)
+    message_stats["top_recipients"] = [
+        {"girlfriend_name": girlfriend_name, "messages": total}
+        for girlfriend_name, total in db.session.query(MessageDailyCount.girlfriend_name, count)
+        .filter(MessageDailyCount.user_id == user.id, MessageDailyCount.day >= recipients_start)
+        .group_by(MessageDailyCount.girlfriend_name)
+        .order_by(count.desc(), MessageDailyCount.girlfriend_name)
+        .limit(top_recipients)
+    ]
+    return message_stats
+
+# Compute counters and buckets straight from the message table
+def _count_messages_by_bucket(user_ids=None):
+    day = db.func.date(Message.timestamp)
+    query = (db.session.query(Message.user_id, day, Message.girlfriend_name, db.func.count(Message.id))
+             .group_by(Message.user_id, day, Message.girlfriend_name))
+    if user_ids is not None:
+        query = query.filter(Message.user_id.in_(user_ids))
+    for user_id, bucket_day, girlfriend_name, count in query.yield_per(10000):
+        if isinstance(bucket_day, str):  # SQLite returns date() as text
+            bucket_day = date.fromisoformat(bucket_day)
+        yield user_id, bucket_day, girlfriend_name, count
+
+# Rebuild counters and daily buckets from scratch, for all users or the given ones
+def rebuild_message_statistics(user_ids=None):
+    for model in (MessageDailyCount, UserStatistics):
+        query = model.query
+        if user_ids is not None:
+            query = query.filter(model.user_id.in_(user_ids))
+        query.delete(synchronize_session=False)
+
+    totals = {}
+    buckets = []
+    for user_id, day, girlfriend_name, count in _count_messages_by_bucket(user_ids):
+        totals[user_id] = totals.get(user_id, 0) + count
+        buckets.append({"user_id": user_id, "day": day, "girlfriend_name": girlfriend_name, "count": count})
+    db.session.bulk_insert_mappings(MessageDailyCount, buckets)
+    db.session.bulk_insert_mappings(UserStatistics, [
+        {"user_id": user_id, "total_messages": total} for user_id, total in totals.items()
+    ])
+    db.session.commit()
+    return len(totals)
+
+# Compare stored counters and buckets with the message table; returns the user ids that differ
+def verify_message_statistics(user_ids=None):
+    expected = {}
+    expected_totals = {}
+    for user_id, day, girlfriend_name, count in _count_messages_by_bucket(user_ids):
+        expected[(user_id, day, girlfriend_name)] = count
+        expected_totals[user_id] = expected_totals.get(user_id, 0) + count
+
+    buckets = MessageDailyCount.query
+    totals = UserStatistics.query.filter(UserStatistics.total_messages != 0)
+    if user_ids is not None:
+        buckets = buckets.filter(MessageDailyCount.user_id.in_(user_ids))
+        totals = totals.filter(UserStatistics.user_id.in_(user_ids))
+    actual = {(b.user_id, b.day, b.girlfriend_name): b.count for b in buckets if b.count}
+    actual_totals = {stats.user_id: stats.total_messages for stats in totals}
+
+    mismatched = {key[0] for key in expected.keys() ^ actual.keys()}
+    mismatched.update(key[0] for key in expected.keys() & actual.keys() if expected[key] != actual[key])
+    mismatched.update(user_id for user_id in expected_totals.keys() | actual_totals.keys()
+                      if expected_totals.get(user_id) != actual_totals.get(user_id))
+    return sorted(mismatched)
+
+@app.cli.command("rebuild-stats")
+@click.option("--user-id", "user_ids", type=int, multiple=True, help="Only rebuild these users.")
+@click.option("--verify-only", is_flag=True, help="Report mismatches without rebuilding.")
+def rebuild_stats_command(user_ids, verify_only):
+    """Rebuild per-user message statistics from the message table and verify them."""
+    user_ids = list(user_ids) or None
+    if not verify_only:
+        click.echo(f"Rebuilt statistics for {rebuild_message_statistics(user_ids)} users.")
+    mismatched = verify_message_statistics(user_ids)
+    if mismatched:
+        raise click.ClickException(f"Statistics differ from messages for users: {', '.join(map(str, mismatched))}")
+    click.echo("Statistics match the message table.")
+
+# Share a message on social media. The share becomes a background job and the user is
+# redirected straight away; JSON clients get the job back and can poll /share_jobs/<id>.
 @app.route("/share_on_social_media/<int:message_id>")
 @login_required
 def share_on_social_media(message_id):
-    # Placeholder: Retrieve the message by ID and integrate with social media sharing API
-    message = Message.query.get_or_404(message_id)
-    share_status = share_message_on_social_media(message)
-    
-    if share_status:
-        flash("Message shared on social media successfully!", "success")
-    else:
-        flash("Failed to share message on social media. Please try again later.", "danger")
+    message = Message.query.filter_by(id=message_id, user_id=current_user.id).first_or_404()
+    provider = request.args.get("provider", "default")
+    if provider not in app.config['SHARE_RATE_LIMITS']:
+        return jsonify({"error": "Unknown provider"}), 400
+    job = ShareJob(user_id=current_user.id, message_id=message.id, provider=provider)
+    db.session.add(job)
+    db.session.commit()
+    share_queue.submit(job)
 
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job.to_dict()), 202
+    flash("Your message is being shared on social media.", "info")
     return redirect(url_for("index"))
 
+@app.route("/share_jobs/<int:job_id>")
+@login_required
+def share_job_status(job_id):
+    job = ShareJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return jsonify(job.to_dict())
+
 # Placeholder function to share a message on social media
+@span("share_message_on_social_media")
 def share_message_on_social_media(message):
     # Placeholder: Integrate with a social media sharing API (e.g., Twitter, Facebook)
     try:
-        # Example: Use requests library to post the message to a hypothetical social media API
-        response = requests.post("https://api.example.com/share", data={"message": message.romantic_message})
+        # Example: Post the message to a hypothetical social media API through the shared client
+        response = outbound_client.post(app.config['SOCIAL_SHARE_URL'], data={"message": message.romantic_message})
         return response.status_code == 200
     except Exception as e:
         logging.error(f"Error sharing message on social media: {str(e)}")
         return False
 
+# Token bucket rate limiter; acquire() blocks until a token is available, try_acquire() doesn't
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    # Take a token if one is available, without waiting
+    def try_acquire(self):
+        return not self._take()
+
+    # Take a token and return 0, or return the seconds until one is available
+    def _take(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+# Bounded pool of share workers. ShareJob rows are the durable record either way; the
+# backend decides how workers find due jobs:
+#   database - workers claim due rows with a lease, so several processes can share the table
+#   memory   - due job ids are handed over through an in-process schedule, without polling
+class ShareQueue:
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._schedule = []  # Heap of (due time, job id) for the memory backend
+        self._limiters = {}
+        self._workers = []
+        self._stop = threading.Event()
+
+    @property
+    def backend(self):
+        return self.app.config['SHARE_QUEUE_BACKEND']
+
+    def start(self):
+        if self._workers or not self.app.config['SHARE_WORKER_ENABLED']:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            self._stop.clear()
+            self._workers = [threading.Thread(target=self._run, name=f"share-worker-{i}", daemon=True)
+                             for i in range(self.app.config['SHARE_WORKERS'])]
+            if self.backend == 'memory':
+                # Jobs queued before this process started
+                for job_id, due in (db.session.query(ShareJob.id, ShareJob.next_attempt_at)
+                                    .filter(ShareJob.status.in_(('queued', 'sending')))):
+                    heapq.heappush(self._schedule, (due, job_id))
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._schedule = []  # Reloaded from the database on the next start
+            self._ready.notify_all()
+        for worker in workers:
+            worker.join()
+
+    # Hand a committed job to the workers
+    def submit(self, job):
+        self.start()
+        self._schedule_job(job.id, job.next_attempt_at)
+
+    def _schedule_job(self, job_id, due):
+        with self._lock:
+            if self.backend == 'memory':
+                heapq.heappush(self._schedule, (due, job_id))
+            self._ready.notify()
+
+    def limiter(self, provider):
+        with self._lock:
+            if provider not in self._limiters:
+                self._limiters[provider] = TokenBucket(*self.app.config['SHARE_RATE_LIMITS'][provider])
+            return self._limiters[provider]
+
+    # Claim the next due job, or return None when nothing is due
+    def claim(self):
+        now = datetime.utcnow()
+        if self.backend == 'memory':
+            with self._lock:
+                if not self._schedule or self._schedule[0][0] > now:
+                    return None
+                _, job_id = heapq.heappop(self._schedule)
+            candidates = [job_id]
+        else:
+            candidates = [job_id for job_id, in db.session.query(ShareJob.id)
+                          .filter(ShareJob.status.in_(('queued', 'sending')), ShareJob.next_attempt_at <= now)
+                          .order_by(ShareJob.next_attempt_at, ShareJob.id)
+                          .limit(10)]
+        # Queued jobs, or claims whose lease ran out; only one worker's update can match
+        lease_until = now + timedelta(seconds=self.app.config['SHARE_LEASE'])
+        for job_id in candidates:
+            claimed = (ShareJob.query
+                       .filter(ShareJob.id == job_id, ShareJob.status.in_(('queued', 'sending')),
+                               ShareJob.next_attempt_at <= now)
+                       .update({"status": "sending", "next_attempt_at": lease_until}, synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                return db.session.get(ShareJob, job_id)
+        return None
+
+    def process(self, job):
+        self.limiter(job.provider).acquire()
+        if share_message_on_social_media(job.message):
+            job.status = 'sent'
+        else:
+            job.attempts += 1
+            job.last_error = "Share request failed"
+            if job.attempts >= self.app.config['SHARE_MAX_ATTEMPTS']:
+                job.status = 'failed'
+            else:
+                backoff = self.app.config['SHARE_RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+                job.status = 'queued'
+                job.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff * random.uniform(0.5, 1.0))
+        db.session.commit()
+        if job.status == 'queued':
+            self._schedule_job(job.id, job.next_attempt_at)
+
+    # Process due jobs on the calling thread until none are left; returns how many ran
+    def run_pending(self):
+        processed = 0
+        while True:
+            job = self.claim()
+            if job is None:
+                return processed
+            self.process(job)
+            processed += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = None
+            with self.app.app_context():
+                try:
+                    job = self.claim()
+                    if job is not None:
+                        self.process(job)
+                except Exception as e:
+                    logging.error(f"Error processing share job: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if job is None:
+                with self._lock:
+                    if not self._stop.is_set():
+                        self._ready.wait(self._idle_wait())
+
+    def _idle_wait(self):
+        # Called with the lock held
+        wait = self.app.config['SHARE_POLL_INTERVAL']
+        if self.backend == 'memory' and self._schedule:
+            wait = min(wait, max(0.0, (self._schedule[0][0] - datetime.utcnow()).total_seconds()))
+        return wait
+
+share_queue = ShareQueue(app)
+
+# Start the workers with the process (on its first request), so shares queued before it started,
+# including the memory backend's reload of them, don't wait for a new share
+@app.before_request
+def start_share_queue():
+    share_queue.start()
+
 # ... (Other potential enhancements soon)
 
 if __name__ == "__main__":
+    # Development server: make sure the tables exist first
+    with app.app_context():
+        db.create_all()
     app.run(debug=True)
@@ -0,0 +1,36 @@
+# Benchmark rows per second of /generate_messages/batch versus looping over /generate_message.
+#
+#   python benchmarks/bench_batch.py [messages] [batch size]
+import sys
+import time
+
+from common import bench_user
+from flask_login import login_user
+from app import app, ajax_generate_message, ajax_generate_messages_batch
+
+def run_loop(user, count):
+    for i in range(count):
+        with app.test_request_context('/generate_message', method='POST', json={'girlfriend_name': f'Name {i}'}):
+            login_user(user)
+            ajax_generate_message()
+
+def run_batches(user, count, batch_size):
+    for offset in range(0, count, batch_size):
+        entries = [{'girlfriend_name': f'Name {i}'} for i in range(offset, min(count, offset + batch_size))]
+        with app.test_request_context('/generate_messages/batch', method='POST', json=entries):
+            login_user(user)
+            ajax_generate_messages_batch().get_data()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with app.app_context():
+        user = bench_user()
+        for label, run in (('loop', lambda: run_loop(user, count)), ('batch', lambda: run_batches(user, count, batch_size))):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print(f"{label:>6}: {count} rows in {elapsed:.2f}s ({count / elapsed:.0f} rows/s)")
+
+if __name__ == '__main__':
+    main()
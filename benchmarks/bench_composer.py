@@ -0,0 +1,40 @@
+# Micro-benchmark of in-process message composition, in messages per second on one core.
+#
+#   python benchmarks/bench_composer.py [messages]
+#
+#   cold      - every special-moments text is new: tokenize, rank and fill a template
+#   new seed  - same moments, new seed each time (a user generating again): template fill only
+#   memoized  - identical inputs: served from the message cache
+import sys
+import time
+
+from common import ROOT  # noqa: F401 (puts the app on sys.path)
+from app import app, message_composer, FALLBACK_QUOTES, MESSAGE_TEMPLATES, MessageComposer
+
+MOMENTS = [
+    "Our first date at the beach in Paris, dancing in the rain. Then the late-night pizza when the car broke down!",
+    "We went hiking up Mount Tam and watched the sunset",
+    "Dinner with your parents at Nopa; the surprise party for my birthday",
+    "Stargazing in Joshua Tree",
+]
+
+def run(label, count, inputs):
+    composer = MessageComposer(MESSAGE_TEMPLATES, FALLBACK_QUOTES, app.config['COMPOSER_CACHE_SIZE'])
+    composer.tokenizers()  # Loaded once per process; not part of the per-message cost
+    start = time.perf_counter()
+    for i in range(count):
+        composer.compose(*inputs(i))
+    elapsed = time.perf_counter() - start
+    print(f"{label:>9}: {count / elapsed:10.0f} messages/s  ({elapsed / count * 1e6:.1f}us each)")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    start = time.perf_counter()
+    message_composer.tokenizers()
+    print(f"tokenizers loaded in {(time.perf_counter() - start) * 1000:.0f}ms")
+    run("cold", count, lambda i: ("Emma", f"{MOMENTS[i % len(MOMENTS)]} (day {i})", i))
+    run("new seed", count, lambda i: ("Emma", MOMENTS[i % len(MOMENTS)], i))
+    run("memoized", count, lambda i: ("Emma", MOMENTS[i % len(MOMENTS)], 0))
+
+if __name__ == "__main__":
+    main()
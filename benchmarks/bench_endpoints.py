@@ -0,0 +1,217 @@
+# Load test of the core endpoints through a local threaded WSGI server.
+#
+#   python benchmarks/bench_endpoints.py [--users 100] [--messages 10000] [--clients 8] [--duration 20]
+#                                        [--save-baseline] [--check]
+#
+# Seeds synthetic users and message histories (1k-1M rows), then each client logs in and
+# drives a weighted mix of /generate_message, /get_message_history, /user_statistics,
+# /visualization (page and chart image) and /login. The quote API, SMTP and the social
+# endpoint are local stand-ins. Reports RPS, p50/p95/p99 and DB queries per request per
+# endpoint, and compares them with benchmarks/baseline.json (--save-baseline rewrites it;
+# --check exits non-zero on a regression). Baselines are machine-specific: record one on
+# the machine you compare on. Set PASSWORD_HASH_METHOD to make logins cheaper or dearer.
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+import requests
+from common import ROOT, percentile
+from jinja2 import ChoiceLoader, DictLoader
+from werkzeug.serving import make_server
+from werkzeug.security import generate_password_hash
+from app import (app, db, User, Message, quote_cache, password_service, login_ip_throttle, login_user_throttle,
+                 rebuild_message_statistics, notification_outbox)
+from test_app import FakeQuoteAPI, FakeSMTPServer, FakeUpstream
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+PASSWORD = 'bench password'
+NAMES = ['Alice', 'Beth', 'Carol', 'Dana', 'Emma', 'Fiona', 'Grace', 'Hana']
+
+# Templates some routes render aren't part of this tree; these stand-ins are only used when the
+# real template is missing, and render the same data
+STAND_IN_TEMPLATES = {
+    'message_history.html': '{% for m in message_history %}<p>{{ m.girlfriend_name }}: {{ m.romantic_message }} '
+                            '{{ m.timestamp }}</p>{% endfor %}{{ next_cursor }}',
+    'user_statistics.html': '{% for key, value in message_stats.items() %}<p>{{ key }}: {{ value }}</p>{% endfor %}',
+    'data_visualization.html': '<img src="{{ chart_url }}">',
+    'login.html': '<form method="post"></form>',
+}
+
+# (name, weight, method, path, expected status)
+OPERATIONS = [
+    ('generate_message', 20, 'POST', '/generate_message', 200),
+    ('get_message_history', 30, 'GET', '/get_message_history', 200),
+    ('user_statistics', 15, 'GET', '/user_statistics', 200),
+    ('visualization', 10, 'GET', '/visualization', 200),
+    ('visualization_chart', 10, 'GET', '/visualization/messages_per_day.png?days=30', 200),
+    ('login', 5, 'POST', '/login', 302),
+]
+
+def seed(users, messages):
+    db.create_all()
+    existing = User.query.filter(User.username.like('bench%')).count()
+    if existing >= users:
+        return
+    pwhash = generate_password_hash(PASSWORD, password_service.method, password_service.salt_length)
+    db.session.bulk_insert_mappings(User, [
+        {'username': f'bench{i}', 'password': pwhash, 'email': f'bench{i}@example.com'} for i in range(existing, users)
+    ])
+    db.session.commit()
+    user_ids = [user_id for user_id, in User.query.with_entities(User.id).filter(User.username.like('bench%'))]
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    for start in range(0, messages, 10000):
+        db.session.execute(Message.__table__.insert(), [
+            {'user_id': rng.choice(user_ids), 'girlfriend_name': rng.choice(NAMES),
+             'romantic_message': f'Message {i}, love grows stronger every day.',
+             'timestamp': now - timedelta(seconds=rng.randrange(365 * 24 * 60 * 60))}
+            for i in range(start, min(start + 10000, messages))
+        ])
+        db.session.commit()
+    rebuild_message_statistics()
+
+def log_in(base_url, username):
+    session = requests.Session()
+    response = session.post(f'{base_url}/login', data={'username': username, 'password': PASSWORD}, allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f'Login as {username} failed with {response.status_code}')
+    return session
+
+def client(base_url, index, users, deadline, results):
+    rng = random.Random(index)
+    session = log_in(base_url, f'bench{index % users}')
+    names, weights = [op[0] for op in OPERATIONS], [op[1] for op in OPERATIONS]
+    operations = {op[0]: op for op in OPERATIONS}
+    while time.monotonic() < deadline:
+        name, _, method, path, expected = operations[rng.choices(names, weights)[0]]
+        kwargs = {'allow_redirects': False}
+        requester = session
+        if name == 'generate_message':
+            kwargs['json'] = {'girlfriend_name': rng.choice(NAMES), 'special_moments': 'Our first date'}
+        elif name == 'login':
+            requester = requests.Session()
+            kwargs['data'] = {'username': f'bench{rng.randrange(users)}', 'password': PASSWORD}
+        start = time.perf_counter()
+        response = requester.request(method, base_url + path, **kwargs)
+        elapsed = time.perf_counter() - start
+        results.append((name, elapsed, int(response.headers.get('X-DB-Queries', 0)), response.status_code == expected))
+
+def summarize(results, duration):
+    summary = {}
+    for name, *_ in OPERATIONS:
+        samples = [r for r in results if r[0] == name]
+        if not samples:
+            continue
+        latencies = [r[1] * 1000 for r in samples]
+        summary[name] = {
+            'requests': len(samples),
+            'rps': round(len(samples) / duration, 2),
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'queries': round(sum(r[2] for r in samples) / len(samples), 2),
+            'errors': sum(1 for r in samples if not r[3]),
+        }
+    return summary
+
+# Regressions against the baseline: 25% slower p95, 25% fewer RPS, or more queries per request
+def compare(summary, baseline, tolerance=0.25):
+    regressions = []
+    print(f"\n{'vs baseline':<22}{'rps':>9}{'p95':>9}{'queries':>9}")
+    for name, result in summary.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        rps, p95 = result['rps'] / base['rps'] - 1, result['p95'] / base['p95'] - 1
+        print(f"{name:<22}{rps:+9.0%}{p95:+9.0%}{result['queries'] - base['queries']:+9.1f}")
+        if p95 > tolerance or rps < -tolerance or result['queries'] > base['queries'] + 0.5:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    holder = unittest.TestCase()
+    quotes = FakeQuoteAPI(['Love is patient, love is kind', 'You are my sunshine'])
+    holder.addCleanup(quotes.close)
+    social = FakeUpstream([(200, 0.0)])
+    holder.addCleanup(social.close)
+    FakeSMTPServer().install(holder)
+    quote_cache.url = quotes.url
+    app.config.update(SOCIAL_SHARE_URL=social.url, RECORD_QUERY_COUNTS=True, OUTBOX_WORKER_ENABLED=True)
+    # Logins all come from 127.0.0.1 here; throttling them would measure the throttle
+    for throttle in (login_ip_throttle, login_user_throttle):
+        throttle.rate, throttle.burst = 1e9, 1e9
+    app.jinja_loader = ChoiceLoader([app.jinja_loader, DictLoader(STAND_IN_TEMPLATES)])
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with app.app_context():
+        start = time.perf_counter()
+        seed(args.users, args.messages)
+        print(f"seeded {args.users} users, {Message.query.count()} messages in {time.perf_counter() - start:.1f}s")
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    # One untimed pass over every endpoint, so lazy imports and first-use setup aren't measured
+    session = log_in(base_url, 'bench0')
+    session.post(f'{base_url}/generate_message', json={'girlfriend_name': 'Alice'})
+    for name, _, method, path, expected in OPERATIONS:
+        if method == 'GET':
+            session.get(base_url + path)
+
+    results = []
+    deadline = time.monotonic() + args.duration
+    clients = [threading.Thread(target=client, args=(base_url, i, args.users, deadline, results))
+               for i in range(args.clients)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.perf_counter() - start
+    server.shutdown()
+    notification_outbox.stop()
+    holder.doCleanups()
+
+    summary = summarize(results, duration)
+    print(f"\n{args.clients} clients, {duration:.1f}s, {len(results) / duration:.1f} requests/s in total")
+    print(f"{'endpoint':<22}{'requests':>9}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'errors':>8}")
+    for name, result in summary.items():
+        print(f"{name:<22}{result['requests']:>9}{result['rps']:>8.1f}{result['p50']:>8.1f}ms{result['p95']:>7.1f}ms"
+              f"{result['p99']:>7.1f}ms{result['queries']:>9.1f}{result['errors']:>8}")
+
+    scale = {'users': args.users, 'messages': args.messages, 'clients': args.clients}
+    if args.save_baseline:
+        with open(BASELINE, 'w') as baseline:
+            json.dump({'scale': scale, 'results': summary}, baseline, indent=2, sort_keys=True)
+            baseline.write('\n')
+        print(f"\nSaved baseline to {BASELINE}")
+    elif os.path.exists(BASELINE):
+        with open(BASELINE) as baseline:
+            stored = json.load(baseline)
+        if stored['scale'] != scale:
+            print(f"\nBaseline was recorded at {stored['scale']}; comparing anyway")
+        regressions = compare(summary, stored['results'])
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}")
+            if args.check:
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
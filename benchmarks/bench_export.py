@@ -0,0 +1,62 @@
+# Benchmark bulk import and streaming export of one user's messages.
+#
+#   python benchmarks/bench_export.py [messages]
+#
+# The import body is an NDJSON file streamed from disk; exports are consumed chunk by
+# chunk and discarded, as a client download would. Peak RSS is reported after each phase:
+# it should stay flat however many messages there are.
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from common import bench_user
+from flask_login import login_user
+from app import app, db, User, Message, export_messages, import_messages_route
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def write_import_body(path, count):
+    rng = random.Random(42)
+    with open(path, "w") as body:
+        for i in range(count):
+            body.write(json.dumps({"girlfriend_name": f"Name {i % 50}",
+                                   "romantic_message": f"Message {i} " + "love " * rng.randint(5, 20),
+                                   "timestamp": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T{i % 24:02d}:00:00"}) + "\n")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    scratch = tempfile.mkdtemp()
+    path = os.path.join(scratch, "import.ndjson")
+    write_import_body(path, count)
+
+    with app.app_context():
+        user_id = bench_user().id
+        print(f"{count} messages, {os.path.getsize(path) / 2 ** 20:.0f}MB of NDJSON; peak RSS before: {peak_rss_mb():.0f}MB")
+
+        with open(path, "rb") as body, app.test_request_context(
+                "/import/messages", method="POST", input_stream=body,
+                content_type="application/x-ndjson", content_length=os.path.getsize(path)):
+            login_user(db.session.get(User, user_id))
+            start = time.perf_counter()
+            response, status = import_messages_route()
+            elapsed = time.perf_counter() - start
+        assert status == 200 and response.get_json()["imported"] == count, response.get_json()
+        print(f"import:         {count / elapsed:9.0f} rows/s  {elapsed:6.1f}s  peak RSS {peak_rss_mb():.0f}MB")
+
+        for fmt in ("ndjson", "csv", "ndjson.gz"):
+            with app.test_request_context(f"/export/messages.{fmt}"):
+                login_user(db.session.get(User, user_id))
+                start = time.perf_counter()
+                size = sum(len(chunk) for chunk in export_messages(fmt).response)
+                elapsed = time.perf_counter() - start
+            print(f"export {fmt:9}: {count / elapsed:9.0f} rows/s  {elapsed:6.1f}s  {size / 2 ** 20:6.0f}MB  "
+                  f"peak RSS {peak_rss_mb():.0f}MB")
+        assert Message.query.filter_by(user_id=user_id).count() == count
+
+if __name__ == "__main__":
+    main()
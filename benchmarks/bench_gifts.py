@@ -0,0 +1,112 @@
+# Benchmark gift recommendations over a large catalog.
+#
+#   python benchmarks/bench_gifts.py [items] [--users 1000]
+#
+# Loads a synthetic catalog (100k items by default: 40 categories, 16 colors and a long tail of
+# attributes), then times building the index, scoring preferences against it uncached (with a
+# pure Python scan of the catalog for comparison), a cached per-user lookup, and GET
+# /recommended_gifts for users whose recommendations are cached, with its DB queries.
+import argparse
+import random
+import time
+
+from common import percentile
+from app import (app, db, User, GiftItem, gift_recommender, load_gift_catalog, save_user_preferences, split_values,
+                 gift_term)
+
+CATEGORIES = [f"category{i}" for i in range(40)]
+COLORS = ["red", "blue", "green", "gold", "silver", "black", "white", "pink", "purple", "orange", "yellow", "brown",
+          "grey", "navy", "teal", "beige"]
+ATTRIBUTES = [f"attribute{i}" for i in range(500)]
+
+def catalog(count, rng):
+    for i in range(count):
+        yield {"sku": f"item{i}", "name": f"Gift {i}", "category": rng.choice(CATEGORIES), "color": rng.choice(COLORS),
+               "attributes": rng.sample(ATTRIBUTES[:rng.choice((20, 100, 500))], rng.randint(1, 4)),
+               "price": round(rng.uniform(5, 500), 2), "popularity": round(rng.random() ** 3, 3)}
+
+def preferences(rng):
+    return {"categories": rng.sample(CATEGORIES, 2), "colors": rng.sample(COLORS, 2),
+            "attributes": rng.sample(ATTRIBUTES[:100], 3), "max_price": rng.choice((None, 50, 150))}
+
+# The same scoring as GiftIndex, one item at a time in Python
+def python_scan(rows, prefs, weights, limit):
+    scored = []
+    for item_id, _, category, color, attributes, price, popularity in rows:
+        if prefs["max_price"] is not None and price is not None and price > prefs["max_price"]:
+            continue
+        score = 0.0
+        for rank, value in enumerate(prefs["categories"]):
+            score += weights["category"] / (rank + 1) if gift_term(value) == gift_term(category) else 0
+        for rank, value in enumerate(prefs["colors"]):
+            score += weights["color"] / (rank + 1) if gift_term(value) == gift_term(color) else 0
+        terms = {gift_term(attribute) for attribute in split_values(attributes)}
+        for rank, value in enumerate(prefs["attributes"]):
+            score += weights["attribute"] / (rank + 1) if gift_term(value) in terms else 0
+        if score:
+            scored.append((-(score + weights["popularity"] * popularity), item_id))
+    return sorted(scored)[:limit]
+
+def timings(fn, samples):
+    latencies = []
+    for sample in samples:
+        start = time.perf_counter()
+        fn(sample)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return f"p50 {percentile(latencies, 50):.3f}ms p99 {percentile(latencies, 99):.3f}ms"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('items', type=int, nargs='?', default=100000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    app.config.update(RECORD_QUERY_COUNTS=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        if GiftItem.query.count() < args.items:
+            load_gift_catalog(catalog(args.items, rng), batch_size=5000)
+        print(f"catalog: {GiftItem.query.count()} items loaded in {time.perf_counter() - start:.1f}s")
+        existing = User.query.count()
+        db.session.execute(User.__table__.insert(), [
+            {"username": f"bench{i}", "password": "x", "email": f"bench{i}@example.com"} for i in range(existing, args.users)
+        ])
+        db.session.commit()
+        users = User.query.order_by(User.id).limit(args.users).all()
+        user_ids = [user.id for user in users]
+        for user in users:
+            save_user_preferences(user, preferences(rng))
+
+        start = time.perf_counter()
+        index = gift_recommender.index()
+        print(f"index: {len(index.rows)} items, {len(index.postings)} postings, built in "
+              f"{(time.perf_counter() - start) * 1000:.0f}ms")
+
+        weights, limit = app.config['GIFT_WEIGHTS'], app.config['GIFT_RECOMMENDATIONS']
+        samples = [preferences(rng) for _ in range(500)]
+        print(f"uncached scoring:  {timings(gift_recommender.recommend, samples)}")
+        print(f"python scan:       {timings(lambda prefs: python_scan(index.rows, prefs, weights, limit), samples[:20])}")
+        for user in users:
+            gift_recommender.for_user(user)
+        print(f"cached lookup:     {timings(gift_recommender.for_user, users)}")
+
+    client = app.test_client()
+    queries = []
+
+    def request(user_id):
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+        response = client.get("/recommended_gifts", headers={"Accept": "application/json"})
+        queries.append(int(response.headers.get("X-DB-Queries", 0)))
+        assert response.status_code == 200 and response.get_json()["gifts"]
+
+    for user_id in user_ids:
+        request(user_id)  # Warms the user loader cache as well
+    queries.clear()
+    print(f"GET /recommended_gifts (cached): {timings(request, user_ids)}, "
+          f"{sum(queries) / len(queries):.2f} queries per request; cache {gift_recommender.stats}")
+
+if __name__ == '__main__':
+    main()
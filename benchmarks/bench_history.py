@@ -0,0 +1,46 @@
+# Benchmark message history paging for a heavy user: OFFSET/COUNT versus keyset cursors.
+#
+#   python benchmarks/bench_history.py [rows]
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import bench_user
+from app import app, db, Message, encode_history_cursor, get_message_history_page
+
+def seed(user, rows, chunk=50000):
+    existing = user.messages.count()
+    start = datetime(2020, 1, 1)
+    for offset in range(existing, rows, chunk):
+        db.session.bulk_insert_mappings(Message, [
+            {"user_id": user.id, "girlfriend_name": f"Name {i % 50}", "romantic_message": f"Message {i}",
+             "timestamp": start + timedelta(seconds=i // 2)}
+            for i in range(offset, min(rows, offset + chunk))
+        ])
+        db.session.commit()
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    per_page = app.config['RESULTS_PER_PAGE']
+    with app.app_context():
+        user = bench_user()
+        seed(user, rows)
+        ordered = user.messages.order_by(Message.timestamp.desc(), Message.id.desc())
+
+        for depth in (0, rows // 2, rows - per_page - 1):
+            # The cursor a client would hold after paging down to this depth
+            cursor = encode_history_cursor(ordered.offset(depth).first()) if depth else None
+            offset_ms = timed(lambda: (ordered.offset(depth).limit(per_page).all(), user.messages.count()))
+            keyset_ms = timed(lambda: get_message_history_page(user, cursor=cursor))
+            print(f"depth {depth:>8}: offset+count={offset_ms:8.2f}ms keyset={keyset_ms:8.2f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Benchmark server CPU spent per minute on 1,000 idle clients watching their message history:
+# full 30-second polling, conditional (ETag) polling, and Server-Sent Events streams.
+#
+#   python benchmarks/bench_idle_clients.py [clients] [stream window seconds]
+#
+# The app runs in a local threaded WSGI server in a child process, and clients are real HTTP
+# connections with a logged-in session cookie, so the user loader, cookies and the server's
+# per-connection work are all measured. Only the server process's CPU time is counted.
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+from common import bench_user
+from werkzeug.serving import make_server
+from werkzeug.security import generate_password_hash
+from app import app, db, insert_messages, password_service
+
+POLLS_PER_MINUTE = 2  # One poll every 30 seconds
+PASSWORD = 'bench password'
+
+# Serve the app, and answer with this process's CPU time until told to stop
+def serve(conn):
+    with app.app_context():
+        db.engine.dispose()
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    conn.send(server.server_port)
+    while conn.recv():
+        conn.send(time.process_time())
+    server.shutdown()
+    password_service.shutdown()
+
+def server_cpu(conn):
+    conn.send(True)
+    return conn.recv()
+
+def cpu_per_minute_polling(conn, session, url, clients, conditional, sample=500):
+    headers = {'If-None-Match': session.get(url).headers['ETag']} if conditional else {}
+    start = server_cpu(conn)
+    for _ in range(sample):
+        response = session.get(url, headers=headers)
+        assert response.status_code == (304 if conditional else 200)
+    per_poll = (server_cpu(conn) - start) / sample
+    return per_poll * clients * POLLS_PER_MINUTE
+
+def cpu_per_minute_streaming(conn, session, url, clients, window):
+    # Resuming from event 0 sends the backlog at once, so each stream is open once its headers are in
+    streams = []
+    for _ in range(clients):
+        stream = requests.Session()
+        stream.cookies.update(session.cookies)
+        streams.append(stream.get(f'{url}?last_event_id=0', stream=True))
+        assert streams[-1].status_code == 200
+    start = server_cpu(conn)
+    time.sleep(window)
+    cpu = server_cpu(conn) - start
+    for stream in streams:
+        stream.close()
+    return cpu * 60 / window
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    window = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    app.config.update(HISTORY_STREAM_ENABLED=True)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with app.app_context():
+        user = bench_user()
+        user.password = generate_password_hash(PASSWORD, password_service.method, password_service.salt_length)
+        insert_messages([{'user_id': user.id, 'girlfriend_name': 'Alice', 'romantic_message': 'Every day with you',
+                          'timestamp': datetime.utcnow()}])
+        db.session.commit()
+        username = user.username
+        db.session.remove()
+        db.engine.dispose()
+
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.get_context('fork').Process(target=serve, args=(child_conn,))
+    server.start()
+    try:
+        base_url = f'http://127.0.0.1:{conn.recv()}'
+        session = requests.Session()
+        response = session.post(f'{base_url}/login', data={'username': username, 'password': PASSWORD},
+                                allow_redirects=False)
+        if response.status_code != 302:
+            raise RuntimeError(f'Login failed with {response.status_code}')
+        print(f"full polling:        "
+              f"{cpu_per_minute_polling(conn, session, f'{base_url}/api/messages', clients, False):.3f} CPU s/min")
+        print(f"conditional polling: "
+              f"{cpu_per_minute_polling(conn, session, f'{base_url}/api/messages', clients, True):.3f} CPU s/min")
+        print(f"event streams:       "
+              f"{cpu_per_minute_streaming(conn, session, f'{base_url}/api/messages/stream', clients, window):.3f} CPU s/min")
+    finally:
+        conn.send(False)
+        server.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Benchmark login verification throughput and /generate_message latency during a login storm.
+#
+#   python benchmarks/bench_logins.py [storm threads] [seconds]
+#
+# Storm threads verify passwords back to back, as a flood of login requests would, while
+# one client generates messages. "inline" verifies on the request threads with no admission
+# limit (the old behaviour with a slow KDF); "pool" uses the process pool and the pending limit.
+import sys
+import threading
+import time
+
+from common import bench_user, percentile
+from flask_login import login_user
+from werkzeug.security import generate_password_hash
+from app import app, db, User, PasswordService, PasswordServiceBusy, generate_romantic_message
+
+METHOD = 'pbkdf2:sha256:260000'
+
+def storm(service, pwhash, stop, counts):
+    while not stop.is_set():
+        try:
+            service.verify(pwhash, 'correct horse')
+            counts['verified'] += 1
+        except PasswordServiceBusy:
+            counts['rejected'] += 1
+            time.sleep(0.01)  # A rejected client backs off briefly
+
+def generate(user_id, stop, latencies):
+    with app.app_context():
+        while not stop.is_set():
+            with app.test_request_context('/generate_message', method='POST'):
+                login_user(db.session.get(User, user_id))
+                start = time.perf_counter()
+                generate_romantic_message('Alice', 'Paris')
+                latencies.append(time.perf_counter() - start)
+            time.sleep(0.05)
+
+def run(mode, threads, seconds, user_id):
+    if mode == 'inline':
+        service = PasswordService(METHOD, 16, workers=0, max_pending=threads, timeout=60)
+    else:
+        service = PasswordService(METHOD, 16, workers=app.config['PASSWORD_WORKERS'],
+                                  max_pending=app.config['PASSWORD_MAX_PENDING'], timeout=60)
+        service.verify(service.hash('warm up'), 'warm up')  # Start the pool outside the measurement
+    pwhash = generate_password_hash('correct horse', METHOD, 16)
+    stop = threading.Event()
+    counts = {'verified': 0, 'rejected': 0}
+    latencies = []
+    workers = [threading.Thread(target=storm, args=(service, pwhash, stop, counts)) for _ in range(threads)]
+    workers.append(threading.Thread(target=generate, args=(user_id, stop, latencies)))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    service.shutdown()
+    print(f"{mode:>6}: {counts['verified'] / seconds:6.1f} logins/s  {counts['rejected']:6d} rejected  "
+          f"generate p50={percentile(latencies, 50) * 1000:7.1f}ms p99={percentile(latencies, 99) * 1000:7.1f}ms "
+          f"({len(latencies)} requests)")
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with app.app_context():
+        user_id = bench_user().id
+    print(f"{threads} storm threads, {app.config['PASSWORD_WORKERS']} hashing processes, {METHOD}")
+    for mode in ('inline', 'pool'):
+        run(mode, threads, seconds, user_id)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Benchmark occasion reminder ticks over a large occasions table.
+#
+#   python benchmarks/bench_occasions.py [occasions] [--users 20000] [--processes 4]
+#
+# Seeds yearly occasions (1M by default) with dates spread over the year, then times a tick that
+# fires a day's reminders (about occasions * (OCCASION_REMIND_DAYS + 1) / 365 of them) and an
+# idle tick right after, against a scan of every row for the same day. --processes then fires
+# the following day's reminders from several processes ticking at once, and checks that every
+# due occasion fired exactly once.
+import argparse
+import multiprocessing
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import common  # noqa: F401 (import path and a throwaway database)
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from app import app, db, User, Occasion, OutboxEmail, occasion_scheduler, message_composer, next_occurrence
+
+NAMES = ['Alice', 'Beth', 'Carol', 'Dana', 'Emma', 'Fiona', 'Grace', 'Hana']
+OCCASIONS = ['Birthday', 'Anniversary', 'First date', 'Name day']
+
+def seed(count, users, today, chunk=50000):
+    db.create_all()
+    existing = User.query.count()
+    if existing < users:
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'bench{i}', 'password': 'x', 'email': f'bench{i}@example.com'} for i in range(existing, users)
+        ])
+        db.session.commit()
+    user_ids = [user_id for user_id, in db.session.query(User.id)]
+    rng = random.Random(42)
+    for start in range(Occasion.query.count(), count, chunk):
+        rows = []
+        for _ in range(start, min(count, start + chunk)):
+            occurs_on = date(rng.randrange(1980, 2020), 1, 1) + timedelta(days=rng.randrange(365))
+            rows.append({'user_id': rng.choice(user_ids), 'name': rng.choice(OCCASIONS), 'girlfriend_name': rng.choice(NAMES),
+                         'special_moments': 'Our first dance in the rain at the Lisbon harbour', 'occurs_on': occurs_on,
+                         'recurrence': 'yearly', 'next_occurs_on': next_occurrence(occurs_on, 'yearly', today),
+                         'created_at': datetime.utcnow()})
+        db.session.execute(Occasion.__table__.insert(), rows)
+        db.session.commit()
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+# One process's share of a tick; the database may be locked by another process's batch
+def tick_in_process(today):
+    with app.app_context():
+        db.engine.dispose()
+        fired = occasion_scheduler.stats['fired']
+        while True:
+            try:
+                occasion_scheduler.tick(today)
+                return occasion_scheduler.stats['fired'] - fired
+            except OperationalError:
+                db.session.rollback()
+                time.sleep(random.uniform(0.01, 0.05))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('occasions', type=int, nargs='?', default=1000000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+    today = date(2025, 6, 1)
+    lead = app.config['OCCASION_REMIND_DAYS']
+
+    with app.app_context():
+        start = time.perf_counter()
+        seed(args.occasions, args.users, today)
+        print(f"seeded {Occasion.query.count()} occasions for {User.query.count()} users "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT * FROM occasion WHERE next_occurs_on <= :horizon "
+            "ORDER BY next_occurs_on, id LIMIT 500"), {'horizon': today}).fetchall()
+        print(f"due query plan: {plan[0][-1]}")
+
+        # What a tick without the index has to do: look at every row for this day's month and day
+        days = [(today + timedelta(days=i)).strftime('%m-%d') for i in range(lead + 1)]
+        _, scan_ms = timed(lambda: Occasion.query.filter(func.strftime('%m-%d', Occasion.occurs_on).in_(days)).all())
+
+        message_composer.tokenizers()  # Loaded once per process; not part of a tick
+        fired, tick_ms = timed(lambda: occasion_scheduler.tick(today))
+        _, idle_ms = timed(lambda: occasion_scheduler.tick(today))
+        print(f"tick: {fired} reminders in {tick_ms:.0f}ms ({fired / tick_ms * 1000:.0f}/s); "
+              f"idle tick {idle_ms:.2f}ms; full scan for the same day {scan_ms:.0f}ms")
+
+    if args.processes > 1:
+        following = today + timedelta(days=1)
+        with app.app_context():
+            due = Occasion.query.filter(Occasion.next_occurs_on == following + timedelta(days=lead)).count()
+            emails = OutboxEmail.query.count()
+            db.session.remove()
+            db.engine.dispose()
+        start = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(args.processes) as pool:
+            fired = pool.map(tick_in_process, [following] * args.processes)
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            queued = OutboxEmail.query.count() - emails
+            reminded = Occasion.query.filter(Occasion.last_reminded_on == following + timedelta(days=lead)).count()
+        print(f"{args.processes} processes: fired {fired} = {sum(fired)} of {due} due in {elapsed * 1000:.0f}ms; "
+              f"{queued} emails queued, {reminded} occasions reminded")
+        if not sum(fired) == due == queued == reminded:
+            raise SystemExit("Reminders were lost or fired twice")
+
+if __name__ == '__main__':
+    main()
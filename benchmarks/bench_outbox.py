@@ -0,0 +1,45 @@
+# Benchmark /generate_message latency with the notification outbox versus sending inline.
+#
+#   python benchmarks/bench_outbox.py [requests]
+#
+# Inline sending is emulated by draining the outbox before the response returns,
+# against a local stand-in SMTP server.
+import statistics
+import sys
+import time
+import unittest
+
+from common import bench_user, percentile
+from flask_login import login_user
+from app import app, ajax_generate_message, notification_outbox
+from test_app import FakeSMTPServer
+
+def run(user, count, inline):
+    samples = []
+    for i in range(count):
+        with app.test_request_context('/generate_message', method='POST',
+                                      json={'girlfriend_name': f'Name {i}', 'special_moments': 'Our first date'}):
+            login_user(user)
+            start = time.perf_counter()
+            ajax_generate_message()
+            if inline:
+                notification_outbox.drain()
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    holder = unittest.TestCase()
+    smtp = FakeSMTPServer()
+    smtp.install(holder)
+    with app.app_context():
+        user = bench_user()
+        for label, inline in (('inline', True), ('outbox', False)):
+            samples = run(user, count, inline)
+            print(f"{label:>7}: p50={percentile(samples, 50):.2f}ms p99={percentile(samples, 99):.2f}ms "
+                  f"mean={statistics.mean(samples):.2f}ms")
+        notification_outbox.drain()
+    holder.doCleanups()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Benchmark message search latency against a LIKE '%term%' scan.
+#
+#   python benchmarks/bench_search.py [messages] [--memory]
+#
+# Messages belong to one heavy user and draw words from a Zipf-like vocabulary, so queries
+# range from rare to common terms. --memory also times the in-process inverted index.
+# The LIKE scan is unranked and stops at the first page, so it only wins on common terms;
+# search ranks every match, and rare terms show what the index saves.
+import itertools
+import random
+import sys
+import time
+
+from common import bench_user
+from app import app, db, Message, message_search
+
+WORDS = ("love heart forever sunset beach moon stars kiss dance smile dream together always promise "
+         "adventure sunshine rain coffee paris garden song laugh sweet tender journey home").split()
+VOCABULARY = WORDS + [f"word{i}" for i in range(50000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+QUERIES = ("love", "garden", "word4000", "word40000", "adv*", "paris garden")
+
+def seed(user, count, chunk=50000):
+    rng = random.Random(42)
+    cumulative = list(itertools.accumulate(WEIGHTS))
+    for offset in range(user.messages.count(), count, chunk):
+        db.session.bulk_insert_mappings(Message, [
+            {"user_id": user.id, "girlfriend_name": rng.choice(("Alice", "Beth", "Carol")),
+             "romantic_message": " ".join(rng.choices(VOCABULARY, cum_weights=cumulative, k=12))}
+            for _ in range(offset, min(count, offset + chunk))
+        ])
+        db.session.commit()
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    backends = ['auto', 'memory'] if '--memory' in sys.argv else ['auto']
+    with app.app_context():
+        user = bench_user()
+        seed(user, count)
+        for backend in backends:
+            app.config['SEARCH_BACKEND'] = backend
+            message_search.reset()
+            start = time.perf_counter()
+            message_search.search(user.id, "warmup")
+            print(f"{message_search.engine}: first search (index warm-up) {(time.perf_counter() - start) * 1000:.0f}ms")
+            for query in QUERIES:
+                words = [word.rstrip("*") for word in query.split()]
+                search_ms = timed(lambda: message_search.search(user.id, query))
+                like_ms = timed(lambda: Message.query.filter(Message.user_id == user.id, *[
+                    Message.romantic_message.like(f"%{word}%") for word in words]).limit(20).all())
+                print(f"  {query!r:>24}: search={search_ms:8.2f}ms  LIKE scan={like_ms:8.2f}ms")
+
+if __name__ == '__main__':
+    main()
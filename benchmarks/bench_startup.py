@@ -0,0 +1,74 @@
+# Benchmark worker cold start: import time (python -X importtime), RSS after import,
+# and the time from spawning a server process to its first HTTP response.
+#
+#   python benchmarks/bench_startup.py [runs]
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from common import ROOT
+
+HEAVY_MODULES = ('matplotlib', 'numpy', 'nltk')
+
+def python(*args, **kwargs):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True, **kwargs)
+
+def import_time():
+    # Returns the cumulative import time of `app` in ms and the slowest modules it pulled in
+    stderr = python("-X", "importtime", "-c", "import app").stderr
+    modules = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            modules.append((int(match.group(2)) / 1000, match.group(4).strip()))
+    total = next(ms for ms, name in modules if name == "app")
+    return total, sorted(modules, reverse=True)[1:6]
+
+def import_rss():
+    code = ("import resource, sys, app; "
+            "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss); "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    rss, heavy = python("-c", code).stdout.split("\n")[:2]
+    return int(rss) / 1024, heavy
+
+def first_request():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    code = f"from werkzeug.serving import make_server; import app; make_server('127.0.0.1', {port}, app.app).serve_forever()"
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/uploads/missing.png", timeout=1)
+            except urllib.error.HTTPError:
+                pass
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+                continue
+            return (time.perf_counter() - start) * 1000
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+    imports = [import_time() for _ in range(runs)]
+    total, slowest = min(imports, key=lambda result: result[0])
+    rss, heavy = import_rss()
+    startup = min(first_request() for _ in range(runs))
+    print(f"import app:        {total:.1f}ms (best of {runs})")
+    for ms, name in slowest:
+        print(f"  {ms:8.1f}ms  {name}")
+    print(f"RSS after import:  {rss:.1f}MB (heavy modules loaded: {heavy or 'none'})")
+    print(f"spawn to first response: {startup:.1f}ms (best of {runs})")
+
+if __name__ == '__main__':
+    main()
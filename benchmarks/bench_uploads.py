@@ -0,0 +1,67 @@
+# Benchmark throughput and peak memory of concurrent image uploads through /upload_image.
+#
+#   python benchmarks/bench_uploads.py [concurrent uploads] [MB per upload]
+#
+# Each upload is a multipart request body streamed from disk, so request construction
+# doesn't hold the payload in memory. Payloads are PNG-signed random bytes; thumbnailing
+# is disabled since they aren't decodable images. The form parser writes each file part
+# straight into the upload folder, so a payload is written to disk once.
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from common import bench_user
+from flask_login import login_user
+from app import app, db, User, ImageUpload, upload_image
+
+BOUNDARY = "benchboundary"
+
+def write_body(directory, index, megabytes):
+    path = os.path.join(directory, f"body-{index}")
+    with open(path, "wb") as body:
+        body.write(f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"photo{index}.png\"\r\n"
+                   f"Content-Type: image/png\r\n\r\n".encode())
+        body.write(b"\x89PNG\r\n\x1a\n")
+        for _ in range(megabytes):
+            body.write(os.urandom(1024 * 1024))
+        body.write(f"\r\n--{BOUNDARY}--\r\n".encode())
+    return path
+
+def upload(user_id, path):
+    with app.app_context(), open(path, "rb") as body:
+        user = db.session.get(User, user_id)
+        with app.test_request_context("/upload_image", method="POST", input_stream=body,
+                                      content_type=f"multipart/form-data; boundary={BOUNDARY}",
+                                      content_length=os.path.getsize(path)):
+            login_user(user)
+            upload_image()
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    megabytes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    scratch = tempfile.mkdtemp()
+    app.config.update(UPLOAD_FOLDER=os.path.join(scratch, "uploads"), THUMBNAIL_SIZES=())
+    with app.app_context():
+        user_id = bench_user().id
+        bodies = [write_body(scratch, i, megabytes) for i in range(concurrency)]
+        tracemalloc.start()
+        threads = [threading.Thread(target=lambda path=path: upload(user_id, path)) for path in bodies]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        stored = ImageUpload.query.count()
+    total = concurrency * megabytes
+    print(f"{stored}/{concurrency} x {megabytes} MB uploads stored in {elapsed:.2f}s ({total / elapsed:.1f} MB/s)")
+    print(f"peak Python allocations: {peak / 1024 / 1024:.1f} MB, max RSS: "
+          f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+if __name__ == '__main__':
+    main()
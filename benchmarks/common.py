@@ -0,0 +1,25 @@
+# Shared setup for the benchmark scripts: import path, a throwaway database and a benchmark user.
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'unittests')]
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+os.environ.setdefault('OUTBOX_WORKER_ENABLED', '0')
+os.environ.setdefault('OCCASION_SCHEDULER_ENABLED', '0')
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+# Get (or create) the user benchmarks run as; call inside an app context
+def bench_user(username='bench'):
+    from app import db, User
+    db.create_all()
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        user = User(username=username, password='x', email=f'{username}@example.com')
+        db.session.add(user)
+        db.session.commit()
+    return user
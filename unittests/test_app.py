@@ -1,15 +1,162 @@
+import csv
+import gzip
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from io import BytesIO, StringIO
+from datetime import date, datetime, timedelta
+import threading
 import unittest
-from app import app, db, User, Message, generate_romantic_message, get_upcoming_occasions, get_user_preferences, get_recommendations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from flask import g, request
+from flask_login import login_user
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import generate_password_hash
+from app import app, db, User, Message, generate_romantic_message, get_upcoming_occasions, get_user_preferences, get_recommendations, QuoteCache, FALLBACK_QUOTES, OutboxEmail, notification_outbox, ajax_generate_message, ajax_generate_messages_batch, get_message_history_page, api_message_history, api_message_history_stream, history_broker, generate_romantic_messages, get_message_statistics, rebuild_message_statistics, verify_message_statistics, record_message_statistics, record_bulk_message_statistics, MessageDailyCount, messages_per_day, messages_chart, chart_cache, ChartCache, store_upload, UploadError, UploadSpool, upload_image, ImageUpload, uploaded_file, uploaded_thumbnail, thumbnail_path, OutboundClient, CircuitOpenError, ShareJob, share_queue, share_on_social_media, share_job_status, TokenBucket, message_search, api_search_messages, export_messages, import_messages_route, PasswordService, PasswordServiceBusy, password_service, LoginThrottle, login_ip_throttle, login_user_throttle, login, load_user, user_cache, logout, request_query_count, UserStatistics, bump_history_version, metrics, span, SamplingProfiler, MessageComposer, MESSAGE_TEMPLATES, Occasion, OccasionScheduler, occasion_scheduler, next_occurrence, special_occasions, delete_special_occasion, GiftItem, gift_recommender, load_gift_catalog, save_user_preferences, recommended_gifts, gift_preferences
+
+# Local stand-in for the quote API; serves quotes from `quotes` in order
+class FakeQuoteAPI:
+    def __init__(self, quotes):
+        self.quotes = list(quotes)
+        self.requests = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                quote = api.quotes[api.requests % len(api.quotes)]
+                api.requests += 1
+                body = json.dumps({"contents": {"quotes": [{"quote": quote}]}}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/qod"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Local fake upstream; each request consumes the next (status, delay) step of `script`,
+# repeating the last one, and the client ports seen are recorded to observe connection reuse
+class FakeUpstream:
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = 0
+        self.client_ports = set()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_one(self):
+                status, delay = upstream.script[min(upstream.requests, len(upstream.script) - 1)]
+                upstream.requests += 1
+                upstream.client_ports.add(self.client_address[1])
+                time.sleep(delay)
+                body = b'{"ok": true}'
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.handle_one()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.handle_one()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Local stand-in SMTP server; records delivered messages and the number of connections
+class FakeSMTPServer:
+    def __init__(self, reject_recipients=False):
+        self.messages = []
+        self.connections = 0
+        smtp = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                smtp.connections += 1
+                self.reply("220 localhost ready")
+                for raw in self.rfile:
+                    command = raw.decode().strip().upper()
+                    if command.startswith("RCPT") and smtp.reject_recipients:
+                        self.reply("550 mailbox unavailable")
+                    elif command == "DATA":
+                        self.reply("354 end data with <CR><LF>.<CR><LF>")
+                        lines = []
+                        for data in self.rfile:
+                            if data == b".\r\n":
+                                break
+                            lines.append(data)
+                        smtp.messages.append(b"".join(lines).decode())
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        self.reject_recipients = reject_recipients
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    # Point Flask-Mail at this server for the duration of a test
+    def install(self, test):
+        state = app.extensions['mail']
+        saved = (state.server, state.port, state.use_tls, state.use_ssl, state.suppress)
+        state.server, state.port = "127.0.0.1", self.server.server_address[1]
+        state.use_tls = state.use_ssl = state.suppress = False
+
+        def restore():
+            state.server, state.port, state.use_tls, state.use_ssl, state.suppress = saved
+            self.server.shutdown()
+            self.server.server_close()
+        test.addCleanup(restore)
 
 class AppTestCase(unittest.TestCase):
 
     def setUp(self):
         app.config['TESTING'] = True
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['OCCASION_SCHEDULER_ENABLED'] = False
+        app.config['OUTBOX_WORKER_ENABLED'] = False
+        app.config['SHARE_WORKER_ENABLED'] = False
         self.app = app.test_client()
         db.create_all()
 
     def tearDown(self):
+        user_cache.clear()
+        gift_recommender.clear()
         db.session.remove()
         db.drop_all()
 
@@ -17,6 +164,12 @@ class AppTestCase(unittest.TestCase):
     def create_test_user(self):
         return User(username='testuser', password='testpassword', email='test@example.com')
 
+    # Helper function to override config values for a single test
+    def override_config(self, **values):
+        saved = {key: app.config[key] for key in values}
+        app.config.update(values)
+        self.addCleanup(app.config.update, saved)
+
     # Helper function to log in a test user
     def login_test_user(self):
         return self.app.post('/login', data=dict(
@@ -122,5 +275,1256 @@ class AppTestCase(unittest.TestCase):
 
         self.assertIn(b'Thank you for your feedback!', response.data)
 
+    # Test quote cache is filled from the quote API and serves hits from memory
+    def test_quote_cache_refresh(self):
+        api = FakeQuoteAPI(["Love is patient"])
+        self.addCleanup(api.close)
+        cache = QuoteCache(api.url, ttl=60, max_size=4, refresh_interval=60, timeout=1)
+
+        self.assertTrue(cache.refresh())
+        self.assertEqual(cache.get_quote(), "Love is patient")
+        self.assertEqual(cache.get_quote(), "Love is patient")
+        self.assertEqual(api.requests, 1)
+        self.assertEqual(cache.stats["hits"], 2)
+        self.assertEqual(cache.stats["refreshes"], 1)
+
+    # Test quote cache serves the local fallback pool when the quote API is down
+    def test_quote_cache_fallback(self):
+        api = FakeQuoteAPI(["unused"])
+        url = api.url
+        api.close()
+        cache = QuoteCache(url, ttl=60, max_size=4, refresh_interval=60, timeout=1)
+
+        self.assertFalse(cache.refresh())
+        self.assertIn(cache.get_quote(), FALLBACK_QUOTES)
+        self.assertEqual(cache.stats["misses"], 1)
+        self.assertGreaterEqual(cache.stats["refresh_errors"], 1)
+
+    # Test expired quotes are served while a refresh happens in the background
+    def test_quote_cache_stale_while_revalidate(self):
+        api = FakeQuoteAPI(["First quote", "Second quote"])
+        self.addCleanup(api.close)
+        cache = QuoteCache(api.url, ttl=0, max_size=4, refresh_interval=60, timeout=1)
+        cache.refresh()
+
+        self.assertEqual(cache.get_quote(), "First quote")
+        self.assertEqual(cache.stats["stale_hits"], 1)
+        for _ in range(100):
+            if cache.stats["refreshes"] == 2:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(cache.stats["refreshes"], 2)
+
+    # Test quote cache evicts the oldest quotes beyond its size bound
+    def test_quote_cache_eviction(self):
+        api = FakeQuoteAPI(["One", "Two", "Three"])
+        self.addCleanup(api.close)
+        cache = QuoteCache(api.url, ttl=60, max_size=2, refresh_interval=60, timeout=1)
+        for _ in range(3):
+            cache.refresh()
+
+        self.assertEqual({cache.get_quote() for _ in range(50)}, {"Two", "Three"})
+
+    # Test message generation queues its notification instead of sending it inline
+    def test_generate_message_queues_notification(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False)
+        smtp = FakeSMTPServer()
+        smtp.install(self)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        with app.test_request_context():
+            login_user(test_user)
+            generate_romantic_message('Test Girlfriend', 'Special Moments')
+
+        emails = OutboxEmail.query.all()
+        self.assertEqual(len(emails), 1)
+        self.assertEqual(emails[0].status, 'pending')
+        self.assertEqual(emails[0].recipient, 'test@example.com')
+        self.assertEqual(smtp.connections, 0)
+
+    # Test the outbox sends a batch of emails over a single SMTP connection
+    def test_outbox_drain(self):
+        smtp = FakeSMTPServer()
+        smtp.install(self)
+        for i in range(3):
+            db.session.add(OutboxEmail(recipient=f'user{i}@example.com', subject='Hello', body='Body'))
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual(notification_outbox.drain(), 3)
+        self.assertEqual(len(smtp.messages), 3)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual({email.status for email in OutboxEmail.query.all()}, {'sent'})
+
+    # Test emails pending from before the process started are delivered without a new message
+    def test_outbox_starts_on_first_request(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=True)
+        self.addCleanup(notification_outbox.stop)
+        smtp = FakeSMTPServer()
+        smtp.install(self)
+        db.session.add(OutboxEmail(recipient='user@example.com', subject='Hello', body='Body'))
+        db.session.commit()
+
+        self.app.get('/metrics')
+        deadline = time.monotonic() + 10
+        while not smtp.messages and time.monotonic() < deadline:
+            time.sleep(0.01)
+        notification_outbox.stop()
+        self.assertEqual(len(smtp.messages), 1)
+
+    # Test failed emails are retried with backoff and then dead-lettered
+    def test_outbox_retry_and_dead_letter(self):
+        self.override_config(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_BACKOFF=0)
+        smtp = FakeSMTPServer(reject_recipients=True)
+        smtp.install(self)
+        db.session.add(OutboxEmail(recipient='user@example.com', subject='Hello', body='Body'))
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual(notification_outbox.process_batch(), 1)
+            email = OutboxEmail.query.one()
+            self.assertEqual((email.status, email.attempts), ('pending', 1))
+
+            notification_outbox.drain()
+        email = OutboxEmail.query.one()
+        self.assertEqual((email.status, email.attempts), ('dead', 2))
+        self.assertIsNotNone(email.last_error)
+        self.assertEqual(smtp.messages, [])
+
+    # Test batch generation inserts every message with one summary notification
+    def test_generate_messages_batch(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        entries = [{"girlfriend_name": "Alice"}, {"girlfriend_name": ""}, {"girlfriend_name": "Beth", "special_moments": "Paris"}]
+        with app.test_request_context('/generate_messages/batch', method='POST', json=entries):
+            login_user(test_user)
+            response = ajax_generate_messages_batch()
+            results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([result["index"] for result in results], [0, 1, 2])
+        self.assertEqual(results[1]["error"], "Missing girlfriend's name")
+        self.assertEqual(sorted(m.girlfriend_name for m in Message.query.all()), ["Alice", "Beth"])
+        self.assertEqual(OutboxEmail.query.count(), 1)
+
+    # Test batch generation rejects oversized or malformed batches
+    def test_generate_messages_batch_validation(self):
+        self.override_config(BATCH_MAX_MESSAGES=2)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        for payload in ({"messages": [{"girlfriend_name": "A"}] * 3}, {"messages": []}, "nope"):
+            with app.test_request_context('/generate_messages/batch', method='POST', json=payload):
+                login_user(test_user)
+                response, status = ajax_generate_messages_batch()
+            self.assertEqual(status, 400)
+        self.assertEqual(Message.query.count(), 0)
+
+    # Helper function to add messages for a user with explicit timestamps
+    def add_messages(self, user, timestamps):
+        for i, timestamp in enumerate(timestamps):
+            db.session.add(Message(user=user, girlfriend_name=f'Name {i}', romantic_message=f'Message {i}', timestamp=timestamp))
+        db.session.commit()
+
+    # Test cursor pagination walks the whole history once, newest first, across equal timestamps
+    def test_message_history_cursor_pagination(self):
+        test_user = self.create_test_user()
+        other_user = User(username='otheruser', password='x', email='other@example.com')
+        db.session.add_all([test_user, other_user])
+        now = datetime(2024, 2, 14, 12, 0, 0)
+        self.add_messages(test_user, [now, now, now - timedelta(days=1), now, now - timedelta(days=2), now + timedelta(days=1), now])
+        self.add_messages(other_user, [now])
+
+        seen = []
+        cursor = None
+        while True:
+            page = get_message_history_page(test_user, cursor=cursor, limit=2)
+            seen.extend(page["messages"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        expected = Message.query.filter_by(user_id=test_user.id).order_by(Message.timestamp.desc(), Message.id.desc()).all()
+        self.assertEqual([message["id"] for message in seen], [message.id for message in expected])
+        self.assertNotIn("total", page)
+        rebuild_message_statistics()
+        self.assertEqual(get_message_history_page(test_user, include_total=True)["total"], 7)
+
+    # Test the history API rejects cursors it didn't issue
+    def test_message_history_invalid_cursor(self):
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        with app.test_request_context('/api/messages?cursor=not-a-cursor'):
+            login_user(test_user)
+            response, status = api_message_history()
+        self.assertEqual(status, 400)
+
+    # Test unchanged history polls get a 304 until a message is added
+    def test_message_history_etag(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        with app.test_request_context('/api/messages'):
+            login_user(test_user)
+            etag = api_message_history().get_etag()[0]
+        with app.test_request_context('/api/messages', headers={'If-None-Match': f'"{etag}"'}):
+            login_user(test_user)
+            self.assertEqual(api_message_history().status_code, 304)
+            generate_romantic_message('Test Girlfriend', 'Special Moments')
+        with app.test_request_context('/api/messages', headers={'If-None-Match': f'"{etag}"'}):
+            login_user(test_user)
+            response = api_message_history()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+        self.assertEqual(len(response.get_json()["messages"]), 1)
+
+    # Test the history stream replays missed messages and then pushes new ones
+    def test_message_history_stream(self):
+        self.override_config(HISTORY_STREAM_ENABLED=True)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        now = datetime(2024, 2, 14, 12, 0, 0)
+        self.add_messages(test_user, [now, now])
+        first, second = Message.query.order_by(Message.id).all()
+
+        with app.test_request_context('/api/messages/stream', headers={'Last-Event-ID': str(first.id)}):
+            login_user(test_user)
+            response = api_message_history_stream()
+        events = iter(response.response)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertIn(f'id: {second.id}\n', next(events))
+
+        self.add_messages(test_user, [now])
+        third = Message.query.order_by(Message.id.desc()).first()
+        history_broker.publish(test_user.id, [third])
+        self.assertIn(f'id: {third.id}\n', next(events))
+
+        events.close()
+        self.assertFalse(history_broker.has_subscribers(test_user.id))
+
+    # Test the history stream catches up from the database on messages it wasn't handed
+    def test_message_history_stream_catch_up(self):
+        self.override_config(HISTORY_STREAM_ENABLED=True, HISTORY_STREAM_KEEPALIVE=0.01)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        now = datetime(2024, 2, 14, 12, 0, 0)
+        self.add_messages(test_user, [now])
+
+        with app.test_request_context('/api/messages/stream'):
+            login_user(test_user)
+            response = api_message_history_stream()
+        events = iter(response.response)
+        self.assertEqual(next(events), ': keepalive\n\n')
+
+        # As another process would: committed, but never published to this process's broker
+        self.add_messages(test_user, [now])
+        added = Message.query.order_by(Message.id.desc()).first()
+        self.assertIn(f'id: {added.id}\n', next(events))
+        self.assertEqual(next(events), ': keepalive\n\n')
+        events.close()
+
+    # Test statistics are maintained incrementally as messages are generated
+    def test_message_statistics(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        with app.test_request_context():
+            login_user(test_user)
+            generate_romantic_message('Alice', 'Special Moments')
+            generate_romantic_messages([{"girlfriend_name": "Alice"}, {"girlfriend_name": "Beth"}])
+
+        stats = get_message_statistics(test_user)
+        self.assertEqual(stats["total_messages"], 3)
+        self.assertEqual(stats["messages_last_7_days"], 3)
+        self.assertEqual(stats["messages_last_365_days"], 3)
+        self.assertEqual(stats["top_recipients"], [{"girlfriend_name": "Alice", "messages": 2},
+                                                   {"girlfriend_name": "Beth", "messages": 1}])
+        self.assertEqual(verify_message_statistics(), [])
+
+    # Test statistics can be rebuilt from the message table and verified
+    def test_rebuild_message_statistics(self):
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        now = datetime.utcnow()
+        self.add_messages(test_user, [now, now - timedelta(days=10), now - timedelta(days=400)])
+        user_id = test_user.id
+        self.assertEqual(verify_message_statistics(), [user_id])
+
+        result = app.test_cli_runner().invoke(args=["rebuild-stats"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(verify_message_statistics(), [])
+        stats = get_message_statistics(db.session.get(User, user_id))
+        self.assertEqual((stats["total_messages"], stats["messages_last_7_days"], stats["messages_last_30_days"],
+                          stats["messages_last_365_days"]), (3, 1, 2, 2))
+
+        MessageDailyCount.query.filter_by(user_id=user_id).delete()
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=["rebuild-stats", "--verify-only"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertEqual(rebuild_message_statistics([user_id]), 1)
+        self.assertEqual(verify_message_statistics(), [])
+
+    # Test a counter row another request inserts between the UPDATE and the INSERT is added to, not a 500
+    def test_message_statistics_insert_race(self):
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id, day = test_user.id, datetime.utcnow().date()
+
+        # Stand in for the other request: insert the row just after the lookup (an UPDATE
+        # matching nothing, or the bulk path's SELECT) found it missing
+        inserted = set()
+        def insert_first(conn, cursor, statement, parameters, context, executemany):
+            for table, row in (('user_statistics', f'{user_id}, 5'),
+                               ('message_daily_count', f"{user_id}, '{day}', 'Alice', 5")):
+                missed = ((statement.startswith(f'UPDATE {table}') and cursor.rowcount == 0)
+                          or (statement.startswith('SELECT') and f'FROM {table}' in statement))
+                if missed and table not in inserted:
+                    inserted.add(table)
+                    conn.exec_driver_sql(f'INSERT INTO {table} VALUES ({row})')
+        event.listen(db.engine, 'after_cursor_execute', insert_first)
+        self.addCleanup(event.remove, db.engine, 'after_cursor_execute', insert_first)
+
+        record_message_statistics(user_id, [(datetime.utcnow(), 'Alice')])
+        db.session.commit()
+        self.assertEqual(db.session.get(UserStatistics, user_id).total_messages, 6)
+        self.assertEqual(db.session.get(MessageDailyCount, (user_id, day, 'Alice')).count, 6)
+
+        UserStatistics.query.delete()
+        MessageDailyCount.query.delete()
+        db.session.commit()
+        inserted.clear()
+        record_bulk_message_statistics([{'user_id': user_id, 'timestamp': datetime.utcnow(), 'girlfriend_name': 'Alice'}])
+        db.session.commit()
+        self.assertEqual(db.session.get(UserStatistics, user_id).total_messages, 6)
+        self.assertEqual(db.session.get(MessageDailyCount, (user_id, day, 'Alice')).count, 6)
+
+    # Test importing the app loads no optional subsystems
+    def test_import_is_lazy(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = "import sys, app; print(sorted(m for m in ('matplotlib', 'numpy', 'nltk') if m in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, timeout=60,
+                                env=dict(os.environ, DATABASE_URI="sqlite:///:memory:"))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    # Test messages per day are binned into a dense oldest-first array
+    def test_messages_per_day(self):
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        now = datetime.utcnow()
+        self.add_messages(test_user, [now, now, now - timedelta(days=2), now - timedelta(days=40)])
+        rebuild_message_statistics()
+
+        start, counts = messages_per_day(test_user, 7)
+        self.assertEqual(start, now.date() - timedelta(days=6))
+        self.assertEqual(counts.tolist(), [0, 0, 0, 0, 1, 0, 2])
+
+    # Test chart images are cached by content and revalidated with their ETag
+    def test_messages_chart_caching(self):
+        chart_cache.clear()
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        with app.test_request_context('/visualization/messages_per_day.png?days=7&width=300&height=200'):
+            login_user(test_user)
+            response = messages_chart('png')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertTrue(response.get_data().startswith(b'\x89PNG'))
+        etag = response.get_etag()[0]
+
+        with app.test_request_context('/visualization/messages_per_day.png?days=7&width=300&height=200',
+                                      headers={'If-None-Match': f'"{etag}"'}):
+            login_user(test_user)
+            self.assertEqual(messages_chart('png').status_code, 304)
+        with app.test_request_context('/visualization/messages_per_day.png?days=7&width=300&height=200'):
+            login_user(test_user)
+            self.assertEqual(messages_chart('png').get_etag()[0], etag)
+        self.assertEqual(chart_cache.stats, {"hits": 1, "misses": 1})
+
+    # Test the chart cache evicts the least recently used image
+    def test_chart_cache_eviction(self):
+        cache = ChartCache(max_entries=2)
+        cache.put("a", b"1")
+        cache.put("b", b"2")
+        cache.get("a")
+        cache.put("c", b"3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (b"1", b"3"))
+
+    # Helper function to build an in-memory PNG image
+    def make_png(self, color='red', size=(600, 400)):
+        from PIL import Image
+        image = BytesIO()
+        Image.new('RGB', size, color).save(image, format='PNG')
+        return image.getvalue()
+
+    # Test uploads are stored once per content, with thumbnails generated in the background
+    def test_store_upload(self):
+        folder = tempfile.mkdtemp()
+        self.override_config(UPLOAD_FOLDER=folder, THUMBNAIL_SIZES=(64,))
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        png = self.make_png()
+
+        first = store_upload(BytesIO(png), 'photo.png', test_user.id)
+        second = store_upload(BytesIO(png), 'copy.png', test_user.id)
+        db.session.commit()
+
+        self.assertEqual(first.filename, second.filename)
+        self.assertEqual((first.extension, first.size), ('png', len(png)))
+        stored = [name for _, _, names in os.walk(folder) for name in names if name.endswith('.png')]
+        self.assertEqual(stored, [first.filename])
+        self.assertEqual(ImageUpload.query.count(), 2)
+
+        thumbnail = thumbnail_path(first.sha256, 64)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(thumbnail) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(os.path.exists(thumbnail))
+        with app.test_request_context():
+            response = uploaded_thumbnail(64, first.filename)
+            response.direct_passthrough = False
+            self.assertEqual(response.mimetype, 'image/jpeg')
+
+    # Test uploads that aren't images or exceed the size cap are rejected and leave nothing behind
+    def test_store_upload_validation(self):
+        folder = tempfile.mkdtemp()
+        self.override_config(UPLOAD_FOLDER=folder, MAX_UPLOAD_SIZE=1024, UPLOAD_CHUNK_SIZE=256)
+
+        with self.assertRaises(UploadError):
+            store_upload(BytesIO(b'<html>not an image</html>'), 'page.png', 1)
+        with self.assertRaises(UploadError):
+            store_upload(BytesIO(b'\x89PNG\r\n\x1a\n' + b'\0' * 2048), 'big.png', 1)
+        with self.assertRaises(UploadError):
+            store_upload(BytesIO(b''), 'empty.png', 1)
+        self.assertEqual(os.listdir(folder), [])
+
+    # Test /upload_image's form parser writes the file straight into the upload folder, once
+    def test_upload_image_spool(self):
+        folder = tempfile.mkdtemp()
+        self.override_config(UPLOAD_FOLDER=folder, THUMBNAIL_SIZES=())
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        png = self.make_png()
+
+        with app.test_request_context('/upload_image', method='POST', data={'file': (BytesIO(png), 'photo.png')}):
+            login_user(test_user)
+            self.assertIsInstance(request.files['file'].stream, UploadSpool)
+            self.assertEqual(len(os.listdir(folder)), 1)  # The spool, before the view runs
+            self.assertEqual(upload_image().status_code, 302)
+        upload = ImageUpload.query.one()
+        stored = [name for _, _, names in os.walk(folder) for name in names]
+        self.assertEqual(stored, [upload.filename])
+
+        with app.test_request_context('/upload_image', method='POST', data={'file': (BytesIO(png), 'photo.txt')}):
+            login_user(db.session.get(User, upload.user_id))
+            self.assertEqual(upload_image().status_code, 302)
+        self.assertEqual([name for _, _, names in os.walk(folder) for name in names], stored)
+
+    # Test uploaded images are served with their hash as ETag, long-lived caching and Range support
+    def test_uploaded_file_caching(self):
+        folder = tempfile.mkdtemp()
+        self.override_config(UPLOAD_FOLDER=folder, THUMBNAIL_SIZES=())
+        png = self.make_png()
+        upload = store_upload(BytesIO(png), 'photo.png', 1)
+
+        with app.test_request_context(headers={'Range': 'bytes=0-9'}):
+            response = uploaded_file(upload.filename)
+            response.direct_passthrough = False
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.get_data(), png[:10])
+        self.assertEqual(response.get_etag()[0], upload.sha256)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        with app.test_request_context(headers={'If-None-Match': f'"{upload.sha256}"'}):
+            self.assertEqual(uploaded_file(upload.filename).status_code, 304)
+
+    # Helper function to build an outbound client with fast test settings
+    def make_outbound_client(self, **overrides):
+        settings = dict(connect_timeout=1, read_timeout=1, retries=2, backoff=0.01, pool_size=2,
+                        failure_threshold=3, reset_timeout=60)
+        settings.update(overrides)
+        return OutboundClient(**settings)
+
+    # Test the outbound client reuses pooled connections and records per-host latency
+    def test_outbound_client_pooling(self):
+        upstream = FakeUpstream([(200, 0)])
+        self.addCleanup(upstream.close)
+        client = self.make_outbound_client()
+
+        for _ in range(5):
+            self.assertEqual(client.get(upstream.url).status_code, 200)
+        self.assertEqual(len(upstream.client_ports), 1)
+        histogram = client.latency_snapshot()[f"127.0.0.1:{upstream.server.server_port}"]
+        self.assertEqual(histogram["count"], 5)
+        self.assertEqual(histogram["buckets"][-1][1], 5)
+
+    # Test idempotent requests are retried on 5xx and timeouts, and POSTs are not
+    def test_outbound_client_retries(self):
+        upstream = FakeUpstream([(503, 0), (503, 0), (200, 0)])
+        self.addCleanup(upstream.close)
+        client = self.make_outbound_client()
+        self.assertEqual(client.get(upstream.url).status_code, 200)
+        self.assertEqual(upstream.requests, 3)
+
+        upstream.script, upstream.requests = [(503, 0)], 0
+        self.assertEqual(client.post(upstream.url, data={"a": 1}).status_code, 503)
+        self.assertEqual(upstream.requests, 1)
+
+        slow = FakeUpstream([(200, 0.5)])
+        self.addCleanup(slow.close)
+        with self.assertRaises(requests.Timeout):
+            self.make_outbound_client(read_timeout=0.1, retries=1).get(slow.url)
+        self.assertEqual(slow.requests, 2)
+
+    # Test the circuit breaker fails fast while a host is down and probes it after the reset timeout
+    def test_outbound_client_circuit_breaker(self):
+        upstream = FakeUpstream([(500, 0)])
+        self.addCleanup(upstream.close)
+        client = self.make_outbound_client(retries=0, failure_threshold=2, reset_timeout=0.2)
+
+        client.get(upstream.url)
+        client.get(upstream.url)
+        with self.assertRaises(CircuitOpenError):
+            client.get(upstream.url)
+        self.assertEqual(upstream.requests, 2)
+
+        time.sleep(0.25)
+        upstream.script = [(200, 0)]
+        self.assertEqual(client.get(upstream.url).status_code, 200)
+        self.assertEqual(client.breaker(f"127.0.0.1:{upstream.server.server_port}").state, "closed")
+
+    # Helper function to create a user with one message to share
+    def create_shareable_message(self):
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        self.add_messages(test_user, [datetime.utcnow()])
+        return test_user, Message.query.one()
+
+    # Test sharing queues a job and returns without calling the social media API
+    def test_share_is_queued(self):
+        upstream = FakeUpstream([(200, 0)])
+        self.addCleanup(upstream.close)
+        self.override_config(SHARE_WORKER_ENABLED=False, SOCIAL_SHARE_URL=upstream.url)
+        test_user, message = self.create_shareable_message()
+        user_id = test_user.id
+
+        with app.test_request_context(f'/share_on_social_media/{message.id}', headers={'Accept': 'application/json'}):
+            login_user(test_user)
+            response, status = share_on_social_media(message.id)
+        self.assertEqual(status, 202)
+        self.assertEqual(response.get_json()["status"], "queued")
+        self.assertEqual(upstream.requests, 0)
+
+        with app.app_context():
+            self.assertEqual(share_queue.run_pending(), 1)
+        self.assertEqual(upstream.requests, 1)
+        with app.test_request_context():
+            login_user(db.session.get(User, user_id))
+            self.assertEqual(share_job_status(response.get_json()["id"]).get_json()["status"], "sent")
+
+    # Test failed shares are retried and then marked failed
+    def test_share_retries(self):
+        upstream = FakeUpstream([(500, 0)])
+        self.addCleanup(upstream.close)
+        self.override_config(SHARE_WORKER_ENABLED=False, SOCIAL_SHARE_URL=upstream.url,
+                             SHARE_MAX_ATTEMPTS=2, SHARE_RETRY_BACKOFF=0)
+        test_user, message = self.create_shareable_message()
+        db.session.add(ShareJob(user_id=test_user.id, message_id=message.id))
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual(share_queue.run_pending(), 2)
+        job = ShareJob.query.one()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(upstream.requests, 2)
+
+    # Test the in-process backend hands jobs to the worker pool without polling
+    def test_share_memory_backend(self):
+        upstream = FakeUpstream([(200, 0)])
+        self.addCleanup(upstream.close)
+        self.override_config(SHARE_QUEUE_BACKEND='memory', SHARE_WORKERS=2, SHARE_POLL_INTERVAL=60,
+                             SOCIAL_SHARE_URL=upstream.url, SHARE_WORKER_ENABLED=True)
+        self.addCleanup(share_queue.stop)
+        test_user, message = self.create_shareable_message()
+
+        with app.test_request_context(f'/share_on_social_media/{message.id}'):
+            login_user(test_user)
+            self.assertEqual(share_on_social_media(message.id).status_code, 302)
+        deadline = time.monotonic() + 10
+        while upstream.requests == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        share_queue.stop()
+        self.assertEqual(upstream.requests, 1)
+
+    # Test shares queued before the process started are processed without a new share
+    def test_share_queue_starts_on_first_request(self):
+        upstream = FakeUpstream([(200, 0)])
+        self.addCleanup(upstream.close)
+        self.override_config(SHARE_QUEUE_BACKEND='memory', SHARE_WORKERS=1, SHARE_POLL_INTERVAL=60,
+                             SOCIAL_SHARE_URL=upstream.url, SHARE_WORKER_ENABLED=True)
+        self.addCleanup(share_queue.stop)
+        test_user, message = self.create_shareable_message()
+        # Due once the request is over; the test database is one connection shared between threads
+        db.session.add(ShareJob(user_id=test_user.id, message_id=message.id,
+                                next_attempt_at=datetime.utcnow() + timedelta(seconds=0.5)))
+        db.session.commit()
+
+        self.app.get('/metrics')
+        deadline = time.monotonic() + 10
+        while upstream.requests == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        share_queue.stop()
+        self.assertEqual(upstream.requests, 1)
+
+    # Test the token bucket allows a burst and then holds callers to its rate
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.monotonic()
+        for _ in range(4):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    # Helper function to add searchable messages for two users
+    def create_searchable_messages(self):
+        test_user = self.create_test_user()
+        other_user = User(username='otheruser', password='x', email='other@example.com')
+        db.session.add_all([test_user, other_user])
+        db.session.commit()
+        for user, girlfriend_name, text in [
+            (test_user, 'Alice', 'Remember our sunset walk on the beach'),
+            (test_user, 'Alice', 'The beach, the beach, the beautiful beach'),
+            (test_user, 'Beth', 'Sunday mornings with <you> are my favorite'),
+            (other_user, 'Carol', 'A beach picnic under the stars'),
+        ]:
+            db.session.add(Message(user=user, girlfriend_name=girlfriend_name, romantic_message=text))
+        db.session.commit()
+        return test_user
+
+    # Test search ranks, scopes, prefix-matches and highlights with each backend
+    def test_search_messages(self):
+        for backend in ('auto', 'memory'):
+            with self.subTest(backend=backend):
+                self.override_config(SEARCH_BACKEND=backend)
+                db.session.remove()
+                db.drop_all()
+                db.create_all()
+                message_search.reset()
+                test_user = self.create_searchable_messages()
+                self.assertEqual(message_search.engine, 'fts5' if backend == 'auto' else 'memory')
+
+                results = message_search.search(test_user.id, 'beach')
+                self.assertEqual([r['romantic_message'] for r in results],
+                                 ['The beach, the beach, the beautiful beach', 'Remember our sunset walk on the beach'])
+                self.assertIn('<mark>beach</mark>', results[1]['highlight']['romantic_message'])
+
+                results = message_search.search(test_user.id, 'sun*')
+                self.assertEqual(len(results), 2)
+                sunday = next(r for r in results if r['girlfriend_name'] == 'Beth')
+                self.assertIn('<mark>Sunday</mark>', sunday['highlight']['romantic_message'])
+                self.assertIn('&lt;you&gt;', sunday['highlight']['romantic_message'])
+
+                self.assertEqual([r['girlfriend_name'] for r in message_search.search(test_user.id, 'alice walk')], ['Alice'])
+                self.assertEqual(message_search.search(test_user.id, 'picnic'), [])
+                self.assertEqual(message_search.search(test_user.id, '" OR *'), [])
+
+    # Test the search index follows new messages
+    def test_search_follows_inserts(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False)
+        message_search.reset()
+        test_user = self.create_searchable_messages()
+        self.assertEqual(message_search.search(test_user.id, 'moonlight'), [])
+
+        with app.test_request_context('/api/search?q=moonlight'):
+            login_user(test_user)
+            generate_romantic_messages([{"girlfriend_name": "Moonlight"}])
+            response = api_search_messages()
+        self.assertEqual([r['girlfriend_name'] for r in response.get_json()['results']], ['Moonlight'])
+
+    # Test the in-memory index skips and forgets messages deleted after they were indexed
+    def test_search_skips_deleted_messages(self):
+        self.override_config(SEARCH_BACKEND='memory')
+        message_search.reset()
+        test_user = self.create_searchable_messages()
+        self.assertEqual(len(message_search.search(test_user.id, 'beach')), 2)
+
+        Message.query.filter(Message.romantic_message.like('The beach%')).delete(synchronize_session=False)
+        db.session.commit()
+        self.assertEqual([r['romantic_message'] for r in message_search.search(test_user.id, 'beach')],
+                         ['Remember our sunset walk on the beach'])
+        self.assertEqual(message_search.inverted_index.search(test_user.id, [('beautiful', False)], 20), [])
+        self.assertEqual(len(message_search.inverted_index.search(test_user.id, [('beach', False)], 20)), 1)
+
+    # Helper function to export the logged-in user's messages in the given format
+    def export_as(self, user, fmt):
+        with app.test_request_context(f'/export/messages.{fmt}'):
+            login_user(user)
+            response = export_messages(fmt)
+            return response, response.get_data()
+
+    # Test exports stream every message, oldest first, across chunks and formats
+    def test_export_messages(self):
+        self.override_config(EXPORT_CHUNK_SIZE=2)
+        test_user = self.create_test_user()
+        other_user = User(username='otheruser', password='x', email='other@example.com')
+        db.session.add_all([test_user, other_user])
+        now = datetime(2024, 2, 14, 12, 0, 0)
+        self.add_messages(test_user, [now, now - timedelta(days=1), now, now + timedelta(days=1), now])
+        self.add_messages(other_user, [now])
+        user_id = test_user.id
+        expected = [{'id': m.id, 'girlfriend_name': m.girlfriend_name, 'romantic_message': m.romantic_message,
+                     'timestamp': m.timestamp.isoformat()}
+                    for m in Message.query.filter_by(user_id=user_id).order_by(Message.timestamp, Message.id)]
+
+        response, body = self.export_as(test_user, 'ndjson')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertEqual([json.loads(line) for line in body.decode().splitlines()], expected)
+
+        response, body = self.export_as(db.session.get(User, user_id), 'csv')
+        self.assertEqual(response.mimetype, 'text/csv')
+        rows = list(csv.DictReader(StringIO(body.decode())))
+        self.assertEqual([int(row['id']) for row in rows], [row['id'] for row in expected])
+
+        response, compressed = self.export_as(db.session.get(User, user_id), 'csv.gz')
+        self.assertEqual(response.mimetype, 'application/gzip')
+        self.assertEqual(gzip.decompress(compressed), body)
+
+        with app.test_request_context('/export/messages.xml'):
+            login_user(db.session.get(User, user_id))
+            self.assertEqual(export_messages('xml')[1], 404)
+
+    # Test imports validate rows, insert in batches and keep statistics and history version in step
+    def test_import_messages(self):
+        self.override_config(IMPORT_BATCH_SIZE=2)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+
+        lines = [
+            json.dumps({'girlfriend_name': 'Alice', 'romantic_message': 'One', 'timestamp': '2024-02-14T12:00:00'}),
+            json.dumps({'girlfriend_name': '', 'romantic_message': 'No name'}),
+            '',
+            'not json',
+            json.dumps({'girlfriend_name': 'Beth', 'romantic_message': 'Two', 'timestamp': '2024-02-13T23:30:00-02:00'}),
+            json.dumps({'girlfriend_name': 'Alice', 'romantic_message': 'Three', 'timestamp': 'yesterday'}),
+            json.dumps({'girlfriend_name': 'Alice', 'romantic_message': 'Four'}),
+        ]
+        body = gzip.compress('\n'.join(lines).encode())
+        with app.test_request_context('/import/messages', method='POST', data=body, content_type='application/x-ndjson',
+                                      headers={'Content-Encoding': 'gzip'}):
+            login_user(test_user)
+            response, status = import_messages_route()
+
+        self.assertEqual(status, 200)
+        summary = response.get_json()
+        self.assertEqual(summary['imported'], 3)
+        self.assertEqual(summary['rejected'], 3)
+        self.assertEqual([error['line'] for error in summary['errors']], [2, 4, 6])
+        messages = Message.query.filter_by(user_id=user_id).order_by(Message.id).all()
+        self.assertEqual([m.romantic_message for m in messages], ['One', 'Two', 'Four'])
+        self.assertEqual(messages[1].timestamp, datetime(2024, 2, 14, 1, 30, 0))
+        self.assertEqual(db.session.get(User, user_id).history_version, 2)
+        self.assertEqual(verify_message_statistics(), [])
+
+    # Test a CSV export imports back into another account, and unreadable bodies are rejected
+    def test_import_round_trip(self):
+        test_user = self.create_test_user()
+        other_user = User(username='otheruser', password='x', email='other@example.com')
+        db.session.add_all([test_user, other_user])
+        self.add_messages(test_user, [datetime(2024, 2, 14, 12, 0, 0), datetime(2024, 2, 15, 8, 0, 0)])
+        other_id = other_user.id
+        body = self.export_as(test_user, 'csv')[1]
+
+        other_user = db.session.get(User, other_id)
+        with app.test_request_context('/import/messages', method='POST', data=body, content_type='text/csv'):
+            login_user(other_user)
+            response, status = import_messages_route()
+        self.assertEqual((status, response.get_json()['imported']), (200, 2))
+        self.assertEqual(self.export_as(db.session.get(User, other_id), 'csv')[1].count(b'\n'), 3)
+
+        with app.test_request_context('/import/messages', method='POST', data=b'not gzip', content_type='text/csv',
+                                      headers={'Content-Encoding': 'gzip'}):
+            login_user(db.session.get(User, other_id))
+            response, status = import_messages_route()
+        self.assertEqual(status, 400)
+        self.assertEqual(response.get_json()['imported'], 0)
+
+        with app.test_request_context('/import/messages', method='POST', data=body, content_type='text/plain'):
+            login_user(db.session.get(User, other_id))
+            self.assertEqual(import_messages_route()[1], 415)
+
+    # Test a gzip body that turns corrupt partway keeps the batches read before it and reports the error
+    def test_import_corrupt_gzip(self):
+        self.override_config(IMPORT_BATCH_SIZE=100)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+
+        lines = [json.dumps({'girlfriend_name': 'Alice', 'romantic_message': f'Message {i}'}) for i in range(1000)]
+        compressor = zlib.compressobj(wbits=31)
+        body = compressor.compress('\n'.join(lines).encode()) + compressor.flush(zlib.Z_SYNC_FLUSH) + b'\xff' * 64
+        with app.test_request_context('/import/messages', method='POST', data=body, content_type='application/x-ndjson',
+                                      headers={'Content-Encoding': 'gzip'}):
+            login_user(test_user)
+            response, status = import_messages_route()
+
+        self.assertEqual(status, 400)
+        summary = response.get_json()
+        self.assertIn('Unreadable import data', summary['error'])
+        self.assertGreater(summary['imported'], 0)
+        self.assertEqual(Message.query.filter_by(user_id=user_id).count(), summary['imported'])
+        self.assertEqual(verify_message_statistics(), [])
+
+    # Test the password service hashes and verifies in a worker process and spots outdated hashes
+    def test_password_service(self):
+        service = PasswordService('pbkdf2:sha256:1000', salt_length=8, workers=1, max_pending=2, timeout=30)
+        self.addCleanup(service.shutdown)
+        pwhash = service.hash('secret')
+        self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(service.verify(pwhash, 'secret'))
+        self.assertFalse(service.verify(pwhash, 'wrong'))
+        self.assertFalse(service.verify_unknown('secret'))
+        self.assertFalse(service.needs_rehash(pwhash))
+        self.assertTrue(service.needs_rehash(generate_password_hash('secret', method='sha256')))
+        self.assertTrue(service.needs_rehash(generate_password_hash('secret', method='pbkdf2:sha256:2000')))
+
+    # Test the dummy hash for unknown usernames is made once, in the pool, and shared by concurrent logins
+    def test_password_service_dummy_hash(self):
+        service = PasswordService('pbkdf2:sha256:1000', salt_length=8, workers=1, max_pending=4, timeout=30)
+        self.addCleanup(service.shutdown)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(service.verify_unknown('secret')))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [False] * 4)
+        dummy_hash = service._dummy_hash
+        self.assertTrue(dummy_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertIsNotNone(service.start())
+        self.assertFalse(service.verify_unknown('secret'))
+        self.assertIs(service._dummy_hash, dummy_hash)
+
+    # Test requests beyond the pending limit are turned away instead of queueing
+    def test_password_service_admission(self):
+        service = PasswordService('pbkdf2:sha256:1000', salt_length=8, workers=0, max_pending=1, timeout=30)
+        release = threading.Event()
+        holder = threading.Thread(target=service._run, args=(release.wait,))
+        holder.start()
+        time.sleep(0.05)
+        with self.assertRaises(PasswordServiceBusy):
+            service.hash('secret')
+        release.set()
+        holder.join()
+        self.assertTrue(service.verify(service.hash('secret'), 'secret'))
+
+    # Test login throttles allow a burst per key and forget the least recently seen keys
+    def test_login_throttle(self):
+        throttle = LoginThrottle(rate=0.001, burst=2, max_keys=2)
+        self.assertEqual([throttle.allow('a') for _ in range(3)], [True, True, False])
+        self.assertTrue(throttle.allow('b'))
+        self.assertTrue(throttle.allow('c'))
+        self.assertTrue(throttle.allow('a'))
+
+    # Test a successful login upgrades a legacy sha256 hash once
+    def test_login_rehashes_legacy_password(self):
+        saved = password_service.workers
+        password_service.workers = 0
+        self.addCleanup(setattr, password_service, 'workers', saved)
+        self.addCleanup(login_user_throttle.clear)
+        self.addCleanup(login_ip_throttle.clear)
+        test_user = User(username='testuser', password=generate_password_hash('testpassword', method='sha256'),
+                         email='test@example.com')
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+
+        with app.test_request_context('/login', method='POST', data={'username': 'testuser', 'password': 'testpassword'}):
+            response = login()
+        self.assertEqual(response.status_code, 302)
+        pwhash = db.session.get(User, user_id).password
+        self.assertTrue(pwhash.startswith(password_service.method + '$'))
+
+        with app.test_request_context('/login', method='POST', data={'username': 'testuser', 'password': 'testpassword'}):
+            self.assertEqual(login().status_code, 302)
+        self.assertEqual(db.session.get(User, user_id).password, pwhash)
+
+    # Test the user loader serves repeat requests from its cache and drops users when they change
+    def test_user_loader_cache(self):
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+        db.session.add(UserStatistics(user_id=user_id, total_messages=3))
+        db.session.commit()
+        db.session.remove()
+
+        def load():
+            with app.test_request_context('/'):
+                user = load_user(str(user_id))
+                stats = get_message_statistics(user, windows=())
+                self.assertIn(user, db.session)
+                self.assertEqual((user.username, user.email, stats['total_messages']), ('testuser', 'test@example.com', 3))
+                return request_query_count()
+
+        self.assertEqual(load(), 1)
+        self.assertEqual(load(), 1)  # Cached user; the statistics row is the one round trip
+        self.assertEqual(user_cache.stats, {'hits': 1, 'misses': 1})
+
+        with app.test_request_context('/'):
+            user = load_user(str(user_id))
+            user.password = 'changed'  # Deferred column, loaded on access
+            db.session.commit()
+            self.assertIsNone(user_cache.get(user_id))
+
+        self.assertEqual(load(), 1)
+        with app.test_request_context('/'):
+            bump_history_version(load_user(str(user_id)))
+            db.session.rollback()
+            self.assertIsNotNone(user_cache.get(user_id))
+            user = load_user(str(user_id))
+            bump_history_version(user)
+            db.session.commit()
+            self.assertIsNone(user_cache.get(user_id))
+            self.assertEqual(load_user(str(user_id)).history_version, 1)
+
+            login_user(load_user(str(user_id)))
+            logout()
+            self.assertIsNone(user_cache.get(user_id))
+        self.assertIsNone(load_user('nope'))
+
+    # Test unchanged history polls cost one primary key lookup
+    def test_history_poll_query_count(self):
+        self.override_config(RECORD_QUERY_COUNTS=True)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+        self.add_messages(test_user, [datetime(2024, 2, 14, 12, 0, 0)])
+        with self.app.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+
+        response = self.app.get('/api/messages')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-DB-Queries'], '3')  # User (with statistics), the version and the page
+        response = self.app.get('/api/messages', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['X-DB-Queries'], '1')
+
+    # Test a history version bumped outside this process's user cache still changes the ETag
+    def test_history_etag_bypasses_user_cache(self):
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+        with self.app.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        etag = self.app.get('/api/messages').headers['ETag']
+
+        # As another process would: the row changes, but nothing here drops the cached user
+        db.session.execute(User.__table__.update().where(User.__table__.c.id == user_id)
+                           .values(history_version=User.__table__.c.history_version + 1))
+        db.session.commit()
+        self.assertEqual(user_cache.get(user_id)['history_version'], 0)
+
+        response = self.app.get('/api/messages', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    # Test /metrics reports route latency, request and query counts, and spans in Prometheus format
+    def test_metrics_endpoint(self):
+        metrics.clear()
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+        with self.app.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        self.app.get('/api/messages')
+        with span('test.block'):
+            time.sleep(0.01)
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.mimetype, 'text/plain')
+        body = response.get_data(as_text=True)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_requests_total{method="GET",route="/api/messages",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/api/messages",le="+Inf"} 1', body)
+        self.assertIn('db_queries_total{route="/api/messages"} 3', body)
+        self.assertIn('db_query_duration_seconds_count{route="/api/messages"} 1', body)
+        self.assertIn('span_duration_seconds_count{span="test.block"} 1', body)
+        self.assertIn('cache_requests_total{cache="user",result="misses"} 1', body)
+
+        self.override_config(METRICS_ENABLED=False)
+        self.assertEqual(self.app.get('/metrics').status_code, 404)
+
+    # Test a statement that raises leaves the query timing of the ones after it intact
+    def test_query_timer_failed_statement(self):
+        with app.test_request_context():
+            with self.assertRaises(OperationalError):
+                db.session.execute(db.text('SELECT * FROM no_such_table'))
+            db.session.rollback()
+            db.session.execute(db.text('SELECT 1'))
+            self.assertEqual(request_query_count(), 1)
+            self.assertLess(g.db_query_time, 1.0)
+
+    # Test the sampling profiler captures request stacks and keeps only the slowest profiles
+    def test_sampling_profiler(self):
+        directory = tempfile.mkdtemp()
+        profiler = SamplingProfiler(interval=0.001, keep=2, directory=directory)
+
+        def slow_part():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        profiler.begin()
+        slow_part()
+        samples = profiler.end()
+        path = profiler.record(0.05, 'GET /slow', samples, [('generate_romantic_message', 0.04)])
+        with open(path) as profile:
+            content = profile.read()
+        self.assertIn('# GET /slow 50.0ms', content)
+        self.assertIn('# span generate_romantic_message 40.0ms', content)
+        self.assertIn('slow_part', content)
+
+        self.assertIsNotNone(profiler.record(0.01, 'GET /fast', samples, []))
+        self.assertIsNone(profiler.record(0.001, 'GET /fastest', samples, []))
+        kept = profiler.record(0.2, 'GET /slowest', samples, [])
+        self.assertEqual(sorted(os.listdir(directory)), sorted([os.path.basename(path), os.path.basename(kept)]))
+
+    # Test the composer builds messages from the special moments, deterministically per seed
+    def test_message_composer(self):
+        composer = MessageComposer(MESSAGE_TEMPLATES, FALLBACK_QUOTES, cache_size=16)
+        moments = 'Our first date at the beach in Paris, dancing in the rain. Then the pizza when the car broke down!'
+        self.assertEqual(composer.analyze(moments), (
+            ('our first date at the beach in Paris', 'the pizza when the car broke down', 'dancing in the rain'), ('Paris',)))
+
+        messages = {composer.compose('Emma', moments, seed=seed) for seed in range(20)}
+        self.assertGreater(len(messages), 3)
+        for message in messages:
+            self.assertIn('Emma', message)
+            self.assertTrue(any(part in message for part in ('Paris', 'the pizza when', 'dancing in the rain')), message)
+        self.assertEqual(composer.compose('Emma', moments, seed=7), MessageComposer(
+            MESSAGE_TEMPLATES, FALLBACK_QUOTES, cache_size=16).compose('Emma', moments, seed=7))
+
+        plain = composer.compose('Emma', '  ', seed=1)
+        self.assertTrue(any(quote in plain for quote in FALLBACK_QUOTES), plain)
+        self.assertIn('Love is patient', composer.compose('Emma', '', seed=1, quote='Love is patient'))
+
+        hits = composer.stats['hits']
+        composer.compose('Emma', moments, seed=7)
+        self.assertEqual(composer.stats['hits'], hits + 1)
+
+    # Test generated messages use the special moments and vary between generations
+    def test_generate_uses_special_moments(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+
+        entries = [{"girlfriend_name": "Alice", "special_moments": "Stargazing in Joshua Tree"}] * 2
+        with app.test_request_context('/generate_messages/batch', method='POST', json=entries):
+            login_user(test_user)
+            results = generate_romantic_messages(entries)
+        for result in results:
+            self.assertTrue('Joshua Tree' in result['romantic_message'] or 'stargazing' in result['romantic_message'].lower(),
+                            result['romantic_message'])
+
+    # Test occurrences recur yearly, with Feb 29 on Feb 28 outside leap years
+    def test_next_occurrence(self):
+        self.assertEqual(next_occurrence(date(2020, 5, 15), 'yearly', date(2024, 5, 15)), date(2024, 5, 15))
+        self.assertEqual(next_occurrence(date(2020, 5, 15), 'yearly', date(2024, 5, 16)), date(2025, 5, 15))
+        self.assertEqual(next_occurrence(date(2020, 2, 29), 'yearly', date(2023, 1, 1)), date(2023, 2, 28))
+        self.assertEqual(next_occurrence(date(2020, 2, 29), 'yearly', date(2023, 3, 1)), date(2024, 2, 29))
+        self.assertEqual(next_occurrence(date(2030, 1, 1), 'yearly', date(2024, 1, 1)), date(2030, 1, 1))
+        self.assertEqual(next_occurrence(date(2024, 7, 1), 'once', date(2024, 6, 1)), date(2024, 7, 1))
+        self.assertIsNone(next_occurrence(date(2024, 7, 1), 'once', date(2024, 7, 2)))
+
+    # Test a tick fires due reminders once, with a message and an email each, and moves them on
+    def test_occasion_scheduler_tick(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False, OCCASION_REMIND_DAYS=1, OCCASION_BATCH_SIZE=2)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+        today = date(2024, 7, 21)
+        for name, occurs_on, recurrence in (('Birthday', date(1995, 7, 22), 'yearly'), ('Trip', date(2024, 7, 21), 'once'),
+                                            ('Anniversary', date(2020, 7, 20), 'yearly'), ('Concert', date(2024, 9, 1), 'once')):
+            db.session.add(Occasion(user_id=user_id, name=name, girlfriend_name='Alice', special_moments='Dancing in Lisbon',
+                                    occurs_on=occurs_on, recurrence=recurrence,
+                                    next_occurs_on=next_occurrence(occurs_on, recurrence, today - timedelta(days=1))))
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual(occasion_scheduler.tick(today), 2)
+            # Another process ticking the same day finds nothing left to fire
+            self.assertEqual(OccasionScheduler(app).tick(today), 0)
+
+        occasions = {occasion.name: occasion for occasion in Occasion.query.all()}
+        self.assertEqual(occasions['Birthday'].next_occurs_on, date(2025, 7, 22))
+        self.assertEqual(occasions['Birthday'].last_reminded_on, date(2024, 7, 22))
+        self.assertIsNone(occasions['Trip'].next_occurs_on)
+        # Missed while the scheduler was down: skipped, not sent late
+        self.assertEqual(occasions['Anniversary'].next_occurs_on, date(2025, 7, 20))
+        self.assertIsNone(occasions['Anniversary'].last_reminded_on)
+        self.assertEqual(occasions['Concert'].next_occurs_on, date(2024, 9, 1))
+
+        messages = Message.query.all()
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(all('Alice' in message.romantic_message for message in messages))
+        subjects = sorted(email.subject for email in OutboxEmail.query.all())
+        self.assertEqual(subjects, ["Reminder: Alice's Birthday", "Reminder: Alice's Trip"])
+        self.assertEqual(get_message_statistics(db.session.get(User, user_id))["total_messages"], 2)
+
+    # Test occasions can be added, listed soonest first and deleted
+    def test_special_occasions_api(self):
+        self.override_config(SPECIAL_MOMENTS_MAX_LENGTH=50)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+        today = datetime.utcnow().date()
+
+        created = []
+        for payload in ({"name": "Birthday", "girlfriend_name": "Alice", "date": (today - timedelta(days=400)).isoformat()},
+                        {"name": "Trip", "girlfriend_name": "Alice", "date": (today + timedelta(days=3)).isoformat(),
+                         "recurrence": "once"}):
+            with app.test_request_context('/special_occasions', method='POST', json=payload):
+                login_user(db.session.get(User, user_id))
+                response, status = special_occasions()
+            self.assertEqual(status, 201)
+            created.append(response.get_json())
+        self.assertGreaterEqual(date.fromisoformat(created[0]["date"]), today)
+
+        for payload in ({"name": "Trip", "girlfriend_name": "Alice", "date": "2000-01-01", "recurrence": "once"},
+                        {"name": "Trip", "girlfriend_name": "Alice", "date": "someday"},
+                        {"name": "", "girlfriend_name": "Alice", "date": "2030-01-01"},
+                        {"name": 5, "girlfriend_name": "Alice", "date": "2030-01-01"},
+                        {"name": "Trip", "girlfriend_name": [], "date": "2030-01-01"},
+                        {"name": "Trip", "girlfriend_name": "Alice", "date": "2030-01-01", "special_moments": "x" * 51},
+                        {"name": "Trip", "girlfriend_name": "Alice", "date": "2030-01-01", "recurrence": "daily"}):
+            with app.test_request_context('/special_occasions', method='POST', json=payload):
+                login_user(db.session.get(User, user_id))
+                response, status = special_occasions()
+            self.assertEqual(status, 400)
+
+        with app.test_request_context('/special_occasions', headers={'Accept': 'application/json'}):
+            login_user(db.session.get(User, user_id))
+            listed = special_occasions().get_json()["occasions"]
+            self.assertEqual([occasion["date"] for occasion in listed], sorted(occasion["date"] for occasion in created))
+            self.assertEqual(get_upcoming_occasions(), listed)
+
+        with app.test_request_context(f'/special_occasions/{created[1]["id"]}', method='DELETE'):
+            login_user(db.session.get(User, user_id))
+            self.assertEqual(delete_special_occasion(created[1]["id"])[1], 204)
+        self.assertEqual(Occasion.query.count(), 1)
+
+    # Test gifts are ranked by stored preferences, cached per user and refreshed on changes
+    def test_gift_recommender(self):
+        self.override_config(GIFT_RECOMMENDATIONS=3)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+        self.assertEqual([gift["name"] for gift in get_recommendations({"favorite_category": "Jewelry"})],
+                         ["Necklace", "Bracelet", "Earrings"])
+
+        catalog = [
+            {"sku": "ring", "name": "Ring", "category": "Jewelry", "color": "Gold", "price": 250, "popularity": 0.9},
+            {"sku": "pendant", "name": "Pendant", "category": "Jewelry", "color": "Blue", "attributes": "handmade", "price": 80},
+            {"sku": "scarf", "name": "Scarf", "category": "Clothing", "color": "Blue", "attributes": "handmade, warm"},
+            {"sku": "mug", "name": "Mug", "category": "Kitchen", "color": "White", "popularity": 0.5},
+        ]
+        self.assertEqual(load_gift_catalog(catalog), 4)
+        with self.assertRaises(ValueError):
+            load_gift_catalog([{"sku": "bad", "name": "Bad", "category": "Jewelry", "popularity": 2}])
+
+        with app.test_request_context('/gift_preferences', method='POST',
+                                      json={"categories": ["Jewelry"], "colors": "blue", "attributes": ["Handmade"]}):
+            login_user(db.session.get(User, user_id))
+            self.assertEqual(gift_preferences().get_json()["favorite_category"], "Jewelry")
+        with app.test_request_context('/recommended_gifts', headers={'Accept': 'application/json'}):
+            login_user(db.session.get(User, user_id))
+            gifts = recommended_gifts().get_json()["gifts"]
+            self.assertEqual([gift["name"] for gift in gifts], ["Pendant", "Ring", "Scarf"])
+            self.assertEqual(gift_recommender.for_user(db.session.get(User, user_id)), gifts)
+        self.assertEqual(gift_recommender.stats, {"hits": 1, "misses": 1})
+
+        # Saving preferences drops the cached result; changing the catalog outdates every result
+        save_user_preferences(db.session.get(User, user_id), {"categories": ["Kitchen"], "max_price": 100})
+        self.assertEqual([gift["name"] for gift in gift_recommender.for_user(db.session.get(User, user_id))],
+                         ["Mug", "Pendant", "Scarf"])
+        load_gift_catalog([dict(catalog[3], active=False)])
+        self.assertEqual([gift["name"] for gift in gift_recommender.for_user(db.session.get(User, user_id))],
+                         ["Pendant", "Scarf"])
+        self.assertEqual(gift_recommender.stats["misses"], 3)
+
+        with app.test_request_context('/gift_preferences', method='POST', json={"colors": "Blue", "max_price": "cheap"}):
+            login_user(db.session.get(User, user_id))
+            self.assertEqual(gift_preferences()[1], 400)
+
+    # Test a bad record partway through a catalog keeps the batches before it, and the index picks them up
+    def test_gift_catalog_bad_record(self):
+        self.override_config(GIFT_RECOMMENDATIONS=5)
+        gift_recommender.check_interval = 3600
+        self.addCleanup(setattr, gift_recommender, 'check_interval', app.config['GIFT_CATALOG_CHECK_INTERVAL'])
+        gift_recommender.index()  # Built from the empty catalog
+
+        catalog = [
+            {"sku": "ring", "name": "Ring", "category": "Jewelry", "popularity": 0.9},
+            {"sku": "pendant", "name": "Pendant", "category": "Jewelry"},
+            {"sku": "bad", "name": "Bad", "category": "Jewelry", "price": -1},
+            {"sku": "bracelet", "name": "Bracelet", "category": "Jewelry"},
+        ]
+        with self.assertRaises(ValueError):
+            load_gift_catalog(catalog, batch_size=2)
+        self.assertEqual(GiftItem.query.count(), 2)
+        self.assertEqual([gift["name"] for gift in gift_recommender.recommend({"categories": ["Jewelry"]})],
+                         ["Ring", "Pendant"])
+
+    # Test message requests with wrongly typed or oversized fields are rejected with a 400
+    def test_generate_message_validation(self):
+        self.override_config(OUTBOX_WORKER_ENABLED=False, SPECIAL_MOMENTS_MAX_LENGTH=50)
+        test_user = self.create_test_user()
+        db.session.add(test_user)
+        db.session.commit()
+        user_id = test_user.id
+
+        for payload in ({"girlfriend_name": 5}, {"girlfriend_name": "Alice", "special_moments": ["Paris"]},
+                        {"girlfriend_name": "Alice", "special_moments": "x" * 51}, ["Alice"]):
+            with app.test_request_context('/generate_message', method='POST', json=payload):
+                login_user(db.session.get(User, user_id))
+                response, status = ajax_generate_message()
+            self.assertEqual(status, 400, payload)
+        with app.test_request_context('/generate_messages/batch', method='POST',
+                                      json=[{"girlfriend_name": "Alice"}, {"girlfriend_name": "Beth", "special_moments": 7}]):
+            login_user(db.session.get(User, user_id))
+            response, status = ajax_generate_messages_batch()
+        self.assertEqual(status, 400)
+        self.assertEqual(Message.query.count(), 0)
+
+        composer = MessageComposer(MESSAGE_TEMPLATES, FALLBACK_QUOTES, cache_size=16)
+        self.assertIn('42', composer.compose(42, None, seed=1))
+
 if __name__ == '__main__':
     unittest.main()